@@ -0,0 +1,65 @@
+"""Compares analyse_game_string() against the regex based implementation it
+replaced on synthetic game strings of 10k - 1M hands.
+
+    python -m benchmarks.bench_analysis [--max 1000000]
+"""
+from __future__ import print_function
+
+import argparse
+import re
+import timeit
+
+from frisbee import analyse_game_string
+from benchmarks.synth import game_string
+
+def legacy_analyse_game_string(gs):
+    """The original two pass, regex based analysis"""
+    passSeq = gs.split("\n")
+    players = []
+    act = re.compile("\*|\(P\)|\(F\)|\(S\)")
+    for seq in passSeq:
+        hands = [act.sub('',s) for s in seq.split("-")]
+        for hand in hands:
+            if not hand in players and hand:
+                players.append(hand)
+    playerCreds = []
+    for i in range(len(players)):
+        playerCreds.append(dict(zip(["catch", "drop", "throw", "snatch", "foul"], [0,0,0,0,0])))
+    for seq in passSeq:
+        hands = seq.split('-')
+        for i,hand in enumerate(hands):
+            if re.search('\(S\)', hand):
+                playerCreds[players.index(act.sub('', hand))]["snatch"] += 1
+            elif i!=0:
+                playerCreds[players.index(act.sub('', hand))]["catch"] += 1
+            if re.search('\*', hand):
+                playerCreds[players.index(act.sub('', hand))]["drop"] += 1
+            elif re.search('\(F\)', hand):
+                playerCreds[players.index(act.sub('', hand))]["foul"] += 1
+            elif not re.search('\(P\)', hand) and hand:
+                playerCreds[players.index(act.sub('', hand))]["throw"] += 1
+    return dict(zip(players, playerCreds))
+
+def best_of(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number=1, repeat=repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max", type=int, default=1000000,
+            help="largest number of hands to generate")
+    parser.add_argument("--players", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("%10s %12s %12s %8s" % ("hands", "legacy (s)", "new (s)", "speedup"))
+    hands = 10000
+    while hands <= args.max:
+        gs = game_string(hands, players=args.players)
+        assert analyse_game_string(gs) == legacy_analyse_game_string(gs)
+        old = best_of(legacy_analyse_game_string, gs, args.repeat)
+        new = best_of(analyse_game_string, gs, args.repeat)
+        print("%10d %12.4f %12.4f %7.1fx" % (hands, old, new, old / new))
+        hands *= 10
+
+if __name__ == "__main__":
+    main()
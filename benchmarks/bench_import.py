@@ -0,0 +1,57 @@
+"""Compares importing game sheets one file at a time with import_game_data()
+against the bulk import_games() on synthetic sheets.
+
+    python -m benchmarks.bench_import [--sheets 3000]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from frisbee import import_game_data, import_games
+from gamedb import createdb, open_db, add_team, commit_data, close_db
+from benchmarks.synth import write_sheets, team_names
+
+def fresh_db(path, teams):
+    createdb(path)
+    conn = open_db(path)
+    for name in team_names(teams):
+        add_team(conn, name)
+    commit_data(conn)
+    return conn
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sheets", type=int, default=3000)
+    parser.add_argument("--teams", type=int, default=16)
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        paths = write_sheets(tmp, args.sheets, teams=args.teams)
+
+        db = os.path.join(tmp, "per_file.db")
+        close_db(fresh_db(db, args.teams))
+        start = time.time()
+        for path in paths:
+            import_game_data(path, db)
+        per_file = time.time() - start
+
+        conn = fresh_db(os.path.join(tmp, "bulk.db"), args.teams)
+        start = time.time()
+        import_games(conn, paths, args.processes)
+        bulk = time.time() - start
+        close_db(conn)
+    finally:
+        shutil.rmtree(tmp)
+
+    print("%d sheets" % args.sheets)
+    print("per file : %8.3f s" % per_file)
+    print("bulk     : %8.3f s  (%.1fx)" % (bulk, per_file / bulk))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Times the gamedb lookups on a version 0 db (no indexes, LIKE on team
+names) against a fully migrated one, for tables of 10^3 - 10^6 rows.
+
+    python -m benchmarks.bench_queries [--max 1000000]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+import gamedb
+from gamedb import createdb, open_db, close_db, fold_name
+from benchmarks.synth import player_codes
+
+# The lookups as they were run before the migrations
+LEGACY = {
+    "team_id": "SELECT id FROM teams WHERE name LIKE ?",
+    "player_count": "SELECT id FROM players WHERE team_id=?",
+    "player_fullname": "SELECT name FROM players WHERE p_code=?",
+    "game_string": "SELECT pass_string, team_id FROM passes WHERE game_id=?",
+}
+
+def fill(conn, rows, migrated):
+    """Inserts `rows` teams, players and passes"""
+    names = ["Team %d" % i for i in range(rows)]
+    if migrated:
+        conn.executemany("""INSERT INTO teams (name, g_played, g_won, g_lost,
+                g_drawn, p_for, p_against, name_key)
+                VALUES (?, 0, 0, 0, 0, 0, 0, ?)""",
+                ((n, fold_name(n)) for n in names))
+    else:
+        conn.executemany("INSERT INTO teams VALUES (NULL, ?, 0, 0, 0, 0, 0, 0)",
+                ((n,) for n in names))
+    codes = player_codes(rows)
+    conn.executemany("INSERT INTO players VALUES (NULL, ?, ?, ?, 0, 0, 0, 0, 0)",
+            ((c, c, i % (rows // 10 + 1)) for i, c in enumerate(codes)))
+    conn.executemany("INSERT INTO passes VALUES (NULL, 'AAA-BBB*', ?, ?)",
+            ((i // 2, i % 2) for i in range(rows)))
+    conn.commit()
+    return names, codes
+
+def measure(conn, names, codes, rows, migrated, number):
+    rng = random.Random(0)
+    cases = {
+        "team_id": lambda: rng.choice(names).upper(),
+        "player_count": lambda: rng.randrange(rows // 10 + 1),
+        "player_fullname": lambda: rng.choice(codes),
+        "game_string": lambda: rng.randrange(rows // 2),
+    }
+    result = {}
+    for name, arg in sorted(cases.items()):
+        if migrated:
+            func = getattr(gamedb, name)
+            run = lambda: func(conn, arg())
+        else:
+            sql = LEGACY[name]
+            run = lambda: conn.execute(sql, (arg(),)).fetchall()
+        result[name] = min(timeit.repeat(run, number=number, repeat=3)) / number
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max", type=int, default=1000000)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print("%8s %16s %14s %14s" % ("rows", "lookup", "before (us)", "after (us)"))
+        rows = 1000
+        while rows <= args.max:
+            timings = []
+            for migrated in (False, True):
+                path = os.path.join(tmp, "%d_%d.db" % (rows, migrated))
+                createdb(path, version=None if migrated else 0)
+                conn = open_db(path)
+                names, codes = fill(conn, rows, migrated)
+                timings.append(measure(conn, names, codes, rows, migrated,
+                    args.number))
+                close_db(conn)
+            for name in sorted(timings[0]):
+                print("%8d %16s %14.1f %14.1f" % (rows, name,
+                    timings[0][name] * 1e6, timings[1][name] * 1e6))
+            rows *= 10
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
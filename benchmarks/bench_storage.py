@@ -0,0 +1,63 @@
+"""Compares the pass strings stored as text against the passcodec blobs:
+the size of the db and the time to read all the passes back as events and
+as text.
+
+    python -m benchmarks.bench_storage [--games 10000]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from events import events_from_db
+from gamedb import createdb, open_db, close_db, pass_value, pass_text
+from benchmarks.synth import game_string
+
+def fill(path, strings, encode):
+    createdb(path)
+    conn = open_db(path)
+    conn.executemany("INSERT INTO passes VALUES (NULL, ?, ?, ?)",
+            ((pass_value(s) if encode else s, i // 2, i % 2)
+                for i, s in enumerate(strings)))
+    conn.commit()
+    conn.execute("VACUUM")
+    return conn
+
+def read_text(conn):
+    return [pass_text(v) for (v,) in conn.execute("SELECT pass_string FROM passes")]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--hands", type=int, default=60,
+            help="hands per team and game")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    strings = [game_string(args.hands, seed=i) for i in range(args.games * 2)]
+    tmp = tempfile.mkdtemp()
+    try:
+        print("%-6s %12s %12s %12s" % ("", "size (kB)", "events (s)", "text (s)"))
+        results = {}
+        for name, encode in (("text", False), ("blob", True)):
+            path = os.path.join(tmp, name + ".db")
+            conn = fill(path, strings, encode)
+            size = os.path.getsize(path) / 1024.0
+            events = min(timeit.repeat(lambda: events_from_db(conn),
+                number=1, repeat=args.repeat))
+            text = min(timeit.repeat(lambda: read_text(conn),
+                number=1, repeat=args.repeat))
+            assert read_text(conn) == strings
+            close_db(conn)
+            results[name] = (size, events, text)
+            print("%-6s %12.0f %12.4f %12.4f" % ((name,) + results[name]))
+        print("%-6s %11.1fx %11.1fx %11.1fx" % (("ratio",) + tuple(
+            t / b for t, b in zip(results["text"], results["blob"]))))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
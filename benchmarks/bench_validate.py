@@ -0,0 +1,67 @@
+"""Compares the validating lexer against regular expression validators on
+synthetic game sheets: a whole line match that can only accept or reject a
+line, and a tokenizer that reports the column of every error like the
+lexer does.
+
+    python -m benchmarks.bench_validate [--max 100000]
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import re
+import timeit
+
+from validate import validate_lines
+from benchmarks.synth import game_sheet, team_names
+
+HAND = r"[A-Z0-9]+(?:\(S\))?(?:\*|\(F\)|\(P\))?(?:\(S\))?"
+LINE = re.compile(r"^%s(?:-%s)*$" % (HAND, HAND))
+TOKEN = re.compile(r"(?P<code>[A-Z0-9]+)|(?P<marker>\*|\([FSP]\))|(?P<sep>-)|(?P<bad>.)")
+TEAM_LINE = re.compile(r"^(?P<team>.+):\s+(?P<name>.+)$")
+
+def regex_match(lines):
+    """Number of the lines failing a whole line match"""
+    bad = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if line and not TEAM_LINE.match(line) and not LINE.match(line):
+            bad += 1
+    return bad
+
+def regex_tokens(lines):
+    """Columns of the unexpected characters found by a regex tokenizer"""
+    bad = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if line and not TEAM_LINE.match(line):
+            bad.extend(m.start() + 1 for m in TOKEN.finditer(line)
+                    if m.lastgroup == "bad")
+    return bad
+
+def best_of(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number=1, repeat=repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max", type=int, default=100000,
+            help="largest number of possessions to generate")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("%10s %12s %12s %12s" % ("possessions", "match (s)", "tokens (s)",
+        "lexer (s)"))
+    teams = team_names(2)
+    size = 1000
+    while size <= args.max:
+        sheet = game_sheet(random.Random(0), teams[0], teams[1], size // 2)
+        lines = sheet.splitlines(True)
+        assert not validate_lines(lines) and not regex_match(lines)
+        print("%10d %12.4f %12.4f %12.4f" % (size,
+            best_of(regex_match, lines, args.repeat),
+            best_of(regex_tokens, lines, args.repeat),
+            best_of(validate_lines, lines, args.repeat)))
+        size *= 10
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Load test of the HTTP stats service (Python 3).
+
+    python -m benchmarks.load_test [--db frisbee.db] [--clients 32]
+                                   [--requests 200]
+
+Starts server.py in a subprocess, on a synthetic db unless one is given,
+then lets every client thread send its requests over one keep alive
+connection. Reports the p50/p99 latency and the throughput.
+"""
+import argparse
+import http.client
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import frisbee
+import gamedb
+from benchmarks import synth
+
+def synthetic_db(tmp, sheets, teams):
+    path = os.path.join(tmp, "load.db")
+    gamedb.createdb(path)
+    conn = gamedb.open_db(path)
+    for name in synth.team_names(teams):
+        gamedb.add_team(conn, name)
+    conn.commit()
+    directory = os.path.join(tmp, "sheets")
+    os.mkdir(directory)
+    frisbee.import_games(conn, synth.write_sheets(directory, sheets, teams))
+    conn.close()
+    return path
+
+def paths(conn, rng, count):
+    """Returns a mix of request paths over the existing rows"""
+    teams = [r[0] for r in conn.execute("SELECT id FROM teams")]
+    players = [r[0] for r in conn.execute("SELECT id FROM players")]
+    games = [r[0] for r in conn.execute("SELECT id FROM games")]
+    choices = [lambda: "/teams",
+            lambda: "/teams/%d" % rng.choice(teams),
+            lambda: "/players/%d" % rng.choice(players),
+            lambda: "/games/%d/passes" % rng.choice(games),
+            lambda: "/games/%d/analysis" % rng.choice(games)]
+    return [rng.choice(choices)() for _ in range(count)]
+
+def wait_for(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/teams")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server didn't start")
+
+def client(port, requests, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for path in requests:
+        start = time.perf_counter()
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(path)
+    conn.close()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="db to serve (default: synthetic)")
+    parser.add_argument("--sheets", type=int, default=500)
+    parser.add_argument("--teams", type=int, default=16)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=200,
+            help="requests per client")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    server = None
+    try:
+        db = args.db or synthetic_db(tmp, args.sheets, args.teams)
+        server = subprocess.Popen([sys.executable, "server.py", "--db", db,
+            "--host", "127.0.0.1", "--port", str(args.port),
+            "--workers", str(args.workers)], stdout=subprocess.DEVNULL)
+        wait_for(args.port)
+
+        rng = random.Random(0)
+        conn = gamedb.open_db(db)
+        work = [paths(conn, rng, args.requests) for _ in range(args.clients)]
+        conn.close()
+
+        latencies, errors = [], []
+        threads = [threading.Thread(target=client,
+            args=(args.port, requests, latencies, errors)) for requests in work]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(tmp)
+
+    print("requests   : %d (%d errors)" % (len(latencies), len(errors)))
+    print("throughput : %.0f req/s" % (len(latencies) / elapsed))
+    print("p50        : %.2f ms" % (percentile(latencies, 50) * 1000))
+    print("p99        : %.2f ms" % (percentile(latencies, 99) * 1000))
+
+if __name__ == "__main__":
+    main()
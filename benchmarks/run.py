@@ -0,0 +1,205 @@
+"""Benchmark suite timing the parser, analysis and db stages on synthetic
+game sheets of growing size.
+
+    python -m benchmarks.run [--sizes 100,1000,10000] [--output results.json]
+                             [--compare baseline.json]
+                             [--profile STAGE] [--tracemalloc STAGE]
+
+Each stage is timed for every size, the size being the number of game
+sheets (or possessions for the string stages). Results are written as JSON
+and can be compared against an earlier run. With --profile a cProfile report
+of the chosen stage at the largest size is written next to the results,
+and --tracemalloc does the same for allocations (Python 3 only).
+"""
+from __future__ import print_function
+
+import argparse
+import cProfile
+import json
+import os
+import platform
+import pstats
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import chains
+import frisbee
+import gamedb
+import validate
+from benchmarks import synth
+
+def _fresh_db(tmp, name, teams):
+    path = os.path.join(tmp, name)
+    gamedb.createdb(path)
+    conn = gamedb.open_db(path)
+    for team in teams:
+        gamedb.add_team(conn, team)
+    conn.commit()
+    return conn
+
+class Workload:
+    """The synthetic data of one size, shared by the stages"""
+    def __init__(self, tmp, size, args):
+        rates = dict(length=args.length, drop=args.drop, foul=args.foul,
+                snatch=args.snatch)
+        self.size = size
+        self.tmp = tmp
+        self.teams = synth.team_names(args.teams)
+        self.string = synth.game_string(size * args.length,
+                players=args.players, **rates)
+        directory = os.path.join(tmp, "sheets_%d" % size)
+        os.mkdir(directory)
+        self.sheets = synth.write_sheets(directory, size, teams=args.teams,
+                players=args.players, **rates)
+        self.conn = _fresh_db(tmp, "lookup_%d.db" % size, self.teams)
+        frisbee.import_games(self.conn, self.sheets, processes=1)
+
+    def close(self):
+        self.conn.close()
+
+def stage_parse_gamefile(w):
+    for sheet in w.sheets:
+        frisbee.parse_gamefile(sheet)
+
+def stage_validate_sheets(w):
+    validate.validate_sheets(w.sheets, processes=1)
+
+def stage_analyse_game_string(w):
+    frisbee.analyse_game_string(w.string)
+
+def stage_get_points(w):
+    frisbee.get_points(w.string)
+
+def stage_import_games(w):
+    conn = _fresh_db(w.tmp, "import_%d_%f.db" % (w.size, time.time()), w.teams)
+    frisbee.import_games(conn, w.sheets, processes=1)
+    conn.close()
+
+def stage_team_id(w):
+    rng = random.Random(0)
+    for _ in range(w.size):
+        gamedb.team_id(w.conn, rng.choice(w.teams))
+
+def stage_game_string(w):
+    for gid in range(1, w.size + 1):
+        gamedb.game_string(w.conn, gid)
+
+def stage_player_stats(w):
+    c = w.conn.execute("SELECT id FROM players")
+    for (pid,) in c.fetchall():
+        gamedb.player_stats(w.conn, pid)
+
+def stage_chain_outcomes(w):
+    c = w.conn.execute("SELECT chain FROM chains WHERE length = 3 LIMIT ?",
+            (w.size,))
+    for (chain,) in c.fetchall():
+        chains.chain_outcomes(w.conn, chain)
+
+def stage_standings(w):
+    gamedb.invalidate_standings()
+    gamedb.standings(w.conn)
+
+STAGES = [(name[len("stage_"):], func) for name, func in sorted(globals().items())
+        if name.startswith("stage_")]
+
+def best_time(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def profile_stage(func, w, path):
+    profiler = cProfile.Profile()
+    profiler.runcall(func, w)
+    with open(path, "w") as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats("cumulative").print_stats(40)
+    print("Wrote %s" % path)
+
+def tracemalloc_stage(func, w, path):
+    try:
+        import tracemalloc
+    except ImportError:
+        print("tracemalloc needs Python 3, skipped", file=sys.stderr)
+        return
+    tracemalloc.start(10)
+    func(w)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    with open(path, "w") as f:
+        for stat in snapshot.statistics("lineno")[:40]:
+            f.write("%s\n" % stat)
+    print("Wrote %s" % path)
+
+def compare(results, baseline):
+    """Prints the ratio of every timing to the same one in the baseline"""
+    old = dict(((r["stage"], r["size"]), r["seconds"]) for r in baseline["results"])
+    print("\n%-20s %8s %10s" % ("stage", "size", "vs base"))
+    for r in results:
+        base = old.get((r["stage"], r["size"]))
+        if base:
+            print("%-20s %8d %9.2fx" % (r["stage"], r["size"], r["seconds"] / base))
+
+def main():
+    names = [name for name, _ in STAGES]
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000",
+            help="comma separated numbers of game sheets")
+    parser.add_argument("--stages", default=",".join(names))
+    parser.add_argument("--teams", type=int, default=16)
+    parser.add_argument("--players", type=int, default=7)
+    parser.add_argument("--length", type=float, default=4,
+            help="mean number of hands per possession")
+    parser.add_argument("--drop", type=float, default=0.6)
+    parser.add_argument("--foul", type=float, default=0.05)
+    parser.add_argument("--snatch", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE")
+    parser.add_argument("--profile", choices=names, metavar="STAGE")
+    parser.add_argument("--tracemalloc", choices=names, metavar="STAGE")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    stages = [(n, f) for n, f in STAGES if n in args.stages.split(",")]
+    results = []
+    tmp = tempfile.mkdtemp()
+    try:
+        print("%-20s %8s %12s %14s" % ("stage", "size", "seconds", "us / item"))
+        for size in sizes:
+            w = Workload(tmp, size, args)
+            for name, func in stages:
+                seconds = best_time(func, w, args.repeat)
+                results.append({"stage": name, "size": size, "seconds": seconds})
+                print("%-20s %8d %12.4f %14.2f" % (name, size, seconds,
+                    seconds / size * 1e6))
+            if size == max(sizes):
+                base = os.path.splitext(args.output)[0]
+                funcs = dict(STAGES)
+                if args.profile:
+                    profile_stage(funcs[args.profile], w,
+                            "%s.%s.prof.txt" % (base, args.profile))
+                if args.tracemalloc:
+                    tracemalloc_stage(funcs[args.tracemalloc], w,
+                            "%s.%s.malloc.txt" % (base, args.tracemalloc))
+            w.close()
+    finally:
+        shutil.rmtree(tmp)
+
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+            "params": vars(args), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Wrote %s" % args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Synthetic game data following the notation of THEORY.md"""
+import os.path
+import random
+
+def player_codes(count, prefix=""):
+    """Returns `count` distinct 3 letter player codes"""
+    codes = []
+    for i in range(count):
+        code = ""
+        for _ in range(3):
+            code = chr(ord("A") + i % 26) + code
+            i //= 26
+        codes.append(prefix + code)
+    return codes
+
+def possession(rng, players, length=4, drop=0.6, foul=0.05, snatch=0.1):
+    """Returns a single possession line like 'ABC(S)-DEF-GHI*'"""
+    hands = []
+    count = max(1, int(rng.expovariate(1.0 / length)))
+    last = None
+    for i in range(count):
+        code = rng.choice(players)
+        while code == last and len(players) > 1:
+            code = rng.choice(players)
+        last = code
+        if i == 0 and rng.random() < snatch:
+            code += "(S)"
+        hands.append(code)
+    roll = rng.random()
+    if roll < drop:
+        hands[-1] += "*"
+    elif roll < drop + foul:
+        hands[-1] += "(F)"
+    else:
+        hands[-1] += "(P)"
+    return "-".join(hands)
+
+def game_string(hands, players=7, seed=0, **rates):
+    """Returns a game string with roughly `hands` hands in total"""
+    rng = random.Random(seed)
+    codes = player_codes(players)
+    lines = []
+    total = 0
+    while total < hands:
+        line = possession(rng, codes, **rates)
+        total += line.count("-") + 1
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def game_sheet(rng, team1, team2, possessions=12, players=7, **rates):
+    """Returns the text of a game sheet between two teams"""
+    blocks = []
+    for label, team in (("TEAM1", team1), ("TEAM2", team2)):
+        codes = player_codes(players)
+        lines = [possession(rng, codes, **rates) for _ in range(possessions)]
+        blocks.append("%s: %s\n%s\n" % (label, team, "\n".join(lines)))
+    return "\n".join(blocks) + "\n"
+
+def team_names(count):
+    """Returns `count` distinct team names"""
+    return ["TEAM %s" % code for code in player_codes(count)]
+
+def write_sheets(directory, count, teams=16, seed=0, **kwargs):
+    """Writes `count` game sheets into the directory and returns their paths"""
+    rng = random.Random(seed)
+    names = team_names(teams)
+    paths = []
+    for i in range(count):
+        team1, team2 = rng.sample(names, 2)
+        path = os.path.join(directory, "game_%06d.txt" % i)
+        with open(path, "w") as f:
+            f.write(game_sheet(rng, team1, team2, **kwargs))
+        paths.append(path)
+    return paths
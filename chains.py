@@ -0,0 +1,106 @@
+"""
+Index of the pass chains (n-grams of hands) of every possession.
+
+A chain is a run of 2 to MAX_LENGTH consecutive hands of a possession,
+written like the pass strings, e.g. 'MAG-SAM-BHA'. Its outcome is what
+happened at its last hand: a drop, a foul, a point or nothing. The counts
+per (chain, outcome, team) are kept in the chains table, which gamedb
+updates whenever pass strings are added. Pattern queries are then index
+lookups rather than scans of all the pass strings.
+"""
+from frisbee import DROP, FOUL, POINT, tokenize_hand
+
+MAX_LENGTH = 4
+OUTCOMES = {0: "none", DROP: "drop", FOUL: "foul", POINT: "point"}
+OUTCOME_FLAGS = dict((name, flag) for flag, name in OUTCOMES.items())
+
+def outcome(flags):
+    """Returns the outcome flag of a hand, counted as analyse_game_string
+    does when a hand has more than one marker"""
+    if flags & DROP:
+        return DROP
+    if flags & FOUL:
+        return FOUL
+    return flags & POINT
+
+def iter_chains(pass_string, max_length=MAX_LENGTH):
+    """Yields (chain, length, outcome) of every chain in the pass string"""
+    for seq in pass_string.split("\n"):
+        hands = [tokenize_hand(hand) for hand in seq.split("-")]
+        hands = [(code, flags) for code, flags in hands if code]
+        codes = [code for code, _ in hands]
+        for end in range(1, len(hands)):
+            result = outcome(hands[end][1])
+            for n in range(2, min(max_length, end + 1) + 1):
+                yield "-".join(codes[end - n + 1:end + 1]), n, result
+
+def chain_counts(passes, max_length=MAX_LENGTH):
+    """Counts the chains of many Passes. Returns a dict mapping
+    (chain, outcome, team_id) to [length, count]."""
+    counts = {}
+    for p in passes:
+        for chain, n, result in iter_chains(p.string, max_length):
+            key = (chain, result, p.team_id)
+            if key in counts:
+                counts[key][1] += 1
+            else:
+                counts[key] = [n, 1]
+    return counts
+
+def chain_outcomes(conn, chain, team_id=None):
+    """Returns how often a chain like 'MAG-SAM-BHA' ended in each outcome,
+    as a dict with a count per outcome name and the total"""
+    sql = "SELECT outcome, SUM(count) FROM chains WHERE chain = ?"
+    args = [chain]
+    if team_id is not None:
+        sql += " AND team_id = ?"
+        args.append(team_id)
+    c = conn.cursor()
+    c.execute(sql + " GROUP BY outcome", args)
+    result = dict.fromkeys(OUTCOME_FLAGS, 0)
+    for flag, count in c.fetchall():
+        result[OUTCOMES[flag]] = count
+    result["total"] = sum(result.values())
+    return result
+
+def top_chains(conn, length, outcome="point", k=10):
+    """Returns the k chains of `length` hands that most often ended in the
+    outcome ('point', 'drop', 'foul' or 'none') as (chain, team_id, count)"""
+    c = conn.cursor()
+    c.execute("""SELECT chain, team_id, count FROM chains
+            WHERE length = ? AND outcome = ?
+            ORDER BY count DESC, chain, team_id LIMIT ?""",
+            (length, OUTCOME_FLAGS[outcome], k))
+    return c.fetchall()
+
+def rebuild_chains(conn):
+    """Recomputes the chains table from the stored pass strings"""
+    from frisbee import Passes, pass_text
+    c = conn.cursor()
+    c.execute("SELECT pass_string, game_id, team_id FROM passes")
+    counts = chain_counts(Passes(pass_text(pstr), gid, tid)
+            for pstr, gid, tid in c.fetchall())
+    conn.execute("DELETE FROM chains")
+    _add_counts(conn, counts)
+
+def _add_counts(conn, counts):
+    conn.executemany("""INSERT INTO chains (chain, outcome, team_id, length,
+            count) VALUES (?, ?, ?, ?, ?) ON CONFLICT(chain, outcome, team_id)
+            DO UPDATE SET count = count + excluded.count""",
+            [key + tuple(value) for key, value in counts.items()])
+
+def remove_counts(conn, counts):
+    """Takes counts returned by chain_counts() back out of the chains table"""
+    conn.executemany("""UPDATE chains SET count = count - ?
+            WHERE chain = ? AND outcome = ? AND team_id = ?""",
+            [(value[1],) + key for key, value in counts.items()])
+    conn.executemany("""DELETE FROM chains WHERE chain = ? AND outcome = ?
+            AND team_id = ? AND count <= 0""", list(counts))
+
+def index_pass_strings(conn, passes, sign=1):
+    """Adds the chains of newly stored Passes to the chains table, or takes
+    those of deleted ones out with a negative sign"""
+    if sign < 0:
+        remove_counts(conn, chain_counts(passes))
+    else:
+        _add_counts(conn, chain_counts(passes))
@@ -0,0 +1,105 @@
+"""
+The pass economy of THEORY.md computed on NumPy arrays.
+
+The analysis of a pass string (see frisbee.analyse_game_string) is turned
+into a players x credits matrix of counts. Multiplying it with the credit
+weights gives each player's work, and scaling the work by the team's
+effectiveness x = points / sum of work gives the offence contribution.
+"""
+from __future__ import division
+
+import numpy as np
+
+from frisbee import CREDITS, analyse_game_string, get_points
+from gamedb import iter_passes
+
+# Work done per credit. A drop is counted together with the catch before it,
+# so a dropped catch nets 1/3 - 2/3 = -1/3 and a blind throw -2/3.
+WEIGHTS = {"catch": 1/3, "drop": -2/3, "throw": 2/3, "snatch": 1, "foul": 0}
+
+def weight_vector(weights=None):
+    """Returns the weights as an array in the order of CREDITS"""
+    weights = weights or WEIGHTS
+    return np.array([weights[key] for key in CREDITS], dtype=float)
+
+def counts_matrix(creds, codes=None):
+    """Returns (codes, counts) where counts is an int array with a row per
+    player code and a column per credit in the order of CREDITS"""
+    if codes is None:
+        codes = sorted(creds)
+    counts = np.array([[creds[code][key] for key in CREDITS] for code in codes],
+            dtype=np.int64).reshape(len(codes), len(CREDITS))
+    return codes, counts
+
+def work(counts, weights=None):
+    """Returns the work of every row of a counts matrix"""
+    return counts.dot(weight_vector(weights))
+
+def effectiveness(points, work):
+    """Returns x = points / sum of work, or 0 when no work was done"""
+    total = work.sum()
+    return points / total if total else 0.0
+
+def contribution(creds, points, weights=None):
+    """Returns (codes, work, contribution) arrays for one team's game"""
+    codes, counts = counts_matrix(creds)
+    w = work(counts, weights)
+    return codes, w, w * effectiveness(points, w)
+
+class Season:
+    """
+    Work and contribution of every player over many games. Each team's
+    game is added as a block of rows. The per game effectiveness and the
+    per player totals are then computed over all the rows at once.
+    """
+    def __init__(self, weights=None):
+        self.weights = weight_vector(weights)
+        self.keys = []          # (team_id, code) of every player
+        self._index = {}
+        self._players = []      # player index of every row
+        self._games = []        # team-game index of every row
+        self._counts = []
+        self.points = []        # points of every team-game
+
+    def add(self, team_id, creds, points):
+        """Adds the analysis and points of one team in one game"""
+        game = len(self.points)
+        self.points.append(points)
+        for code, cred in creds.items():
+            key = (team_id, code)
+            if key not in self._index:
+                self._index[key] = len(self.keys)
+                self.keys.append(key)
+            self._players.append(self._index[key])
+            self._games.append(game)
+            self._counts.append([cred[k] for k in CREDITS])
+
+    def add_pass_string(self, team_id, pass_string):
+        """Adds a team's pass string of one game"""
+        self.add(team_id, analyse_game_string(pass_string),
+                get_points(pass_string))
+
+    def totals(self):
+        """Returns (keys, work, contribution) with the season totals of every
+        player in keys"""
+        counts = np.array(self._counts, dtype=np.int64).reshape(-1, len(CREDITS))
+        games = np.array(self._games, dtype=np.intp)
+        players = np.array(self._players, dtype=np.intp)
+        points = np.array(self.points, dtype=float)
+
+        w = counts.dot(self.weights)
+        game_work = np.bincount(games, weights=w, minlength=len(points))
+        x = np.zeros_like(points)
+        np.divide(points, game_work, out=x, where=game_work != 0)
+        contrib = w * x[games]
+
+        n = len(self.keys)
+        return (self.keys, np.bincount(players, weights=w, minlength=n),
+                np.bincount(players, weights=contrib, minlength=n))
+
+def season_from_db(conn, weights=None):
+    """Builds a Season out of all the pass strings stored in the db"""
+    season = Season(weights)
+    for tid, pstr in iter_passes(conn):
+        season.add_pass_string(tid, pstr)
+    return season
@@ -0,0 +1,260 @@
+"""
+Columnar store of pass events.
+
+Every hand of a pass string becomes one event row: the game, the team, the
+possession it belongs to, the thrower, the receiver of the pass (-1 when the
+possession ends with the hand) and the flags of the hand. Player codes are
+interned into small ints, indexing EventTable.codes. Tables are saved as a
+single binary file whose columns can be memory mapped back without parsing.
+"""
+import array
+import json
+import struct
+
+import numpy as np
+
+from frisbee import DROP, FOUL, SNATCH, POINT, CREDITS, tokenize_hand
+import passcodec
+
+# Flag of the hand at the start of a possession line, which is thrown
+# without a catch, next to the marker flags
+START = 16
+
+COLUMNS = (("game", "<i4"), ("team", "<i4"), ("possession", "<i4"),
+        ("thrower", "<i4"), ("receiver", "<i4"), ("flags", "u1"))
+MAGIC = b"FRBEVT01"
+ALIGN = 8
+
+class EventTable:
+    """The event columns as NumPy arrays and the interned player codes"""
+    def __init__(self, codes, columns):
+        self.codes = codes
+        for name, _ in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.flags)
+
+    def select(self, mask):
+        """Returns a new table of the rows selected by a mask or index array"""
+        return EventTable(self.codes,
+                dict((name, getattr(self, name)[mask]) for name, _ in COLUMNS))
+
+    def credits(self):
+        """Returns the credit counts of every player code as a dict of arrays
+        indexed like codes, computed as analyse_game_string would"""
+        f = self.flags
+        masks = {
+            "catch": (f & (START | SNATCH)) == 0,
+            "drop": (f & DROP) != 0,
+            "throw": (f & (DROP | FOUL | POINT)) == 0,
+            "snatch": (f & SNATCH) != 0,
+            "foul": (f & (DROP | FOUL)) == FOUL,
+        }
+        n = len(self.codes)
+        return dict((key, np.bincount(self.thrower[masks[key]], minlength=n))
+                for key in CREDITS)
+
+    def analysis(self):
+        """Returns the credits in the format of analyse_game_string. Codes of
+        different teams are merged, so select a single team first."""
+        creds = self.credits()
+        seen = np.unique(self.thrower)
+        return dict((self.codes[i], dict((key, int(creds[key][i]))
+            for key in CREDITS)) for i in seen)
+
+    def points(self):
+        """Returns the number of possessions that ended in a point"""
+        return int(np.count_nonzero(self.flags & POINT))
+
+    def save(self, filename):
+        """Writes the table to a binary file which load() memory maps"""
+        header = {"codes": self.codes, "rows": len(self),
+                "columns": [list(c) for c in COLUMNS]}
+        header = json.dumps(header).encode("utf-8")
+        offset = _align(len(MAGIC) + 8 + len(header))
+        with open(filename, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name, dtype in COLUMNS:
+                f.write(b"\0" * (offset - f.tell()))
+                data = np.ascontiguousarray(getattr(self, name), dtype=dtype)
+                f.write(data.tobytes())
+                offset = _align(offset + data.nbytes)
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def load(filename, mmap=True):
+    """Opens a table written by EventTable.save(). The columns are memory
+    mapped read only unless mmap is False."""
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not an event table" % filename)
+        size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(size).decode("utf-8"))
+    rows = header["rows"]
+    offset = _align(len(MAGIC) + 8 + size)
+    columns = {}
+    for name, dtype in header["columns"]:
+        dtype = np.dtype(str(dtype))
+        if not rows:
+            columns[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            columns[name] = np.memmap(filename, dtype=dtype, mode="r",
+                    offset=offset, shape=(rows,))
+        else:
+            with open(filename, "rb") as f:
+                f.seek(offset)
+                columns[name] = np.fromfile(f, dtype=dtype, count=rows)
+        offset = _align(offset + rows * dtype.itemsize)
+    return EventTable(header["codes"], columns)
+
+def _extend(a, values):
+    """Appends a NumPy array to an array.array of the same C type"""
+    data = np.ascontiguousarray(values, dtype=a.typecode).tobytes()
+    if hasattr(a, "frombytes"):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+
+class EventBuilder:
+    """Collects events from pass strings into compact arrays"""
+    def __init__(self):
+        self.codes = []
+        self._ids = {}
+        self._possessions = 0
+        self._columns = dict((name, array.array("B" if dtype == "u1" else "i"))
+                for name, dtype in COLUMNS)
+
+    def intern(self, code):
+        """Returns the small int id of a player code"""
+        pid = self._ids.get(code)
+        if pid is None:
+            pid = self._ids[code] = len(self.codes)
+            self.codes.append(code)
+        return pid
+
+    def add_pass_string(self, game_id, team_id, pass_string):
+        """Adds the events of a team's pass string in a game"""
+        cols = self._columns
+        for seq in pass_string.split("\n"):
+            # positions are those of the split line, as in iter_hands, so a
+            # hand after an empty one isn't taken for the possession start
+            hands = [(pos,) + tokenize_hand(hand)
+                    for pos, hand in enumerate(seq.split("-"))]
+            hands = [(pos, self.intern(code), flags)
+                    for pos, code, flags in hands if code]
+            if not hands:
+                continue
+            possession = self._possessions
+            self._possessions += 1
+            for i, (pos, pid, flags) in enumerate(hands):
+                cols["game"].append(game_id)
+                cols["team"].append(team_id)
+                cols["possession"].append(possession)
+                cols["thrower"].append(pid)
+                cols["receiver"].append(hands[i + 1][1] if i + 1 < len(hands) else -1)
+                cols["flags"].append(flags | START if pos == 0 else flags)
+
+    def add_pass_blob(self, game_id, team_id, blob):
+        """Adds the events of a pass string stored as a passcodec blob"""
+        self.add_pass_blobs([(game_id, team_id, blob)])
+
+    def add_pass_blobs(self, rows):
+        """Adds the events of (game_id, team_id, blob) rows of passcodec
+        blobs. The hands are read straight from the blobs, without parsing
+        any text, and the events of all the rows are built at once."""
+        ids, bases, games, teams, lengths, hands = [], [], [], [], [], []
+        for game_id, team_id, blob in rows:
+            blob = bytes(blob)
+            _, codes, (lstart, npos, ltype), (hstart, nhands, htype) = \
+                    passcodec.layout(blob)
+            if not nhands:
+                continue
+            bases.append(len(ids))
+            ids.extend([self.intern(code) for code in codes])
+            games.append(game_id)
+            teams.append(team_id)
+            lengths.append(np.frombuffer(blob, "<u2" if ltype == "H" else "u1",
+                npos, lstart))
+            hands.append(np.frombuffer(blob, "<u2" if htype == "H" else "u1",
+                nhands, hstart))
+        if not hands:
+            return
+        counts = [len(h) for h in hands]
+        lengths = np.concatenate(lengths).astype(np.intp)
+        hands = np.concatenate(hands).astype(np.intp)
+        thrower = np.array(ids, dtype=np.int32)[
+                np.repeat(np.array(bases, dtype=np.intp), counts) + (hands >> 4)]
+        flags = (hands & 15).astype(np.uint8)
+        ends = np.cumsum(lengths)
+        flags[ends - lengths] |= START
+        receiver = np.empty_like(thrower)
+        receiver[:-1] = thrower[1:]
+        receiver[ends - 1] = -1
+        possession = np.repeat(np.arange(self._possessions,
+            self._possessions + len(lengths), dtype=np.int32), lengths)
+        self._possessions += len(lengths)
+
+        columns = dict(game=np.repeat(np.array(games, dtype=np.int32), counts),
+                team=np.repeat(np.array(teams, dtype=np.int32), counts),
+                possession=possession, thrower=thrower, receiver=receiver,
+                flags=flags)
+        for name, values in columns.items():
+            _extend(self._columns[name], values)
+
+    def add_stored(self, rows):
+        """Adds the events of (game_id, team_id, pass_string) rows as read
+        from the passes table, where pass strings are blobs or text"""
+        blobs = []
+        for game_id, team_id, value in rows:
+            if passcodec.is_encoded(value):
+                blobs.append((game_id, team_id, value))
+                continue
+            self.add_pass_blobs(blobs)
+            blobs = []
+            self.add_pass_string(game_id, team_id, value)
+        self.add_pass_blobs(blobs)
+
+    def build(self):
+        """Returns the EventTable of all the events added so far"""
+        return EventTable(list(self.codes),
+                dict((name, np.array(self._columns[name], dtype=dtype))
+                    for name, dtype in COLUMNS))
+
+    def flush(self):
+        """Returns the EventTable of the events added since the last flush
+        and forgets them. Codes and possession numbers carry on, so batches
+        of a stream can be concatenated."""
+        table = self.build()
+        for name, dtype in COLUMNS:
+            self._columns[name] = array.array("B" if dtype == "u1" else "i")
+        return table
+
+def events_from_db(conn):
+    """Builds the EventTable of all the pass strings stored in the db"""
+    builder = EventBuilder()
+    c = conn.cursor()
+    c.execute("SELECT game_id, team_id, pass_string FROM passes ORDER BY id")
+    while True:
+        rows = c.fetchmany(1000)
+        if not rows:
+            break
+        builder.add_stored(rows)
+    return builder.build()
+
+if __name__ == "__main__":
+    import argparse
+    from gamedb import open_db, close_db
+    parser = argparse.ArgumentParser(
+            description="Save the events of all the stored games to a file")
+    parser.add_argument("output")
+    parser.add_argument("--db", default="frisbee.db")
+    args = parser.parse_args()
+    conn = open_db(args.db)
+    table = events_from_db(conn)
+    close_db(conn)
+    table.save(args.output)
+    print("Saved %d events of %d players" % (len(table), len(table.codes)))
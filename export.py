@@ -0,0 +1,253 @@
+"""
+Columnar export of the db for NumPy, pandas and Arrow users.
+
+The teams, players, games and passes tables, and the event table of the
+parsed passes (see events.py), are streamed in batches of rows and written
+column by column, so memory stays bounded by the batch size.
+
+Two formats are written into a directory with one entry per table:
+
+npy      <table>/<column>.npy files that np.load(mmap_mode="r") opens
+         without copying. Text columns are Arrow style: <column>.offsets.npy
+         (int64, rows + 1) into the utf-8 bytes of <column>.data.npy.
+         load() maps them all back.
+parquet  <table>.parquet with a row group per batch (needs pyarrow)
+
+NULL integers are written as -1 and NULL texts as empty strings.
+
+    python export.py --db frisbee.db [--format npy|parquet] [--batch N] OUT
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import struct
+
+import numpy as np
+
+from events import COLUMNS as EVENT_COLUMNS, EventBuilder
+from gamedb import open_db, close_db, pass_text
+
+TABLES = ("teams", "players", "games", "passes")
+NPY_HEADER = 128    # fixed, so the row count can be written at the end
+
+class NpyColumnWriter:
+    """Appends arrays to a .npy file whose length isn't known up front"""
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.f = open(path, "wb")
+        self.f.write(self._header())
+
+    def _header(self):
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (
+                self.dtype.str, self.rows)
+        header = header.ljust(NPY_HEADER - 10 - 1) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + \
+                header.encode("latin-1")
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        self.f.write(values.tobytes())
+        self.rows += len(values)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self._header())
+        self.f.close()
+
+class NpyTextWriter:
+    """Writes strings as int64 offsets into a utf-8 byte column"""
+    def __init__(self, path):
+        self.offsets = NpyColumnWriter(path + ".offsets.npy", "<i8")
+        self.data = NpyColumnWriter(path + ".data.npy", "u1")
+        self.end = 0
+        self.offsets.append([0])
+
+    def append(self, values):
+        encoded = [v.encode("utf-8") for v in values]
+        lengths = np.array([len(v) for v in encoded], dtype=np.int64)
+        self.offsets.append(self.end + np.cumsum(lengths))
+        self.end += int(lengths.sum())
+        self.data.append(np.frombuffer(b"".join(encoded), dtype=np.uint8)
+                if self.end else [])
+
+    def close(self):
+        self.offsets.close()
+        self.data.close()
+
+class NpySink:
+    """Writes every table as a directory of .npy columns"""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def table(self, name, columns):
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return NpyTable(path, columns)
+
+class NpyTable:
+    def __init__(self, path, columns):
+        self.writers = []
+        for name, kind in columns:
+            target = os.path.join(path, name)
+            self.writers.append(NpyTextWriter(target) if kind == "text"
+                    else NpyColumnWriter(target + ".npy", kind))
+
+    def append(self, batch):
+        for writer, values in zip(self.writers, batch):
+            writer.append(values)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+class ParquetSink:
+    """Writes every table as a parquet file with a row group per batch"""
+    def __init__(self, directory):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("The parquet format needs pyarrow installed")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def table(self, name, columns):
+        pa = self.pa
+        types = {"text": pa.string(), "<i8": pa.int64(), "<i4": pa.int32(),
+                "u1": pa.uint8(), "<f8": pa.float64()}
+        schema = pa.schema([(col, types[kind]) for col, kind in columns])
+        return ParquetTable(self.pq.ParquetWriter(
+            os.path.join(self.directory, name + ".parquet"), schema), schema, pa)
+
+class ParquetTable:
+    def __init__(self, writer, schema, pa):
+        self.writer = writer
+        self.schema = schema
+        self.pa = pa
+
+    def append(self, batch):
+        arrays = [self.pa.array(values, type=field.type)
+                for values, field in zip(batch, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays,
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+SINKS = {"npy": NpySink, "parquet": ParquetSink}
+
+def table_columns(conn, table):
+    """Returns [(column, kind)] of a table, kind being 'text' or a dtype"""
+    c = conn.cursor()
+    c.execute("PRAGMA table_info(%s)" % table)
+    kinds = {"INTEGER": "<i8", "REAL": "<f8", "TEXT": "text"}
+    return [(row[1], kinds.get(row[2].upper(), "text")) for row in c.fetchall()]
+
+# Columns stored in another form than they are exported in, with the
+# function reading a value back
+DECODERS = {("passes", "pass_string"): pass_text}
+
+def _column(values, kind, decode=None):
+    if kind == "text":
+        if decode is not None:
+            values = [decode(v) if v is not None else None for v in values]
+        return [v if v is not None else u"" for v in values]
+    missing = -1 if kind != "<f8" else np.nan
+    return np.array([v if v is not None else missing for v in values],
+            dtype=kind)
+
+def export(conn, directory, fmt="npy", batch=10000):
+    """Exports the tables and the events to `directory`. Returns the number
+    of rows written per table."""
+    sink = SINKS[fmt](directory)
+    counts = {}
+    for table in TABLES:
+        columns = table_columns(conn, table)
+        out = sink.table(table, columns)
+        c = conn.cursor()
+        c.execute("SELECT %s FROM %s ORDER BY rowid" %
+                (", ".join(col for col, _ in columns), table))
+        counts[table] = 0
+        while True:
+            rows = c.fetchmany(batch)
+            if not rows:
+                break
+            out.append([_column(values, kind, DECODERS.get((table, col)))
+                for values, (col, kind) in zip(zip(*rows), columns)])
+            counts[table] += len(rows)
+        out.close()
+
+    # Events of the parsed pass strings, with their interned codes
+    out = sink.table("events", list(EVENT_COLUMNS))
+    builder = EventBuilder()
+    c = conn.cursor()
+    c.execute("SELECT game_id, team_id, pass_string FROM passes ORDER BY id")
+    counts["events"] = 0
+    while True:
+        rows = c.fetchmany(batch)
+        if not rows:
+            break
+        builder.add_stored(rows)
+        events = builder.flush()
+        out.append([getattr(events, name) for name, _ in EVENT_COLUMNS])
+        counts["events"] += len(events)
+    out.close()
+    out = sink.table("codes", [("code", "text")])
+    out.append([list(builder.codes)])
+    out.close()
+    counts["codes"] = len(builder.codes)
+    return counts
+
+class TextColumn:
+    """A memory mapped text column of an npy export"""
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def tolist(self):
+        return [self[i] for i in range(len(self))]
+
+def load(directory, table):
+    """Maps the columns of a table of an npy export without copying them.
+    Returns {column: array or TextColumn}."""
+    path = os.path.join(directory, table)
+    columns = {}
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if name.endswith(".offsets.npy"):
+            col = name[:-len(".offsets.npy")]
+            columns[col] = TextColumn(np.load(full, mmap_mode="r"),
+                    np.load(os.path.join(path, col + ".data.npy"), mmap_mode="r"))
+        elif not name.endswith(".data.npy"):
+            columns[name[:-len(".npy")]] = np.load(full, mmap_mode="r")
+    return columns
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the db as columns")
+    parser.add_argument("output", help="directory to write to")
+    parser.add_argument("--db", default="frisbee.db")
+    parser.add_argument("--format", choices=sorted(SINKS), default="npy")
+    parser.add_argument("--batch", type=int, default=10000,
+            help="rows read and written at a time")
+    args = parser.parse_args()
+    conn = open_db(args.db)
+    counts = export(conn, args.output, args.format, args.batch)
+    close_db(conn)
+    for table, rows in sorted(counts.items()):
+        print("%-8s %10d rows" % (table, rows))
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
+from __future__ import print_function
+
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import multiprocessing
+import os.path
 import re
+import sys
 from gamedb import *
 # Class definitions - to be used as data types
 
@@ -9,8 +19,7 @@ class Player:
         self.team_id = team_id
 
     def __get_code(self):
-        cleaned = "".join(self.name.strip().split())
-        return cleaned[:3].upper()
+        return player_code(self.name)
 
 class Game:
     def __init__(self, t1, t2, p1, p2):
@@ -25,65 +34,147 @@ class Passes:
         self.game_id = gid
         self.team_id = tid
 
+# __slots__ counterparts of the above for the hot paths that create one
+# object per row, such as bulk imports
+class PlayerRow(object):
+    __slots__ = ("name", "code", "team_id")
+    def __init__(self, name, team_id):
+        self.name = name
+        self.code = player_code(name)
+        self.team_id = team_id
+
+class GameRow(object):
+    __slots__ = ("team1_id", "team2_id", "point1", "point2")
+    def __init__(self, t1, t2, p1, p2):
+        self.team1_id = t1
+        self.team2_id = t2
+        self.point1 = p1
+        self.point2 = p2
+
+class PassesRow(object):
+    __slots__ = ("string", "game_id", "team_id")
+    def __init__(self, pstr, gid, tid):
+        self.string = pstr
+        self.game_id = gid
+        self.team_id = tid
+
+class TeamBlock:
+    """A team's section of a game sheet. Its possession lines are buffered,
+    so a block takes memory in proportion to the team's section, not to one
+    possession; the rest of the sheet is not held. The points are counted
+    as the lines are added, so the block is never rescanned."""
+    def __init__(self, name):
+        self.name = name
+        self.possessions = []
+        self.points = 0
+
+    def add(self, line):
+        """Adds a possession line to the block"""
+        line = line.rstrip("\r\n")
+        self.possessions.append(line)
+        if line.endswith("(P)"):
+            self.points += 1
+
+    @property
+    def string(self):
+        """The pass string of the block, one possession per line"""
+        return "".join(line + "\n" for line in self.possessions)
+
 class ParsingError(Exception):
     def __init__(self, value):
         self.value = value
-    def __str__(self, value):
-        return repr(self.value)
+    def __str__(self):
+        return str(self.value)
 
 def get_points(gs):
     """Counts the points from the game string and returns the points"""
-    return len(re.findall('\(P\)$', gs, re.MULTILINE))
+    return sum(1 for line in gs.split("\n") if line.endswith("(P)"))
+
+# Action markers of a hand (see THEORY.md) and the bit flags they map to
+DROP, FOUL, SNATCH, POINT = 1, 2, 4, 8
+MARKERS = (("*", DROP), ("(F)", FOUL), ("(S)", SNATCH), ("(P)", POINT))
+CREDITS = ("catch", "drop", "throw", "snatch", "foul")
+
+def tokenize_hand(hand):
+    """Splits a hand like 'PL1(S)*' into its player code and marker flags"""
+    flags = 0
+    for marker, flag in MARKERS:
+        if marker in hand:
+            flags |= flag
+            hand = hand.replace(marker, "")
+    return hand, flags
+
+def iter_hands(gs):
+    """Yields (position, code, flags) for every hand of the game string.
+    position is the index of the hand within its possession line."""
+    for seq in gs.split("\n"):
+        if not seq:
+            continue
+        for pos, hand in enumerate(seq.split("-")):
+            code, flags = tokenize_hand(hand)
+            if code:
+                yield pos, code, flags
 
 def analyse_game_string(gs):
-    passSeq = gs.split("\n")
-    players = []
-    act = re.compile("\*|\(P\)|\(F\)|\(S\)")
-    # create a list of unique player codes
-    for seq in passSeq:
-        hands = [act.sub('',s) for s in seq.split("-")]
-        for hand in hands:
-            if not hand in players and hand:
-                players.append(hand)
-    # Create a creds data store
-    playerCreds = []
-    for i in range(len(players)):
-        playerCreds.append(dict(zip(["catch", "drop", "throw", "snatch", "foul"], [0,0,0,0,0])))
-
-    # Parse each string and assign creds
-    for seq in passSeq:
-        hands = seq.split('-')
-        # get the credit value
-        for i,hand in enumerate(hands):
-            if re.search('\(S\)', hand):
-                playerCreds[players.index(act.sub('', hand))]["snatch"] += 1
-            elif i!=0:
-                playerCreds[players.index(act.sub('', hand))]["catch"] += 1
-
-            if re.search('\*', hand):
-                playerCreds[players.index(act.sub('', hand))]["drop"] += 1
-            elif re.search('\(F\)', hand):
-                playerCreds[players.index(act.sub('', hand))]["foul"] += 1
-            elif not re.search('\(P\)', hand) and hand:
-                playerCreds[players.index(act.sub('', hand))]["throw"] += 1
-    return dict(zip(players, playerCreds))
+    """Returns the catch, drop, throw, snatch and foul count of each player
+    in the game string, keyed by the player code"""
+    creds = {}
+    for pos, code, flags in iter_hands(gs):
+        cred = creds.get(code)
+        if cred is None:
+            cred = creds[code] = dict.fromkeys(CREDITS, 0)
+        if flags & SNATCH:
+            cred["snatch"] += 1
+        elif pos:
+            cred["catch"] += 1
+
+        if flags & DROP:
+            cred["drop"] += 1
+        elif flags & FOUL:
+            cred["foul"] += 1
+        elif not flags & POINT:
+            cred["throw"] += 1
+    return creds
+
+TEAM_LINE = re.compile(r"^(?P<team>.+):\s+(?P<name>.+)$")
+
+def iter_gameblocks(lines):
+    """Reads the lines of a game sheet lazily and yields a TeamBlock for
+    every team as soon as its block ends, holding one block at a time. A
+    block starts with a 'TEAM1: NAME' line and ends with a blank line or
+    the end of the input."""
+    block = None
+    for line in lines:
+        if ":" in line:
+            match = TEAM_LINE.match(line)
+            if match:
+                if block is not None:
+                    yield block
+                block = TeamBlock(match.group("name"))
+                continue
+        if line.strip():
+            if block is not None:
+                block.add(line)
+        elif block is not None:
+            yield block
+            block = None
+    if block is not None:
+        yield block
+
+def iter_gamefile(gfile):
+    """Generator yielding the TeamBlock of each team in the game sheet file"""
+    with open(gfile, "r") as f:
+        for block in iter_gameblocks(f):
+            yield block
 
 def parse_gamefile(gfile):
     """Parses the given text file containing game data"""
-    t = re.compile(r"^(?P<team>.+):\s+(?P<name>.+)$")
     vals = []
     keys = ["team1", "string1", "points1", "team2", "string2", "points2"]
-    with open(gfile,"r") as f:
-        passStr = ""
-        for line in f:
-            if t.match(line):
-                vals.append( t.match(line).group('name') )
-            elif re.match("^\n|\Z", line):
-                vals.append( passStr )
-                vals.append( get_points(passStr) )
-                passStr = ''
-            else:
-                passStr += line
+    for block in iter_gamefile(gfile):
+        vals.extend([block.name, block.string, block.points])
+        if len(vals) == len(keys):
+            break
     if not len(vals):
         raise ParsingError("Empty file")
     elif len(vals) < 6:
@@ -91,23 +182,264 @@ def parse_gamefile(gfile):
     else:
         return dict(zip(keys,vals))
 
-def import_game_data(filename):
-    """Imports details from a game sheet file into the database"""
-    conn = open_db()
-    # get the game result and update the game
-    data = parse_gamefile(filename)
-    game_id = -1
-    t1 = team_id(data["team1"])
-    t2 = team_id(data["team2"])
-    p1 = data["points1"]
-    p2 = data["points2"]
-    if t1 != -1 and t2 != -1:
-        game_id = add_game(conn, Game(t1,t2,p1,p2))
-
-    # get the game id and update the pass string
-    if game_id != -1:
-        add_pass_string(Passes(data["string1"], game_id, t1))
-        add_pass_string(Passes(data["string2"], game_id, t2))
-    commit_data()
-    close_db()
+def resolve_game(conn, game):
+    """Resolves a game as returned by parse_gamefile() to db ids. Returns
+    [(team id, [(position, player id, flags)])] for its two teams, None
+    standing for the teams and players unknown to the db. The ids come from
+    the cached team and player maps, so a whole game takes at most two
+    queries."""
+    teams = team_ids(conn)
+    players = player_ids(conn)
+    resolved = []
+    for n in ("1", "2"):
+        tid = teams.get(fold_name(game["team" + n]))
+        resolved.append((tid, [(pos, players.get((tid, code)), flags)
+            for pos, code, flags in iter_hands(game["string" + n])]))
+    return resolved
+
+def import_game_data(filename, dbname="frisbee.db", cache_dir=None):
+    """Imports details from a game sheet file into the database, unless it
+    was imported unchanged before. See import_games()."""
+    conn = open_db(dbname)
+    try:
+        return import_games(conn, [filename], 1, cache_dir)
+    finally:
+        close_db(conn)
+
+def expand_sheets(pattern):
+    """Returns the sorted game sheet paths of a directory or a glob pattern"""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.txt")
+    return sorted(glob.glob(pattern))
+
+# The version of the parsed sheets kept in a cache_dir, to bump whenever
+# iter_gameblocks or analyse_game_string change their results
+CACHE_VERSION = 1
+
+def read_sheet(filename, cache_dir=None):
+    """Parses and analyses a game sheet into
+    (filename, content hash, [(team, pass string, points, analysis)]).
+    With a cache_dir the result is kept there by content hash and
+    CACHE_VERSION, and sheets seen before aren't parsed again. Module level so that it can be sent to
+    worker processes."""
+    with open(filename, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    cached = (os.path.join(cache_dir, "%s-v%d.json" % (digest, CACHE_VERSION))
+            if cache_dir else None)
+    if cached and os.path.exists(cached):
+        with open(cached) as f:
+            return filename, digest, [tuple(b) for b in json.load(f)]
+    lines = content.decode("utf-8").splitlines(True)
+    blocks = [(b.name, b.string, b.points, analyse_game_string(b.string))
+            for b in iter_gameblocks(lines)]
+    if cached:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp = "%s.%d" % (cached, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(blocks, f)
+        os.rename(tmp, cached)
+    return filename, digest, blocks
+
+def negate_creds(counts):
+    """Returns the counts with all the credits negated"""
+    return dict((key, dict((k, -v) for k, v in cred.items()))
+            for key, cred in counts.items())
+
+def remove_games(conn, game_ids):
+    """Deletes games, taking them back out of the team totals, the player
+    counters and the chain index. Doesn't commit."""
+    counts = count_creds(delete_games(conn, game_ids))
+    update_player_counts(conn, negate_creds(counts))
+
+def add_creds(counts, team_id, creds):
+    """Adds the analysis of a team's pass string to the per (team_id, code)
+    totals in counts"""
+    for code, cred in creds.items():
+        total = counts.get((team_id, code))
+        if total is None:
+            counts[(team_id, code)] = dict(cred)
+        else:
+            for key, value in cred.items():
+                total[key] += value
+    return counts
+
+def count_creds(passes, counts=None):
+    """Adds the analysis of (team_id, pass_string) pairs to the per
+    (team_id, code) totals in counts, a new dict by default, and returns
+    them"""
+    if counts is None:
+        counts = {}
+    for tid, pstr in passes:
+        add_creds(counts, tid, analyse_game_string(pstr))
+    return counts
+
+def import_games(conn, filenames, processes=None, cache_dir=None):
+    """
+    Imports many game sheets in a single transaction. The sheets are parsed
+    in a pool of `processes` worker processes (all cores by default, no pool
+    when 1) and written with batched inserts. Sheets without exactly two
+    teams, or with teams unknown to the db, are skipped.
+
+    Every imported file is kept in a ledger with its content hash, mtime and
+    size. Files whose mtime and size are unchanged are not even read, and
+    files whose content was imported before are not imported again. A file
+    whose content changed replaces its earlier game, with the team totals
+    and player counters corrected. Parsed sheets are cached in cache_dir.
+
+    Returns a dict of the file names that were "imported", "replaced" (a
+    subset of imported), "unchanged" and "skipped".
+    """
+    ledger = import_ledger(conn)
+    seen = set(entry[0] for entry in ledger.values())
+    result = dict(imported=[], replaced=[], unchanged=[], skipped=[])
+    stats, todo = {}, []
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        st = os.stat(filename)
+        stats[filename] = (path, st.st_mtime, st.st_size)
+        entry = ledger.get(path)
+        if entry and entry[1:3] == (st.st_mtime, st.st_size):
+            result["unchanged"].append(filename)
+        else:
+            todo.append(filename)
+
+    reader = functools.partial(read_sheet, cache_dir=cache_dir)
+    if processes == 1 or len(todo) < 2:
+        pool = None
+        sheets = map(reader, todo)
+    else:
+        pool = multiprocessing.Pool(processes)
+        sheets = pool.imap(reader, todo, chunksize=16)
+    try:
+        teams = team_ids(conn)
+        games, strings, counts = [], [], {}
+        entries, touched, replaced = [], [], []
+        for filename, digest, blocks in sheets:
+            path, mtime, size = stats[filename]
+            entry = ledger.get(path)
+            if entry and entry[0] == digest:
+                touched.append((path, digest, mtime, size, entry[3]))
+                result["unchanged"].append(filename)
+                continue
+            tids = [teams.get(fold_name(b[0]), -1) for b in blocks]
+            if len(blocks) != 2 or -1 in tids or digest in seen:
+                result["skipped"].append(filename)
+                continue
+            seen.add(digest)
+            if entry and entry[3] is not None:
+                replaced.append(entry[3])
+                result["replaced"].append(filename)
+            result["imported"].append(filename)
+            entries.append((path, digest, mtime, size))
+            games.append(GameRow(tids[0], tids[1], blocks[0][2], blocks[1][2]))
+            strings.append((blocks[0][1], blocks[1][1]))
+            for block, tid in zip(blocks, tids):
+                add_creds(counts, tid, block[3])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    try:
+        remove_games(conn, replaced)
+        game_ids = add_games(conn, games)
+        add_pass_strings(conn, [PassesRow(pstr, gid, tid)
+            for gid, g, pstrs in zip(game_ids, games, strings)
+            for pstr, tid in zip(pstrs, (g.team1_id, g.team2_id))])
+        update_player_counts(conn, counts)
+        record_imports(conn, touched + [entry + (gid,)
+            for entry, gid in zip(entries, game_ids)])
+        commit_data(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+def rebuild_player_stats(conn):
+    """Recomputes the counters of all the players from the stored pass
+    strings, streaming the passes table once. Commits when done."""
+    counts = count_creds(iter_passes(conn))
+    try:
+        reset_player_counts(conn)
+        update_player_counts(conn, counts)
+        commit_data(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    return len(counts)
+
+def main(argv=None):
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description="Frisbee game analysis")
+    sub = parser.add_subparsers(dest="command")
+    imp = sub.add_parser("import", help="import game sheets into the db")
+    imp.add_argument("sheets", nargs="+",
+            help="game sheet files, directories or glob patterns")
+    imp.add_argument("--db", default="frisbee.db")
+    imp.add_argument("-j", "--processes", type=int, default=None,
+            help="number of parser processes (default: all cores)")
+    imp.add_argument("--cache", metavar="DIR",
+            help="directory caching the parsed sheets")
+    imp.add_argument("--network", metavar="FILE.npz",
+            help="pass network file to add the imported games to")
+    imp.add_argument("--no-validate", dest="validate", action="store_false",
+            help="import without validating the sheets first")
+    imp.add_argument("--metrics", metavar="FILE",
+            help="file to write the timings of the import to")
+    imp.add_argument("--slow", type=float, default=None, metavar="SECONDS",
+            help="with --metrics, log the queries slower than this")
+    mig = sub.add_parser("migrate", help="upgrade the db schema")
+    mig.add_argument("--db", default="frisbee.db")
+    reb = sub.add_parser("rebuild",
+            help="recompute the player counters from the stored passes")
+    reb.add_argument("--db", default="frisbee.db")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        filenames = []
+        for pattern in args.sheets:
+            filenames.extend(expand_sheets(pattern))
+        if args.validate:
+            import validate
+            errors = validate.validate_sheets(filenames, args.processes)
+            for error in errors:
+                print(error)
+            if errors:
+                print("Nothing imported, %d errors in the game sheets" %
+                        len(errors))
+                return 1
+        if args.metrics:
+            import logging
+            import metrics
+            logging.basicConfig(format="%(message)s")
+            metrics.enable(args.slow)
+        if args.network:
+            import network
+            net = (network.load(args.network) if os.path.exists(args.network)
+                    else network.PassNetwork())
+            net.listen()
+        conn = open_db(args.db)
+        result = import_games(conn, filenames, args.processes, args.cache)
+        close_db(conn)
+        if args.network:
+            net.save(args.network)
+        if args.metrics:
+            with open(args.metrics, "w") as f:
+                f.write(metrics.dump())
+        for filename in result["skipped"]:
+            print("Skipped %s" % filename)
+        print("Imported %d of %d game sheets (%d replaced, %d unchanged)" %
+                (len(result["imported"]), len(filenames),
+                    len(result["replaced"]), len(result["unchanged"])))
+    elif args.command == "migrate":
+        conn = open_db(args.db)
+        print("Schema version %d" % migrate(conn))
+        close_db(conn)
+    elif args.command == "rebuild":
+        conn = open_db(args.db)
+        print("Rebuilt the counters of %d players" % rebuild_player_stats(conn))
+        close_db(conn)
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,21 @@
 #!/usr/bin/python
 
+import collections
+import contextlib
 import sqlite3
+import threading
+import weakref
+
+import passcodec
 
 # --------------------------------------------------------------------------- #
 #                       Overall DB Functions                                  #
 # --------------------------------------------------------------------------- #
-def createdb(dbname='frisbee'):
+def createdb(dbname='frisbee', version=None):
     '''
     This function creates the database and initializes the various tables
-    required to analyze the games
+    required to analyze the games. The schema is then migrated to `version`
+    (the latest by default).
     '''
     if dbname.find(".db") == -1:
         dbname = dbname + ".db"
@@ -32,12 +39,150 @@ def createdb(dbname='frisbee'):
             FOREIGN KEY(game_id) REFERENCES games(id),
             FOREIGN KEY(team_id) REFERENCES teams(id))''')
     conn.commit()
+    migrate(conn, version)
     conn.close()
 
-def open_db():
+# --------------------------------------------------------------------------- #
+#                       Schema migrations                                     #
+# --------------------------------------------------------------------------- #
+# Each migration takes a cursor and upgrades the schema by one version. The
+# version of a db is kept in PRAGMA user_version, 0 being the createdb tables.
+
+def fold_name(name):
+    '''Case folds a team name for the indexed, case insensitive lookup'''
+    return name.strip().lower()
+
+def _migration_1(c):
+    '''Indexes for the hot lookups and a case folded team name'''
+    c.execute("ALTER TABLE teams ADD COLUMN name_key TEXT")
+    c.execute("SELECT id, name FROM teams")
+    c.executemany("UPDATE teams SET name_key=? WHERE id=?",
+            [(fold_name(name), tid) for tid, name in c.fetchall()])
+    c.execute("CREATE INDEX idx_teams_name_key ON teams(name_key, id)")
+    c.execute("CREATE INDEX idx_players_team ON players(team_id)")
+    c.execute("CREATE INDEX idx_players_code ON players(p_code, name)")
+    c.execute("CREATE INDEX idx_passes_game ON passes(game_id, team_id)")
+
+def _migration_2(c):
+    '''One player per code and team, the key of the player counter upserts.
+    Teammates already sharing a code, such as Sam and Samuel, keep it for
+    the first one added and get the next free code of player_code().'''
+    c.execute("SELECT id, team_id, p_code, name FROM players ORDER BY id")
+    rows = c.fetchall()
+    codes, seen, recoded = {}, {}, []
+    for _, tid, code, _ in rows:
+        codes.setdefault(tid, set()).add(code)
+    for pid, tid, code, name in rows:
+        if code in seen.setdefault(tid, set()):
+            code = player_code(name or code, codes[tid])
+            codes[tid].add(code)
+            recoded.append((code, pid))
+        seen[tid].add(code)
+    c.executemany("UPDATE players SET p_code=? WHERE id=?", recoded)
+    c.execute("DROP INDEX idx_players_team")
+    c.execute("""CREATE UNIQUE INDEX idx_players_team_code
+            ON players(team_id, p_code)""")
+
+def _migration_3(c):
+    '''The pass chain index of chains.py, filled from the stored passes'''
+    c.execute("""CREATE TABLE chains (chain TEXT, outcome INTEGER,
+            team_id INTEGER, length INTEGER, count INTEGER,
+            PRIMARY KEY(chain, outcome, team_id)) WITHOUT ROWID""")
+    c.execute("""CREATE INDEX idx_chains_top
+            ON chains(length, outcome, count DESC, chain, team_id)""")
+    from chains import rebuild_chains  # chains needs frisbee, which needs us
+    rebuild_chains(c.connection)
+
+def _migration_4(c):
+    '''The ledger of the imported game sheet files'''
+    c.execute("""CREATE TABLE imports (path TEXT PRIMARY KEY, hash TEXT,
+            mtime REAL, size INTEGER, game_id INTEGER,
+            FOREIGN KEY(game_id) REFERENCES games(id))""")
+    c.execute("CREATE INDEX idx_imports_hash ON imports(hash)")
+
+def _migration_5(c):
+    '''The pass strings stored as passcodec blobs, see pass_value()'''
+    c.execute("SELECT id, pass_string FROM passes WHERE typeof(pass_string) = 'text'")
+    c.executemany("UPDATE passes SET pass_string=? WHERE id=?",
+            [(pass_value(pstr), pid) for pid, pstr in c.fetchall()])
+
+def _migration_6(c):
+    '''The game buckets, rolling totals and stats of leaderboard.py'''
+    counters = ", ".join("%s INTEGER" % f for f in ("games", "wins", "draws",
+        "losses", "points", "conceded", "catches", "drops", "throws",
+        "snatches", "fouls"))
+    c.execute("""CREATE TABLE leader_games (team_id INTEGER, seq INTEGER,
+            p_code TEXT, game_id INTEGER, %s,
+            PRIMARY KEY(team_id, seq, p_code)) WITHOUT ROWID""" % counters)
+    c.execute("CREATE INDEX idx_leader_games_game ON leader_games(game_id, team_id)")
+    c.execute("""CREATE TABLE leader_totals (span INTEGER, team_id INTEGER,
+            p_code TEXT, %s,
+            PRIMARY KEY(span, team_id, p_code)) WITHOUT ROWID""" % counters)
+    c.execute("""CREATE TABLE leaders (span INTEGER, stat TEXT,
+            is_team INTEGER, value REAL, team_id INTEGER, p_code TEXT,
+            PRIMARY KEY(span, team_id, p_code, stat)) WITHOUT ROWID""")
+    c.execute("""CREATE INDEX idx_leaders_top
+            ON leaders(span, stat, is_team, value, team_id, p_code)""")
+    from leaderboard import rebuild_leaderboards
+    rebuild_leaderboards(c.connection)
+
+MIGRATIONS = [_migration_1, _migration_2, _migration_3, _migration_4,
+        _migration_5, _migration_6]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(conn):
+    '''Returns the schema version of the db'''
+    # read as a SELECT, any other statement commits the open transaction
+    # in Python 2's sqlite3
+    return conn.execute("SELECT user_version FROM pragma_user_version"
+            ).fetchone()[0]
+
+def migrate(conn, version=None):
+    '''
+    Applies the pending migrations up to `version` (the latest by default)
+    in a single transaction. Returns the new schema version.
+    '''
+    if version is None:
+        version = SCHEMA_VERSION
+    current = schema_version(conn)
+    if current >= version:
+        return current
+    # sqlite3 would commit before every DDL statement in its default mode
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN")
+        for migration in MIGRATIONS[current:version]:
+            migration(c)
+        c.execute("PRAGMA user_version = %d" % version)
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+class Connection(sqlite3.Connection):
+    '''A sqlite3 connection that the caches of this module can refer to
+    weakly, so that they don't keep closed connections alive'''
+    def rollback(self):
+        # what was cached since the last commit may include the rolled back
+        # writes, and they don't change the data version
+        sqlite3.Connection.rollback(self)
+        for cache, lock in ((_standings_cache, _standings_lock),
+                (_players_cache, _players_lock)):
+            with lock:
+                cache.pop(self, None)
+
+# The class of the connections opened by open_db and the pools, replaced by
+# metrics.enable() with one that times its queries
+connection_factory = Connection
+
+def open_db(dbname="frisbee.db"):
     '''Wrapper for sqlite3.connect(). Returns a connection object'''
-    # TODO change frisbee.db to suitable db
-    conn = sqlite3.connect("frisbee.db")
+    conn = sqlite3.connect(dbname, factory=connection_factory)
     return conn
 
 def close_db(conn):
@@ -48,18 +193,110 @@ def commit_data(conn):
     '''Wrapper for sqlite3 conn.commit()'''
     conn.commit()
 
+class ConnectionPool(object):
+    '''
+    Keeps one connection per thread to a database, so that concurrent readers
+    don't pay for the connection setup on every request. Connections are
+    opened in WAL mode, which lets readers run while a writer commits, and
+    with a larger prepared statement cache.
+    '''
+    def __init__(self, dbname="frisbee.db", cached_statements=256):
+        self.dbname = dbname
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+
+    def connection(self):
+        '''Returns the connection of the calling thread, opening it if needed'''
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.dbname, check_same_thread=False,
+                    cached_statements=self.cached_statements,
+                    factory=connection_factory)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def session(self):
+        '''
+        Context manager for a unit of work. Yields the thread's connection,
+        commits once when the outermost session exits and rolls back if it
+        raises.
+        '''
+        conn = self.connection()
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            if self._local.depth == 1:
+                conn.rollback()
+            raise
+        else:
+            if self._local.depth == 1:
+                conn.commit()
+        finally:
+            self._local.depth -= 1
+
+    def close(self):
+        '''Closes the connections of all the threads'''
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(dbname="frisbee.db"):
+    '''Returns the shared ConnectionPool of a database'''
+    with _pools_lock:
+        if dbname not in _pools:
+            _pools[dbname] = ConnectionPool(dbname)
+        return _pools[dbname]
+
+def session(dbname="frisbee.db"):
+    '''Shortcut for get_pool(dbname).session()'''
+    return get_pool(dbname).session()
+
 # --------------------------------------------------------------------------- #
 #                       Functions for adding data                             #
 # --------------------------------------------------------------------------- #
 def add_team(conn, name):
     ''' Add a new team to the database '''
+    invalidate_standings()
     c = conn.cursor()
-    c.execute("INSERT INTO teams VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)",(name, 0, 0, 0, 0, 0, 0))
+    c.execute("""INSERT INTO teams (name, g_played, g_won, g_lost, g_drawn,
+            p_for, p_against, name_key) VALUES (?, 0, 0, 0, 0, 0, 0, ?)""",
+            (name, fold_name(name)))
     return c.lastrowid
 
 def add_player(conn, player):
-    '''Add a new player to the database'''
+    '''
+    Add a new player to the database. A player whose code is taken by a
+    teammate gets the next free one from player_code(), which is set on the
+    player. A code taken by a placeholder, the player named by its code that
+    update_player_counts() adds for a code it doesn't know, is the player's
+    own: the placeholder is given the name and its id is returned.
+    '''
     c = conn.cursor()
+    c.execute("SELECT id, name FROM players WHERE team_id=? AND p_code=?",
+            (player.team_id, player.code))
+    row = c.fetchone()
+    invalidate_players()
+    if row is not None and row[1] == player.code:
+        c.execute("UPDATE players SET name=? WHERE id=?", (player.name, row[0]))
+        return row[0]
+    if row is not None:
+        taken = set(code for tid, code in player_ids(conn)
+                if tid == player.team_id)
+        player.code = player_code(player.name, taken)
     c.execute('''INSERT INTO players VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)''',
             (player.name, player.code, player.team_id, 0, 0, 0, 0, 0))
     return c.lastrowid
@@ -72,25 +309,151 @@ def add_game(conn, game):
     update_team_scores(conn, game)  # Trigger update in teams table
     return c.lastrowid
 
+# Pass strings are stored as the compact blobs of passcodec when they encode
+# back to the same text, and as text otherwise. Readers of the pass_string
+# column decode it with pass_text().
+def pass_value(pass_string):
+    '''Returns the value stored in passes.pass_string for a pass string'''
+    try:
+        return sqlite3.Binary(passcodec.encode(pass_string))
+    except ValueError:
+        return pass_string
+
+def pass_text(value):
+    '''Returns the pass string of a passes.pass_string value'''
+    if passcodec.is_encoded(value):
+        return passcodec.decode_text(value)
+    return value
+
+# Functions called as listener(conn, passes, sign) with the list of pass
+# strings added by add_pass_string and add_pass_strings, sign 1, or deleted
+# by delete_games, sign -1, in the same transaction
+_pass_listeners = []
+
+# The indexes of the passes kept in their own tables, as (schema version
+# creating the tables, module). The index_pass_strings(conn, passes, sign) of
+# the module is called with the listeners on the dbs that have its tables.
+PASS_INDEXES = [(3, "chains"), (6, "leaderboard")]
+
+def add_pass_listener(listener):
+    '''Registers a function to call whenever pass strings are added or
+    deleted'''
+    _pass_listeners.append(listener)
+
+def remove_pass_listener(listener):
+    '''Unregisters a function added with add_pass_listener'''
+    _pass_listeners.remove(listener)
+
+def _pass_indexes(conn):
+    """Returns the modules of the PASS_INDEXES that the db has tables for.
+    They are imported here as they need frisbee, which needs us."""
+    version = schema_version(conn)
+    return [__import__(name) for needed, name in PASS_INDEXES
+            if version >= needed]
+
+def _notify_pass_listeners(conn, passes, sign=1):
+    for index in _pass_indexes(conn):
+        index.index_pass_strings(conn, passes, sign)
+    for listener in list(_pass_listeners):
+        listener(conn, passes, sign)
+
 def add_pass_string(conn, passes):
     '''Add a new pass string to the db'''
     c = conn.cursor()
     c.execute('''INSERT INTO passes VALUES (NULL, ?, ?, ?)''',
-            (passes.string, passes.game_id, passes.team_id))
+            (pass_value(passes.string), passes.game_id, passes.team_id))
+    _notify_pass_listeners(conn, [passes])
     return c.lastrowid
 
+def add_games(conn, games):
+    '''Adds many games and updates the teams table once per team. Returns
+    the ids of the games in order. Doesn't commit.'''
+    c = conn.cursor()
+    # the ids are those sqlite gives the rows, as another connection may be
+    # adding games too
+    ids = []
+    for g in games:
+        c.execute('''INSERT INTO games VALUES (NULL, ?, ?, ?, ?)''',
+                (g.team1_id, g.team2_id, g.point1, g.point2))
+        ids.append(c.lastrowid)
+    update_teams_scores(conn, games)
+    return ids
+
+def add_pass_strings(conn, passes):
+    '''Adds many pass strings with a single executemany. Doesn't commit.'''
+    c = conn.cursor()
+    passes = list(passes)
+    c.executemany('''INSERT INTO passes VALUES (NULL, ?, ?, ?)''',
+            [(pass_value(p.string), p.game_id, p.team_id) for p in passes])
+    _notify_pass_listeners(conn, passes)
+
+# Rows read back for delete_games, with the attributes of Game and Passes
+_GameRow = collections.namedtuple("_GameRow", "team1_id team2_id point1 point2")
+_PassesRow = collections.namedtuple("_PassesRow", "string game_id team_id")
+
+def delete_games(conn, game_ids):
+    '''
+    Deletes games with their pass strings, taking them back out of the team
+    totals and, through the pass listeners, the indexes. The player counters
+    are left to the caller, who can analyse the pass strings returned as
+    (team_id, pass_string) tuples. Doesn't commit.
+    '''
+    game_ids = list(game_ids)
+    if not game_ids:
+        return []
+    c = conn.cursor()
+    marks = ", ".join("?" * len(game_ids))
+    c.execute("""SELECT team1_id, team2_id, point1, point2 FROM games
+            WHERE id IN (%s)""" % marks, game_ids)
+    games = [_GameRow(*row) for row in c.fetchall()]
+    c.execute("""SELECT pass_string, game_id, team_id FROM passes
+            WHERE game_id IN (%s)""" % marks, game_ids)
+    passes = [_PassesRow(pass_text(pstr), gid, tid)
+            for pstr, gid, tid in c.fetchall()]
+    update_teams_scores(conn, games, sign=-1)
+    _notify_pass_listeners(conn, passes, -1)
+    c.execute("DELETE FROM passes WHERE game_id IN (%s)" % marks, game_ids)
+    c.execute("DELETE FROM games WHERE id IN (%s)" % marks, game_ids)
+    if schema_version(conn) >= 4:  # the import ledger
+        c.execute("UPDATE imports SET game_id = NULL WHERE game_id IN (%s)"
+                % marks, game_ids)
+    return [(p.team_id, p.string) for p in passes]
+
+# --------------------------------------------------------------------------- #
+#                       Import ledger                                         #
+# --------------------------------------------------------------------------- #
+def import_ledger(conn):
+    '''Returns {path: (hash, mtime, size, game_id)} of the imported files'''
+    c = conn.cursor()
+    c.execute("SELECT path, hash, mtime, size, game_id FROM imports")
+    return dict((row[0], row[1:]) for row in c.fetchall())
+
+def record_imports(conn, entries):
+    '''Adds or replaces ledger entries given as (path, hash, mtime, size,
+    game_id) tuples. Doesn't commit.'''
+    c = conn.cursor()
+    c.executemany("INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?, ?)",
+            entries)
+
 # ----------------------------------------------------------------------------#
 #                       Functions related to TEAM                             #
 # ----------------------------------------------------------------------------#
 def team_id(conn, team):
     """Returns the id of the team name. Or -1 if no team exists"""
     c = conn.cursor()
-    c.execute('SELECT id FROM teams WHERE name LIKE ?', (team,))
+    c.execute('SELECT id FROM teams WHERE name_key = ?', (fold_name(team),))
     team_id = c.fetchone()
     return team_id[0] if team_id else -1
 
+def team_ids(conn):
+    """Returns a dict mapping the case folded team names to their ids"""
+    c = conn.cursor()
+    c.execute("SELECT name_key, id FROM teams")
+    return dict(c.fetchall())
+
 def update_team_scores(conn, game):
     '''Updates the games played related data in teams table'''
+    invalidate_standings()
     c = conn.cursor()
     if game.point1 == game.point2:
         c.execute("""UPDATE teams SET
@@ -115,7 +478,26 @@ def update_team_scores(conn, game):
         c.execute("""UPDATE teams SET g_played = g_played + 1, g_lost = g_lost +1,
                 p_for = p_for + ?, p_against = p_against + ? WHERE id = ?""",
                 (game.point1, game.point2, game.team1_id))
-    conn.commit() # Safe to commit at this point
+
+def update_teams_scores(conn, games, sign=1):
+    '''Sums up the results of many games per team and updates the teams
+    table with one row per team. With sign=-1 the games are taken back out
+    of the totals. Doesn't commit.'''
+    invalidate_standings()
+    totals = {}
+    for g in games:
+        for tid, pf, pa in ((g.team1_id, g.point1, g.point2),
+                (g.team2_id, g.point2, g.point1)):
+            t = totals.setdefault(tid, [0, 0, 0, 0, 0, 0])
+            t[0] += sign
+            t[1 if pf > pa else 2 if pf < pa else 3] += sign
+            t[4] += sign * pf
+            t[5] += sign * pa
+    c = conn.cursor()
+    c.executemany("""UPDATE teams SET g_played = g_played + ?,
+            g_won = g_won + ?, g_lost = g_lost + ?, g_drawn = g_drawn + ?,
+            p_for = p_for + ?, p_against = p_against + ? WHERE id = ?""",
+            [tuple(t) + (tid,) for tid, t in totals.items()])
 
 def games_played(conn, team_id):
     """Returns the number of games played by a team"""
@@ -143,25 +525,197 @@ def draws(conn, team_id):
 
 def team_stats(conn, team_id):
     """Returns the teams statistics as a dictionary"""
-    conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT * FROM teams WHERE id=?", (team_id,))
+    c.row_factory = sqlite3.Row
+    c.execute("""SELECT id, name, g_played, g_won, g_lost, g_drawn, p_for,
+            p_against FROM teams WHERE id=?""", (team_id,))
     stat = c.fetchone()
     return dict(zip(stat.keys(), stat))
 
+# Standings are cached per connection until the next write to the teams
+# table through this module, or a commit by another connection, which
+# changes the PRAGMA data_version seen by this one. Only the connections of
+# open_db and the pools are cached: plain sqlite3 connections can't be
+# weakly referenced.
+_standings_cache = weakref.WeakKeyDictionary()
+_standings_lock = threading.Lock()
+
+def data_version(conn):
+    """Returns the PRAGMA data_version of a connection"""
+    return conn.execute("SELECT data_version FROM pragma_data_version"
+            ).fetchone()[0]
+
+def _cached(cache, lock, conn, version):
+    """Returns the value cached for a connection at a data version, or None"""
+    with lock:
+        try:
+            entry = cache.get(conn)
+        except TypeError:
+            return None
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    return None
+
+def _cache(cache, lock, conn, version, value):
+    with lock:
+        try:
+            cache[conn] = (version, value)
+        except TypeError:
+            pass
+
+def invalidate_standings():
+    """Drops all the cached standings"""
+    with _standings_lock:
+        _standings_cache.clear()
+
+def _head_to_head(conn, tied):
+    """Returns {team id: (wins, point difference)} counting only the games
+    between teams of the same tied group. `tied` maps team ids to groups."""
+    ids = list(tied)
+    marks = ", ".join("?" * len(ids))
+    c = conn.cursor()
+    c.execute("""SELECT team1_id, team2_id, point1, point2 FROM games
+            WHERE team1_id IN (%s) AND team2_id IN (%s)""" % (marks, marks),
+            ids + ids)
+    h2h = dict((tid, [0, 0]) for tid in ids)
+    for t1, t2, p1, p2 in c:
+        if tied[t1] != tied[t2]:
+            continue
+        h2h[t1][1] += p1 - p2
+        h2h[t2][1] += p2 - p1
+        if p1 > p2:
+            h2h[t1][0] += 1
+        elif p2 > p1:
+            h2h[t2][0] += 1
+    return h2h
+
+def standings(conn):
+    """
+    Returns the league table as a list of team stat dicts with their rank
+    and point difference, sorted by wins, point difference and then the head
+    to head record among the tied teams. Served from memory until the teams
+    table is written to.
+    """
+    version = data_version(conn)
+    cached = _cached(_standings_cache, _standings_lock, conn, version)
+    if cached is not None:
+        return [dict(row) for row in cached]
+
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    c.execute("""SELECT id, name, g_played, g_won, g_lost, g_drawn, p_for,
+            p_against, p_for - p_against AS p_diff FROM teams
+            ORDER BY g_won DESC, p_diff DESC, name_key""")
+    rows = [dict(zip(r.keys(), r)) for r in c.fetchall()]
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["g_won"], row["p_diff"]), []).append(row["id"])
+    tied = dict((tid, key) for key, ids in groups.items() if len(ids) > 1
+            for tid in ids)
+    if tied:
+        h2h = _head_to_head(conn, tied)
+        order = dict((row["id"], i) for i, row in enumerate(rows))
+        rows.sort(key=lambda r: (-r["g_won"], -r["p_diff"],
+            -h2h.get(r["id"], (0, 0))[0], -h2h.get(r["id"], (0, 0))[1],
+            order[r["id"]]))
+    for rank, row in enumerate(rows):
+        row["rank"] = rank + 1
+
+    _cache(_standings_cache, _standings_lock, conn, version, rows)
+    return [dict(row) for row in rows]
+
 # --------------------------------------------------------------------------- #
 #                       Player related functions                              #
 # --------------------------------------------------------------------------- #
+def player_code(name, taken=()):
+    """
+    Returns the code of a player name: its first three letters, upper case.
+    When that is in `taken`, the first two letters are followed by each of
+    the later letters of the name in turn and then by 1, 2, 3..., so "Sam"
+    is SAM and "Samuel" on the same team SAU.
+    """
+    letters = "".join(name.split()).upper()
+    code = letters[:3]
+    if code not in taken:
+        return code
+    for letter in letters[3:]:
+        if letters[:2] + letter not in taken:
+            return letters[:2] + letter
+    n = 1
+    while "%s%d" % (letters[:2], n) in taken:
+        n += 1
+    return "%s%d" % (letters[:2], n)
+
+# The ids of all the players by (team_id, p_code), cached per connection
+# like the standings, until a player is added through this module or
+# another connection commits
+_players_cache = weakref.WeakKeyDictionary()
+_players_lock = threading.Lock()
+
+def invalidate_players():
+    """Drops all the cached player ids"""
+    with _players_lock:
+        _players_cache.clear()
+
+def player_ids(conn):
+    """Returns {(team_id, p_code): player id} of all the players. The map is
+    loaded with one query and served from memory until the next add_player
+    or update_player_counts, or a commit by another connection."""
+    version = data_version(conn)
+    ids = _cached(_players_cache, _players_lock, conn, version)
+    if ids is not None:
+        return ids
+    c = conn.cursor()
+    c.execute("SELECT team_id, p_code, id FROM players")
+    ids = dict(((tid, code), pid) for tid, code, pid in c)
+    _cache(_players_cache, _players_lock, conn, version, ids)
+    return ids
+
+def resolve_players(conn, team_id, codes):
+    """Returns the player ids of the codes of a team, None for the unknown
+    ones, with at most one query for the whole list"""
+    ids = player_ids(conn)
+    return [ids.get((team_id, code)) for code in codes]
+
 def player_count(conn, team_id):
     """Returns the number of players associated with a particular team"""
     c = conn.cursor()
-    c.execute("SELECT id FROM players WHERE team_id=?", (team_id,))
-    return len(c.fetchall())
+    c.execute("SELECT COUNT(*) FROM players WHERE team_id=?", (team_id,))
+    return c.fetchone()[0]
+
+# The analysis credits and the players columns they are counted in
+PLAYER_COUNTERS = (("catch", "catches"), ("drop", "drops"), ("throw", "throws"),
+        ("snatch", "snatches"), ("foul", "fouls"))
+
+def update_player_counts(conn, counts):
+    '''
+    Adds the analysed credits to the players counters with one batched
+    upsert. `counts` maps (team_id, p_code) to a dict of credits as returned
+    by analyse_game_string. Unknown codes are added as players named by
+    their code. Doesn't commit.
+    '''
+    invalidate_players()
+    cols = ", ".join(col for _, col in PLAYER_COUNTERS)
+    updates = ", ".join("%s = %s + excluded.%s" % (col, col, col)
+            for _, col in PLAYER_COUNTERS)
+    c = conn.cursor()
+    c.executemany("""INSERT INTO players (name, p_code, team_id, %s)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(team_id, p_code) DO UPDATE SET %s""" % (cols, updates),
+            [(code, code, tid) + tuple(cred[key] for key, _ in PLAYER_COUNTERS)
+                for (tid, code), cred in sorted(counts.items())])
+
+def reset_player_counts(conn):
+    '''Sets the counters of all the players to 0. Doesn't commit.'''
+    c = conn.cursor()
+    c.execute("UPDATE players SET %s" %
+            ", ".join("%s = 0" % col for _, col in PLAYER_COUNTERS))
 
 def player_stats(conn, player_id):
     """Returns the statistics of the player id"""
-    conn.row_factory = sqlite3.Row
     c = conn.cursor()
+    c.row_factory = sqlite3.Row
     c.execute("SELECT * FROM players WHERE id=?", (player_id,))
     stats = c.fetchone()
     return dict(zip(stats.keys(), stats))
@@ -169,7 +723,7 @@ def player_stats(conn, player_id):
 def player_fullname(conn, player_code):
     """Returns the full name of the player when the code is supplied"""
     c = conn.cursor()
-    c.execute("SELECT name FROM player WHERE p_code=?", (player_code,))
+    c.execute("SELECT name FROM players WHERE p_code=?", (player_code,))
     return c.fetchone()[0]
 
 
@@ -178,13 +732,26 @@ def player_fullname(conn, player_code):
 # --------------------------------------------------------------------------- #
 def game_string(conn, game_id):
     """Returns the pass strings of the given game"""
-    conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT pass_string, team_id FROM passes WHERE game_id=?", (game_id,))
-    return [dict(zip(g.keys(), g)) for g in c.fetchall()]
+    return [{"pass_string": pass_text(pstr), "team_id": tid}
+            for pstr, tid in c.fetchall()]
 
+def iter_passes(conn, team_id=None, raw=False):
+    """Yields the (team_id, pass_string) of all the stored pass strings, or
+    of a team's, in the order they were added, streaming the passes table.
+    raw=True yields the stored values as they are, see pass_text()."""
+    sql = "SELECT team_id, pass_string FROM passes"
+    args = ()
+    if team_id is not None:
+        sql += " WHERE team_id = ?"
+        args = (team_id,)
+    c = conn.cursor()
+    c.execute(sql + " ORDER BY id", args)
+    for tid, pstr in c:
+        yield tid, (pstr if raw else pass_text(pstr))
 
 
 if __name__ == "__main__":
-    print "This file cannot be run as a script. Import it and use."
+    print("This file cannot be run as a script. Import it and use.")
 
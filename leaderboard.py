@@ -0,0 +1,270 @@
+"""
+Leaderboards of the players and teams, over all their games and over
+rolling windows of their last games.
+
+The games of every team are numbered in the order they were stored, and
+the credits and result of every player of the team in each game are kept
+in the leader_games table, one bucket per game. The team's own row has the
+code ''. For every span of SPANS (the last n games of the team, 0 for all
+of them) leader_totals holds the sums of the buckets in the window, which
+gamedb keeps up to date as pass strings are added: the new game is added
+and the game sliding out of the window subtracted, for the players of that
+team only. The value of every stat of STATS is stored in the leaders table
+with an index by (span, stat, kind, value), so the top k is read from the
+index in O(k log n) however long the history.
+
+The windows count games rather than time: the games table has no date, so
+a board like "the best drop rate this month" is approximated by the last
+few games of each team, e.g. span 5.
+
+    python leaderboard.py --db frisbee.db drop_rate --span 5 -k 10
+"""
+from __future__ import division, print_function
+
+import argparse
+
+from frisbee import Passes, analyse_game_string
+from gamedb import PLAYER_COUNTERS, pass_text
+
+# Rolling windows, in games of a team; 0 is all its games
+SPANS = (0, 5, 10)
+
+COUNTERS = [col for _, col in PLAYER_COUNTERS]
+RESULTS = ["games", "wins", "draws", "losses", "points", "conceded"]
+FIELDS = RESULTS + COUNTERS
+
+def _rate(part, whole):
+    return part / whole if whole else None
+
+# The stats of the leaderboards, computed from the totals of a window
+STATS = dict((field, (lambda f: lambda t: t[f])(field)) for field in FIELDS)
+STATS.update({
+    "margin": lambda t: t["points"] - t["conceded"],
+    "win_rate": lambda t: _rate(t["wins"], t["games"]),
+    # drops per hand the player passed on or lost
+    "drop_rate": lambda t: _rate(t["drops"], t["throws"] + t["drops"] + t["fouls"]),
+})
+# The stats where the lowest value leads
+LOWEST_FIRST = set(["drops", "fouls", "losses", "conceded", "drop_rate"])
+
+def _results(c, game_ids):
+    """Returns {(game_id, team_id): [wins, draws, losses, points, conceded]}"""
+    game_ids = sorted(game_ids)
+    results = {}
+    for i in range(0, len(game_ids), 500):
+        chunk = game_ids[i:i + 500]
+        c.execute("""SELECT id, team1_id, team2_id, point1, point2 FROM games
+                WHERE id IN (%s)""" % ", ".join("?" * len(chunk)), chunk)
+        for gid, t1, t2, p1, p2 in c.fetchall():
+            for tid, points, conceded in ((t1, p1, p2), (t2, p2, p1)):
+                results[(gid, tid)] = [int(points > conceded),
+                        int(points == conceded), int(points < conceded),
+                        points, conceded]
+    return results
+
+def _game_rows(pass_string, result, known=()):
+    """Returns {p_code: values of FIELDS} of a team's pass string in a game,
+    with the team's row under ''. Codes already in the game's bucket, the
+    known ones, only get their credits."""
+    played = [1] + (result or [0] * (len(RESULTS) - 1))
+    rows = {"": [0] * len(FIELDS)}
+    for code, cred in analyse_game_string(pass_string).items():
+        counts = [cred[key] for key, _ in PLAYER_COUNTERS]
+        head = [0] * len(RESULTS) if code in known else played
+        rows[code] = head + counts
+        rows[""][len(RESULTS):] = [a + b for a, b in
+                zip(rows[""][len(RESULTS):], counts)]
+    if "" not in known:
+        rows[""][:len(RESULTS)] = played
+    return rows
+
+def _upsert(table, keys):
+    return """INSERT INTO %s (%s, %s) VALUES (%s)
+            ON CONFLICT(%s) DO UPDATE SET %s""" % (table, ", ".join(keys),
+            ", ".join(FIELDS), ", ".join("?" * (len(keys) + len(FIELDS))),
+            ", ".join(k for k in keys if k != "game_id"),
+            ", ".join("%s = %s + excluded.%s" % (f, f, f) for f in FIELDS))
+
+def _bucket(c, team_id, seq):
+    """Returns {p_code: values of FIELDS} of a team's game"""
+    c.execute("SELECT p_code, %s FROM leader_games WHERE team_id = ? AND seq = ?"
+            % ", ".join(FIELDS), (team_id, seq))
+    return dict((row[0], list(row[1:])) for row in c.fetchall())
+
+def _add_delta(deltas, span, team_id, rows, sign):
+    for code, values in rows.items():
+        total = deltas.get((span, team_id, code))
+        if total is None:
+            deltas[(span, team_id, code)] = [sign * v for v in values]
+        else:
+            for i, v in enumerate(values):
+                total[i] += sign * v
+
+def index_pass_strings(conn, passes, sign=1):
+    """Adds newly stored Passes to the game buckets and the rolling totals
+    of their teams, or takes the games of deleted ones out with a negative
+    sign"""
+    if sign < 0:
+        remove_games(conn, set(p.game_id for p in passes))
+        return
+    passes = sorted(passes, key=lambda p: (p.game_id, p.team_id))
+    if not passes:
+        return
+    c = conn.cursor()
+    results = _results(c, set(p.game_id for p in passes))
+    last, deltas = {}, {}
+    for p in passes:
+        tid = p.team_id
+        if tid not in last:
+            c.execute("""SELECT COALESCE(MAX(seq), 0) FROM leader_games
+                    WHERE team_id = ?""", (tid,))
+            last[tid] = c.fetchone()[0]
+        c.execute("""SELECT seq FROM leader_games WHERE game_id = ?
+                AND team_id = ? LIMIT 1""", (p.game_id, tid))
+        found = c.fetchone()
+        if found:
+            seq = found[0]
+            rows = _game_rows(p.string, None, _bucket(c, tid, seq))
+        else:
+            seq = last[tid] = last[tid] + 1
+            rows = _game_rows(p.string, results.get((p.game_id, tid)))
+        c.executemany(_upsert("leader_games",
+            ["team_id", "seq", "p_code", "game_id"]),
+            [(tid, seq, code, p.game_id) + tuple(values)
+                for code, values in rows.items()])
+        for span in SPANS:
+            if span and seq <= last[tid] - span:
+                continue
+            _add_delta(deltas, span, tid, rows, 1)
+            if span and not found and seq > span:
+                _add_delta(deltas, span, tid, _bucket(c, tid, seq - span), -1)
+    c.executemany(_upsert("leader_totals", ["span", "team_id", "p_code"]),
+            [key + tuple(values) for key, values in deltas.items()])
+    _update_leaders(c, deltas)
+
+def _update_leaders(c, keys):
+    """Writes the stats of the (span, team_id, p_code) keys from their
+    totals, dropping the players without games in their window. Only the
+    stats whose value changed are written."""
+    stats, gone = [], []
+    for key in keys:
+        c.execute("""SELECT %s FROM leader_totals WHERE span = ?
+                AND team_id = ? AND p_code = ?""" % ", ".join(FIELDS), key)
+        row = c.fetchone()
+        if row is None:
+            continue
+        totals = dict(zip(FIELDS, row))
+        if totals["games"] <= 0:
+            gone.append(key)
+            continue
+        span, tid, code = key
+        stats.extend((span, stat, int(code == ""), func(totals), tid, code)
+                for stat, func in STATS.items())
+    for table in ("leaders", "leader_totals"):
+        c.executemany("""DELETE FROM %s WHERE span = ? AND team_id = ?
+                AND p_code = ?""" % table, gone)
+    c.executemany("""INSERT INTO leaders (span, stat, is_team, value, team_id,
+            p_code) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(span, team_id, p_code, stat) DO UPDATE
+            SET value = excluded.value WHERE value IS NOT excluded.value""",
+            stats)
+
+def _rebuild_teams(c, team_ids):
+    """Recomputes the totals and stats of teams from their game buckets"""
+    keys = []
+    for tid in team_ids:
+        for span in SPANS:
+            c.execute("DELETE FROM leaders WHERE span = ? AND team_id = ?",
+                    (span, tid))
+            c.execute("DELETE FROM leader_totals WHERE span = ? AND team_id = ?",
+                    (span, tid))
+        c.execute("SELECT COALESCE(MAX(seq), 0) FROM leader_games WHERE team_id = ?",
+                (tid,))
+        last = c.fetchone()[0]
+        for span in SPANS:
+            c.execute("""INSERT INTO leader_totals
+                    SELECT ?, team_id, p_code, %s FROM leader_games
+                    WHERE team_id = ? AND seq > ? GROUP BY p_code""" %
+                    ", ".join("SUM(%s)" % f for f in FIELDS),
+                    (span, tid, last - span if span else 0))
+            c.execute("""SELECT span, team_id, p_code FROM leader_totals
+                    WHERE span = ? AND team_id = ?""", (span, tid))
+            keys.extend(c.fetchall())
+    _update_leaders(c, keys)
+
+def remove_games(conn, game_ids):
+    """Takes deleted games out of the buckets, numbering the later games of
+    their teams down, and recomputes the totals of those teams"""
+    game_ids = list(game_ids)
+    if not game_ids:
+        return
+    marks = ", ".join("?" * len(game_ids))
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT team_id FROM leader_games WHERE game_id IN (%s)"
+            % marks, game_ids)
+    teams = [row[0] for row in c.fetchall()]
+    c.execute("DELETE FROM leader_games WHERE game_id IN (%s)" % marks, game_ids)
+    for tid in teams:
+        c.execute("""SELECT DISTINCT seq FROM leader_games WHERE team_id = ?
+                ORDER BY seq""", (tid,))
+        # in increasing order, every new number is free when it is used
+        c.executemany("""UPDATE leader_games SET seq = ?
+                WHERE team_id = ? AND seq = ?""",
+                [(new, tid, old) for new, (old,) in
+                    enumerate(c.fetchall(), 1) if new != old])
+    _rebuild_teams(c, teams)
+
+def rebuild_leaderboards(conn):
+    """Recomputes the leaderboard tables from the stored pass strings"""
+    c = conn.cursor()
+    for table in ("leaders", "leader_totals", "leader_games"):
+        c.execute("DELETE FROM %s" % table)
+    c.execute("SELECT pass_string, game_id, team_id FROM passes ORDER BY id")
+    index_pass_strings(conn, [Passes(pass_text(pstr), gid, tid)
+        for pstr, gid, tid in c.fetchall()])
+
+def top(conn, stat, k=10, span=0, teams=False, ascending=None):
+    """
+    Returns the k leading players, or teams, by a stat of STATS over the
+    last `span` games of their team (0 for all the games) as (team_id,
+    p_code, value) tuples, p_code being '' for teams. The lowest values
+    lead for the stats of LOWEST_FIRST unless `ascending` is given. Players
+    and teams without a value, such as a rate of nothing, aren't listed.
+    """
+    if stat not in STATS or span not in SPANS:
+        raise ValueError("no leaderboard of %s over %s games" % (stat, span))
+    if ascending is None:
+        ascending = stat in LOWEST_FIRST
+    order = "ASC" if ascending else "DESC"
+    c = conn.cursor()
+    c.execute("""SELECT team_id, p_code, value FROM leaders
+            WHERE span = ? AND stat = ? AND is_team = ? AND value IS NOT NULL
+            ORDER BY value %s, team_id %s, p_code %s LIMIT ?""" %
+            (order, order, order), (span, stat, int(teams), k))
+    return c.fetchall()
+
+def main():
+    from gamedb import open_db, close_db, commit_data
+    parser = argparse.ArgumentParser(description="Print a leaderboard")
+    parser.add_argument("stat", choices=sorted(STATS))
+    parser.add_argument("--db", default="frisbee.db")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--span", type=int, default=0, choices=SPANS,
+            help="last games of each team (default: all)")
+    parser.add_argument("--teams", action="store_true")
+    parser.add_argument("--rebuild", action="store_true",
+            help="recompute the leaderboards from the stored passes first")
+    args = parser.parse_args()
+
+    conn = open_db(args.db)
+    if args.rebuild:
+        rebuild_leaderboards(conn)
+        commit_data(conn)
+    names = dict(conn.execute("SELECT id, name FROM teams"))
+    for rank, (tid, code, value) in enumerate(top(conn, args.stat, args.k,
+            args.span, args.teams), 1):
+        print("%3d. %-20s %-6s %g" % (rank, names.get(tid, tid), code, value))
+    close_db(conn)
+
+if __name__ == "__main__":
+    main()
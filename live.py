@@ -0,0 +1,160 @@
+"""
+Live ingestion of a game as it is played.
+
+Hands are added one at a time (or a possession line at a time) as they are
+written down. Every hand updates the running credits, points and THEORY.md
+work of its player in O(1), so the scoreboard is always current. When the
+game ends, finalize() stores it like an imported sheet, without reparsing.
+"""
+from __future__ import division
+
+from frisbee import (DROP, FOUL, SNATCH, POINT, CREDITS, GameRow, PassesRow,
+        tokenize_hand, add_creds)
+from economy import WEIGHTS
+from gamedb import add_game, add_pass_string, update_player_counts, commit_data
+
+class LiveTeam:
+    """The running state of one team in a live game"""
+    def __init__(self, team_id):
+        self.team_id = team_id
+        self.creds = {}
+        self.work = {}
+        self.total_work = 0.0
+        self.points = 0
+        self.lines = []
+        self.hands = []     # hands of the current possession
+
+    def credit(self, code, key):
+        self.creds[code][key] += 1
+        self.work[code] += WEIGHTS[key]
+        self.total_work += WEIGHTS[key]
+
+    def add_hand(self, hand):
+        """Adds a hand to the current possession. Returns True if its marker
+        ended the possession."""
+        code, flags = tokenize_hand(hand)
+        if not code:
+            raise ValueError("Hand without a player code: %r" % hand)
+        if code not in self.creds:
+            self.creds[code] = dict.fromkeys(CREDITS, 0)
+            self.work[code] = 0.0
+        if flags & SNATCH:
+            self.credit(code, "snatch")
+        elif self.hands:
+            self.credit(code, "catch")
+
+        if flags & DROP:
+            self.credit(code, "drop")
+        elif flags & FOUL:
+            self.credit(code, "foul")
+        elif not flags & POINT:
+            self.credit(code, "throw")
+        if flags & POINT:
+            self.points += 1
+        self.hands.append(hand)
+        if flags & (DROP | FOUL | POINT):
+            self.end_possession()
+            return True
+        return False
+
+    def end_possession(self):
+        """Ends the current possession, for the ones without a marker"""
+        if self.hands:
+            self.lines.append("-".join(self.hands))
+            self.hands = []
+
+    @property
+    def effectiveness(self):
+        """x = points / sum of work of THEORY.md"""
+        return self.points / self.total_work if self.total_work else 0.0
+
+    def contribution(self, code):
+        """The offence contribution of a player so far"""
+        return self.work[code] * self.effectiveness
+
+    @property
+    def string(self):
+        """The pass string of the possessions so far"""
+        return "".join(line + "\n" for line in self.lines)
+
+class LiveGame:
+    """A game between two teams being ingested hand by hand"""
+    def __init__(self, team1_id, team2_id):
+        self.teams = {team1_id: LiveTeam(team1_id),
+                team2_id: LiveTeam(team2_id)}
+        self.order = (team1_id, team2_id)
+        self.game_id = None
+
+    def team(self, team_id):
+        return self.teams[team_id]
+
+    def add_hand(self, team_id, hand):
+        """Adds one hand like 'SAM(S)' of a team"""
+        if self.game_id is not None:
+            raise ValueError("The game has been finalized")
+        return self.teams[team_id].add_hand(hand)
+
+    def add_line(self, team_id, line):
+        """Adds a whole possession line like 'MAG-SAM-BHA(P)' of a team.
+        Raises ValueError, adding nothing, for a line with a hand without a
+        code or a drop, foul or point marker before its last hand."""
+        line = line.strip()
+        if not line:
+            return
+        hands = line.split("-")
+        for i, hand in enumerate(hands):
+            code, flags = tokenize_hand(hand)
+            if not code:
+                raise ValueError("Hand without a player code: %r" % hand)
+            if flags & (DROP | FOUL | POINT) and i < len(hands) - 1:
+                raise ValueError("Possession %r continues after %r" %
+                        (line, hand))
+        for hand in hands:
+            self.add_hand(team_id, hand)
+        self.teams[team_id].end_possession()
+
+    def end_possession(self, team_id):
+        self.teams[team_id].end_possession()
+
+    @property
+    def score(self):
+        """The points of both teams in order"""
+        return tuple(self.teams[tid].points for tid in self.order)
+
+    def scoreboard(self):
+        """Returns the live stats of both teams: points, effectiveness and
+        the credits, work and contribution of every player"""
+        board = {}
+        for tid, team in self.teams.items():
+            board[tid] = {"points": team.points,
+                    "effectiveness": team.effectiveness,
+                    "players": dict((code, dict(team.creds[code],
+                        work=team.work[code],
+                        contribution=team.contribution(code)))
+                        for code in team.creds)}
+        return board
+
+    def finalize(self, conn):
+        """Stores the game, its pass strings and the player counters in one
+        transaction, rolled back if any of them fails. Returns the id of the
+        game."""
+        if self.game_id is not None:
+            return self.game_id
+        t1, t2 = self.order
+        for team in self.teams.values():
+            team.end_possession()
+        p1, p2 = self.score
+        try:
+            game_id = add_game(conn, GameRow(t1, t2, p1, p2))
+            counts = {}
+            for tid in self.order:
+                team = self.teams[tid]
+                add_pass_string(conn, PassesRow(team.string, game_id, tid))
+                add_creds(counts, tid, team.creds)
+            update_player_counts(conn, counts)
+            commit_data(conn)
+        except Exception:
+            conn.rollback()
+            raise
+        self.game_id = game_id
+        return game_id
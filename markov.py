@@ -0,0 +1,206 @@
+"""
+Markov chain model of the possessions of each team, with Monte Carlo
+simulation of possessions and matches.
+
+A possession is a walk through the players of a team: it starts with a
+player, who passes to a teammate or ends it with an outcome, none, drop,
+foul or point (see chains.OUTCOMES). The start and transition probabilities
+of every team are fitted from the event table of the stored passes.
+
+The simulations run batches of possessions at once as NumPy arrays: every
+step draws the next state of all the possessions still going, so the only
+Python loop is over the hands of the longest possession. Matches give each
+team as many possessions as one of its recorded games, drawn at random.
+Only the offence is modelled, as in THEORY.md, so a team's points don't
+depend on the opponent.
+
+    python markov.py --db frisbee.db "FIRE B" "BULLET A" [--matches 100000]
+"""
+from __future__ import division, print_function
+
+import argparse
+
+import numpy as np
+
+from chains import outcome
+from economy import weight_vector
+from events import START, events_from_db
+from frisbee import CREDITS, DROP, FOUL, POINT, SNATCH
+
+# The absorbing states, after the players of a team
+OUTCOMES = (0, DROP, FOUL, POINT)
+NONE, DROPPED, FOULED, SCORED = range(len(OUTCOMES))
+CATCH, DROPS, THROW, SNATCHES, FOULS = [CREDITS.index(key)
+        for key in ("catch", "drop", "throw", "snatch", "foul")]
+
+class TeamModel:
+    """The possession chain of a team: player codes, the probabilities of
+    the starting player, of snatching at the start and of the transitions
+    from every player to the players and then the OUTCOMES, and the number
+    of possessions of each of its games"""
+    def __init__(self, team_id, codes, start, snatch, transitions, games):
+        self.team_id = team_id
+        self.codes = codes
+        self.start = start
+        self.snatch = snatch
+        self.transitions = transitions
+        self.games = games
+
+    def expected_visits(self):
+        """Returns the expected number of hands of every player in a
+        possession, from the fundamental matrix of the absorbing chain"""
+        n = len(self.codes)
+        q = self.transitions[:, :n]
+        return np.linalg.solve((np.eye(n) - q).T, self.start)
+
+    def expected_points(self):
+        """Returns the probability that a possession ends with a point"""
+        n = len(self.codes)
+        return float(self.expected_visits().dot(self.transitions[:, n + SCORED]))
+
+def fit(table):
+    """Fits a TeamModel for every team of an EventTable. Returns
+    {team_id: TeamModel}."""
+    models = {}
+    ends = np.array([OUTCOMES.index(outcome(flags)) for flags in range(16)])
+    for team_id in np.unique(table.team):
+        rows = table.select(table.team == team_id)
+        players, thrower = np.unique(rows.thrower, return_inverse=True)
+        n = len(players)
+        # every receiver throws the next hand, so is one of the players
+        receiver = np.searchsorted(players, rows.receiver)
+        target = np.where(rows.receiver >= 0, np.minimum(receiver, n - 1),
+                n + ends[rows.flags & 15])
+        counts = np.zeros((n, n + len(OUTCOMES)))
+        np.add.at(counts, (thrower, target), 1)
+        transitions = counts / counts.sum(axis=1)[:, None]
+
+        starts = (rows.flags & START) != 0
+        start = np.bincount(thrower[starts], minlength=n).astype(float)
+        snatched = np.bincount(thrower[starts & ((rows.flags & SNATCH) != 0)],
+                minlength=n)
+        snatch = np.zeros(n)
+        np.divide(snatched, start, out=snatch, where=start != 0)
+        start /= start.sum()
+
+        # possessions of every game of the team
+        firsts = rows.game[starts]
+        games = np.unique(firsts, return_counts=True)[1]
+        models[int(team_id)] = TeamModel(int(team_id),
+                [table.codes[p] for p in players], start, snatch, transitions,
+                games)
+    return models
+
+def fit_db(conn):
+    """Fits the models of all the teams from the passes stored in the db"""
+    return fit(events_from_db(conn))
+
+def simulate_possessions(model, n, rng, max_hands=200):
+    """
+    Simulates n possessions of a team. Returns (outcomes, credits): the
+    index in OUTCOMES of the end of every possession, and the total credits
+    of every player as a len(codes) x len(CREDITS) array, counted as
+    analyse_game_string does. Possessions still going after max_hands end
+    with no outcome.
+    """
+    k = len(model.codes)
+    cum = np.cumsum(model.transitions, axis=1)
+    cum[:, -1] = 1.0
+    start = np.cumsum(model.start)
+    state = np.minimum(np.searchsorted(start, rng.random_sample(n),
+        side="right"), k - 1)
+    credits = np.zeros((k, len(CREDITS)))
+    snatched = rng.random_sample(n) < model.snatch[state]
+    credits[:, SNATCHES] = np.bincount(state[snatched], minlength=k)
+
+    ends = np.full(n, NONE, dtype=np.intp)
+    active = np.arange(n)
+    for _ in range(max_hands):
+        s = state[active]
+        u = rng.random_sample(len(s))
+        nxt = (u[:, None] >= cum[s]).sum(axis=1)
+        passed = nxt < k
+        end = nxt - k
+        credits[:, THROW] += np.bincount(s[passed | (end == NONE)], minlength=k)
+        credits[:, CATCH] += np.bincount(nxt[passed], minlength=k)
+        credits[:, DROPS] += np.bincount(s[end == DROPPED], minlength=k)
+        credits[:, FOULS] += np.bincount(s[end == FOULED], minlength=k)
+        ends[active[~passed]] = end[~passed]
+        active = active[passed]
+        state[active] = nxt[passed]
+        if not len(active):
+            break
+    return ends, credits
+
+def simulate_points(model, counts, rng, batch=200000):
+    """Returns (points of every entry of counts, credits) after simulating
+    counts[i] possessions for entry i, in batches of possessions"""
+    counts = np.asarray(counts, dtype=np.intp)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    scored = np.empty(len(owner), dtype=bool)
+    credits = np.zeros((len(model.codes), len(CREDITS)))
+    for first in range(0, len(owner), batch):
+        ends, c = simulate_possessions(model, min(batch, len(owner) - first), rng)
+        scored[first:first + len(ends)] = ends == SCORED
+        credits += c
+    return np.bincount(owner, weights=scored, minlength=len(counts)), credits
+
+def contributions(model, credits, points, weights=None):
+    """Returns [(code, work, contribution)] of the players of a team from
+    their credits and the points scored, as economy.contribution does"""
+    work = credits.dot(weight_vector(weights))
+    total = work.sum()
+    x = points / total if total else 0.0
+    return [(code, float(w), float(w * x)) for code, w in zip(model.codes, work)]
+
+def simulate_match(model1, model2, matches=100000, seed=None, weights=None):
+    """
+    Simulates matches between two teams. Returns a dict with the
+    probabilities of a "win", "draw" and "loss" of the first team, the
+    expected "points" of each team and the expected "players" work and
+    contribution per match of each team, keyed by team id.
+    """
+    rng = np.random.RandomState(seed)
+    points, players = [], {}
+    for model in (model1, model2):
+        counts = model.games[rng.randint(len(model.games), size=matches)]
+        scored, credits = simulate_points(model, counts, rng)
+        points.append(scored)
+        players[model.team_id] = contributions(model, credits / matches,
+                scored.mean(), weights)
+    p1, p2 = points
+    return {"win": float(np.mean(p1 > p2)), "draw": float(np.mean(p1 == p2)),
+            "loss": float(np.mean(p1 < p2)),
+            "points": (float(p1.mean()), float(p2.mean())),
+            "players": players}
+
+def main():
+    from gamedb import open_db, close_db, team_id
+    parser = argparse.ArgumentParser(description="Simulate matches")
+    parser.add_argument("team1")
+    parser.add_argument("team2")
+    parser.add_argument("--db", default="frisbee.db")
+    parser.add_argument("--matches", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    conn = open_db(args.db)
+    ids = [team_id(conn, name) for name in (args.team1, args.team2)]
+    models = fit_db(conn)
+    close_db(conn)
+    for name, tid in zip((args.team1, args.team2), ids):
+        if tid not in models:
+            parser.error("no passes of team %s" % name)
+    result = simulate_match(models[ids[0]], models[ids[1]], args.matches,
+            args.seed)
+    print("%s win %.3f, draw %.3f, %s win %.3f" % (args.team1, result["win"],
+        result["draw"], args.team2, result["loss"]))
+    for name, tid, points in zip((args.team1, args.team2), ids,
+            result["points"]):
+        print("\n%s: %.2f expected points" % (name, points))
+        for code, work, contrib in sorted(result["players"][tid],
+                key=lambda p: -p[2]):
+            print("  %-6s work %6.2f  contribution %6.2f" % (code, work, contrib))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Optional instrumentation of the db queries and the analysis pipeline.
+
+Nothing is measured until enable() is called, so there is no overhead when
+it is off. enable() wraps the functions listed in INSTRUMENTED in timers,
+wherever they were imported, and the connections opened through gamedb
+afterwards time their queries and count the rows they touch. For every
+function a latency histogram and its number of queries and rows are kept,
+and for every outermost call (an operation) the number of queries it ran.
+Queries slower than the threshold are logged with their EXPLAIN QUERY PLAN
+to the "frisbee.slow" logger and kept in slow_queries.
+
+    import metrics
+    metrics.enable(slow=0.05)
+    frisbee.import_game_data("games/game_1.txt")
+    print(metrics.dump())
+
+Connections opened before enable() and calls made in the worker processes
+of a pool are not counted.
+"""
+import bisect
+import collections
+import functools
+import itertools
+import logging
+import os.path
+import sqlite3
+import sys
+import threading
+import time
+
+import frisbee
+import gamedb
+
+# The instrumented functions of each module
+INSTRUMENTED = [
+    (gamedb, ["add_team", "add_player", "add_game", "add_games",
+        "add_pass_string", "add_pass_strings", "delete_games", "import_ledger",
+        "record_imports", "team_id", "team_ids", "update_team_scores",
+        "update_teams_scores", "games_played", "wins", "losses", "draws",
+        "team_stats", "standings", "player_ids", "player_count",
+        "update_player_counts", "reset_player_counts", "player_stats",
+        "player_fullname", "game_string"]),
+    (frisbee, ["parse_gamefile", "analyse_game_string", "resolve_game",
+        "import_game_data", "import_games", "rebuild_player_stats"]),
+]
+
+# Upper bounds of the latency (seconds) and the queries per operation buckets
+SECONDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+QUERIES = (1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000)
+
+log = logging.getLogger("frisbee.slow")
+log.addHandler(logging.NullHandler())
+clock = getattr(time, "perf_counter", time.time)
+
+class Histogram(object):
+    """Counts of the observed values by bucket upper bound, with their sum"""
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        """The lines of the histogram in the Prometheus text format"""
+        total = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            yield '%s_bucket{%sle="%s"} %d' % (name, labels, bound, total)
+        labels = "{%s}" % labels.rstrip(",") if labels else ""
+        yield "%s_sum%s %s" % (name, labels, self.sum)
+        yield "%s_count%s %d" % (name, labels, self.count)
+
+class CallStats(object):
+    """The measures of one instrumented function"""
+    def __init__(self):
+        self.seconds = Histogram(SECONDS)
+        self.operations = Histogram(QUERIES)
+        self.queries = 0
+        self.rows = 0
+
+_lock = threading.Lock()
+_local = threading.local()
+_patched = []
+calls = {}
+queries = Histogram(SECONDS)
+slow_queries = collections.deque(maxlen=100)
+threshold = 0.1
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _record(name, elapsed, frame, outermost):
+    with _lock:
+        stats = calls.get(name)
+        if stats is None:
+            stats = calls[name] = CallStats()
+        stats.seconds.observe(elapsed)
+        stats.queries += frame[0]
+        stats.rows += frame[1]
+        if outermost:
+            stats.operations.observe(frame[0])
+
+def _timed(name, func):
+    """Wraps func to record its latency, queries and rows under name"""
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        stack = _stack()
+        frame = [0, 0]
+        stack.append(frame)
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            stack.pop()
+            _record(name, elapsed, frame, not stack)
+    timed.__wrapped__ = func
+    return timed
+
+def _count_rows(n):
+    for frame in _stack():
+        frame[1] += n
+
+def explain(database, sql, params):
+    """Returns the EXPLAIN QUERY PLAN of a statement, one step per line.
+    It runs on a connection of its own, as Python 2 commits the open
+    transaction before such a statement, and gives up rather than wait for
+    a lock."""
+    if database == ":memory:":
+        return ""
+    try:
+        conn = sqlite3.connect(database, timeout=0)
+        try:
+            c = conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return "\n".join(row[-1] for row in c)
+        finally:
+            conn.close()
+    except (sqlite3.Error, ValueError):
+        return ""
+
+def _query(cursor, sql, params, elapsed):
+    stack = _stack()
+    for frame in stack:
+        frame[0] += 1
+    if cursor.rowcount > 0:
+        _count_rows(cursor.rowcount)
+    with _lock:
+        queries.observe(elapsed)
+    if elapsed >= threshold:
+        plan = explain(cursor.connection.database, sql, params)
+        slow_queries.append((elapsed, sql, plan))
+        log.warning("%.4f s: %s%s", elapsed, " ".join(sql.split()),
+                "\n" + plan if plan else "")
+
+_next = getattr(sqlite3.Cursor, "__next__", None) or sqlite3.Cursor.next
+
+class Cursor(sqlite3.Cursor):
+    """A cursor timing its statements and counting the rows it returns"""
+    def execute(self, sql, params=()):
+        start = clock()
+        sqlite3.Cursor.execute(self, sql, params)
+        _query(self, sql, params, clock() - start)
+        return self
+
+    def executemany(self, sql, seq):
+        seq = iter(seq)
+        first = next(seq, None)
+        if first is None:
+            return sqlite3.Cursor.executemany(self, sql, [])
+        start = clock()
+        sqlite3.Cursor.executemany(self, sql, itertools.chain([first], seq))
+        _query(self, sql, first, clock() - start)
+        return self
+
+    def fetchone(self):
+        row = sqlite3.Cursor.fetchone(self)
+        if row is not None:
+            _count_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = sqlite3.Cursor.fetchmany(self, size or self.arraysize)
+        _count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = sqlite3.Cursor.fetchall(self)
+        _count_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = _next(self)
+        _count_rows(1)
+        return row
+    next = __next__
+
+class Connection(gamedb.Connection):
+    """A connection whose cursors, including those of execute(), are
+    instrumented"""
+    def __init__(self, database, *args, **kwargs):
+        sqlite3.Connection.__init__(self, database, *args, **kwargs)
+        self.database = database
+
+    def cursor(self, factory=Cursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+def _loaded_as(module):
+    """Returns the module and __main__ if that is the same file run as a
+    script, such as frisbee.py"""
+    main = sys.modules.get("__main__")
+    path = getattr(main, "__file__", None)
+    if path and (os.path.splitext(os.path.realpath(path))[0] ==
+            os.path.splitext(os.path.realpath(module.__file__))[0]):
+        return [module, main]
+    return [module]
+
+def enable(slow=None):
+    """Starts measuring. slow is the threshold in seconds above which the
+    queries are logged."""
+    global threshold
+    if slow is not None:
+        threshold = slow
+    with _lock:
+        if _patched:
+            return
+        gamedb.connection_factory = Connection
+        wrappers = {}
+        for module, names in INSTRUMENTED:
+            for source in _loaded_as(module):
+                for name in names:
+                    func = getattr(source, name)
+                    wrappers[id(func)] = (func, _timed(
+                        "%s.%s" % (module.__name__, name), func))
+        # the functions are replaced in every module that imported them
+        for module in list(sys.modules.values()):
+            if module is None:
+                continue
+            for name, obj in list(vars(module).items()):
+                found = wrappers.get(id(obj))
+                if found is not None and found[0] is obj:
+                    setattr(module, name, found[1])
+                    _patched.append((module, name, obj))
+
+def disable():
+    """Stops measuring and restores the original functions. The collected
+    measures are kept until reset()."""
+    with _lock:
+        gamedb.connection_factory = gamedb.Connection
+        while _patched:
+            module, name, func = _patched.pop()
+            setattr(module, name, func)
+
+def enabled():
+    return bool(_patched)
+
+def reset():
+    """Drops all the collected measures"""
+    global queries
+    with _lock:
+        calls.clear()
+        queries = Histogram(SECONDS)
+        slow_queries.clear()
+
+def snapshot():
+    """Returns {function: dict(calls, seconds, queries, rows)}"""
+    with _lock:
+        return dict((name, dict(calls=s.seconds.count, seconds=s.seconds.sum,
+            queries=s.queries, rows=s.rows)) for name, s in calls.items())
+
+def dump():
+    """Returns the collected measures in the Prometheus text format"""
+    with _lock:
+        items = sorted(calls.items())
+        lines = ["# HELP frisbee_call_seconds Latency of the instrumented calls",
+                "# TYPE frisbee_call_seconds histogram"]
+        for name, stats in items:
+            lines.extend(stats.seconds.lines("frisbee_call_seconds",
+                'func="%s",' % name))
+        for metric, attr, text in (("queries", "queries", "Queries run"),
+                ("rows", "rows", "Rows returned or changed")):
+            lines.append("# HELP frisbee_call_%s_total %s by the calls" %
+                    (metric, text))
+            lines.append("# TYPE frisbee_call_%s_total counter" % metric)
+            lines.extend('frisbee_call_%s_total{func="%s"} %d' %
+                    (metric, name, getattr(stats, attr)) for name, stats in items)
+        lines.append("# HELP frisbee_operation_queries Queries per outermost call")
+        lines.append("# TYPE frisbee_operation_queries histogram")
+        for name, stats in items:
+            if stats.operations.count:
+                lines.extend(stats.operations.lines("frisbee_operation_queries",
+                    'func="%s",' % name))
+        lines.append("# HELP frisbee_query_seconds Latency of all the queries")
+        lines.append("# TYPE frisbee_query_seconds histogram")
+        lines.extend(queries.lines("frisbee_query_seconds", ""))
+        lines.append("# HELP frisbee_slow_queries Queries over the threshold")
+        lines.append("# TYPE frisbee_slow_queries gauge")
+        lines.append("frisbee_slow_queries %d" % len(slow_queries))
+    return "\n".join(lines) + "\n"
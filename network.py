@@ -0,0 +1,213 @@
+"""
+Pass networks as sparse matrices.
+
+Every pass of a possession is a directed edge from the thrower to the
+receiver. Edges are kept as three weighted adjacency matrices: completed
+passes, dropped passes and scoring passes (the assist graph). Players are
+the rows and columns, identified by their (team_id, code) key in
+PassNetwork.keys. Networks are built incrementally, one pass string at a
+time, and can follow the imports into a db, and the games deleted from it,
+through listen().
+"""
+import array
+import heapq
+import json
+import operator
+
+import numpy as np
+from scipy import sparse
+
+from frisbee import DROP, POINT, tokenize_hand
+import gamedb
+
+KINDS = ("pass", "drop", "score")
+
+# Edges logged before they are merged into the matrix of their kind
+COMPACT_EVERY = 65536
+
+class PassNetwork:
+    """Passer to receiver matrices of a game, a team or a whole season"""
+    def __init__(self, team_id=None, game_id=None, chain_lengths=(2, 3, 4)):
+        self.team_id = team_id
+        self.game_id = game_id
+        self.keys = []
+        self._index = {}
+        # rows, columns and weights, -1 for the passes taken back out, of the
+        # edges not merged into the matrices yet
+        self._edges = dict((kind, (array.array("i"), array.array("i"),
+            array.array("i"))) for kind in KINDS)
+        self.chains = dict((n, {}) for n in chain_lengths)
+        self._matrices = dict((kind, sparse.csr_matrix((0, 0)))
+                for kind in KINDS)
+
+    def _intern(self, key):
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._index[key] = len(self.keys)
+            self.keys.append(key)
+        return idx
+
+    def add_pass_string(self, team_id, pass_string, game_id=None, sign=1):
+        """Adds the passes of a team's pass string, or takes them back out
+        with a negative sign. Strings of other teams or games than the
+        network was created for are ignored."""
+        if self.team_id is not None and team_id != self.team_id:
+            return
+        if self.game_id is not None and game_id != self.game_id:
+            return
+        for seq in pass_string.split("\n"):
+            hands = [tokenize_hand(hand) for hand in seq.split("-")]
+            hands = [(self._intern((team_id, code)), flags)
+                    for code, flags in hands if code]
+            for (thrower, _), (receiver, flags) in zip(hands, hands[1:]):
+                self._add_edge("drop" if flags & DROP else "pass",
+                        thrower, receiver, sign)
+                if flags & POINT:
+                    self._add_edge("score", thrower, receiver, sign)
+            players = [idx for idx, _ in hands]
+            for n, counts in self.chains.items():
+                for i in range(len(players) - n + 1):
+                    chain = tuple(players[i:i + n])
+                    count = counts.get(chain, 0) + sign
+                    if count > 0:
+                        counts[chain] = count
+                    else:
+                        counts.pop(chain, None)
+
+    def remove_pass_string(self, team_id, pass_string, game_id=None):
+        """Takes the passes of a pass string added before back out"""
+        self.add_pass_string(team_id, pass_string, game_id, -1)
+
+    def _add_edge(self, kind, thrower, receiver, weight=1):
+        rows, cols, weights = self._edges[kind]
+        rows.append(thrower)
+        cols.append(receiver)
+        weights.append(weight)
+        if len(rows) >= COMPACT_EVERY:
+            self.matrix(kind)
+
+    def listen(self):
+        """Adds every pass string stored through gamedb from now on, and
+        takes those of the deleted games out. Returns the listener to give
+        to gamedb.remove_pass_listener()."""
+        def listener(conn, passes, sign):
+            for p in passes:
+                self.add_pass_string(p.team_id, p.string, p.game_id, sign)
+        gamedb.add_pass_listener(listener)
+        return listener
+
+    def matrix(self, kind="pass"):
+        """Returns the weighted adjacency matrix of a kind of edge as a CSR
+        matrix, entry [i, j] counting the passes from keys[i] to keys[j]. The
+        edges logged since the last call are merged into it first."""
+        m = self._matrices[kind]
+        rows, cols, weights = self._edges[kind]
+        n = len(self.keys)
+        if not rows and m.shape[0] == n:
+            return m
+        # players added since get empty rows and columns
+        indptr = np.concatenate([m.indptr,
+            np.repeat(m.indptr[-1:], n - m.shape[0])])
+        m = sparse.csr_matrix((m.data, m.indices, indptr), shape=(n, n))
+        m = (m + sparse.coo_matrix((np.array(weights, dtype=np.float64),
+            (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+            shape=(n, n))).tocsr()
+        m.eliminate_zeros()
+        self._matrices[kind] = m
+        del rows[:], cols[:], weights[:]
+        return m
+
+    def degrees(self, kind="pass"):
+        """Returns (out, in) arrays of the weighted degree of every player"""
+        m = self.matrix(kind)
+        return (np.asarray(m.sum(axis=1)).ravel(),
+                np.asarray(m.sum(axis=0)).ravel())
+
+    def centrality(self, kind="pass", damping=0.85, tol=1e-10, max_iter=200):
+        """Returns the PageRank of every player in the network, computed
+        with sparse matrix-vector products"""
+        m = self.matrix(kind)
+        n = m.shape[0]
+        if not n:
+            return np.zeros(0)
+        out = np.asarray(m.sum(axis=1)).ravel()
+        scale = np.zeros(n)
+        np.divide(1.0, out, out=scale, where=out != 0)
+        transition = sparse.diags(scale).dot(m).T.tocsr()
+        dangling = out == 0
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            new = damping * (transition.dot(rank) + rank[dangling].sum() / n)
+            new += (1 - damping) / n
+            if np.abs(new - rank).sum() < tol:
+                return new
+            rank = new
+        return rank
+
+    def top_chains(self, length=3, k=10):
+        """Returns the k most frequent chains of `length` players as a list
+        of (tuple of keys, count)"""
+        counts = self.chains[length]
+        top = heapq.nlargest(k, counts.items(), key=operator.itemgetter(1))
+        return [(tuple(self.keys[i] for i in chain), count)
+                for chain, count in top]
+
+    def assists(self):
+        """Returns the assist graph as (thrower key, scorer key, count) tuples,
+        most frequent first"""
+        m = self.matrix("score").tocoo()
+        order = np.argsort(-m.data, kind="mergesort")
+        return [(self.keys[m.row[i]], self.keys[m.col[i]], int(m.data[i]))
+                for i in order]
+
+    def save(self, filename):
+        """Saves the network to a .npz file, with the merged count of every
+        edge"""
+        arrays = {"keys": np.array(json.dumps(self.keys))}
+        for kind in KINDS:
+            m = self.matrix(kind).tocoo()
+            arrays[kind + "_rows"] = m.row.astype(np.int32)
+            arrays[kind + "_cols"] = m.col.astype(np.int32)
+            arrays[kind + "_weights"] = m.data.astype(np.int32)
+        for n, counts in self.chains.items():
+            arrays["chains_%d" % n] = np.array(list(counts.keys()),
+                    dtype=np.int32).reshape(-1, n)
+            arrays["chain_counts_%d" % n] = np.array(list(counts.values()),
+                    dtype=np.int64)
+        np.savez(filename, **arrays)
+
+def load(filename, team_id=None, game_id=None):
+    """Loads a network saved with PassNetwork.save()"""
+    with np.load(filename) as data:
+        lengths = sorted(int(name.split("_")[1]) for name in data.files
+                if name.startswith("chains_"))
+        net = PassNetwork(team_id, game_id, lengths)
+        for key in json.loads(str(data["keys"])):
+            net._intern(tuple(key))
+        for kind in KINDS:
+            rows, cols, weights = net._edges[kind]
+            rows.extend(data[kind + "_rows"].tolist())
+            cols.extend(data[kind + "_cols"].tolist())
+            weights.extend(data[kind + "_weights"].tolist())
+        for n in lengths:
+            net.chains[n] = dict(zip(map(tuple, data["chains_%d" % n].tolist()),
+                data["chain_counts_%d" % n].tolist()))
+    return net
+
+def network_from_db(conn, team_id=None, game_id=None):
+    """Builds the network of the pass strings stored in the db, optionally
+    limited to a team or a game"""
+    net = PassNetwork(team_id, game_id)
+    sql = "SELECT team_id, game_id, pass_string FROM passes"
+    args = []
+    if team_id is not None:
+        sql += " WHERE team_id = ?"
+        args.append(team_id)
+    if game_id is not None:
+        sql += (" AND" if args else " WHERE") + " game_id = ?"
+        args.append(game_id)
+    c = conn.cursor()
+    c.execute(sql + " ORDER BY id", args)
+    for tid, gid, pstr in c:
+        net.add_pass_string(tid, gamedb.pass_text(pstr), gid)
+    return net
@@ -0,0 +1,143 @@
+"""
+Compact binary encoding of pass strings.
+
+A team's pass string is stored as a blob of a small header, the player codes
+of the string (the dictionary), the number of hands of every possession and
+then one small int per hand: the index of its code in the dictionary times
+16 plus the marker flags of the hand, so a hand is a single byte for teams
+of up to 16 codes. The layout, all little endian:
+
+    magic "\\0P", format byte, codes (uint16), possessions (uint16),
+    length of the codes (uint16), the codes joined by '-',
+    hands per possession (uint8, uint16 if wide),
+    hands (uint8, uint16 if wide)
+
+The format byte holds the version in its high nibble and the WIDE_LENGTHS,
+WIDE_HANDS and UNTERMINATED bits. Only pass strings that decode back to the
+very same text are encoded, see encode(). Decoding needs no parsing: the
+columns can be read straight from the blob, as decode() and the events
+module do.
+"""
+import array
+import struct
+import sys
+
+# The markers written after the code of a hand for each of the 16 sets of
+# flags, built by suffixes()
+_SUFFIXES = None
+
+MAGIC = b"\0P"
+VERSION = 1
+WIDE_LENGTHS, WIDE_HANDS, UNTERMINATED = 1, 2, 4
+HEADER = struct.Struct("<2sBHHH")
+
+def _array(typecode, data=b""):
+    a = array.array(typecode)
+    if data:
+        if hasattr(a, "frombytes"):
+            a.frombytes(data)
+        else:
+            a.fromstring(data)
+        if sys.byteorder == "big" and a.itemsize > 1:
+            a.byteswap()
+    return a
+
+def _bytes(a):
+    if sys.byteorder == "big" and a.itemsize > 1:
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes() if hasattr(a, "tobytes") else a.tostring()
+
+def suffixes():
+    """Returns the markers of frisbee.MARKERS written after a code for each
+    of the 16 sets of flags, a snatch first as in 'PL1(S)*'. frisbee is
+    imported here as it needs gamedb, which needs us."""
+    global _SUFFIXES
+    if _SUFFIXES is None:
+        from frisbee import DROP, FOUL, SNATCH, POINT, MARKERS
+        markers = dict((flag, marker) for marker, flag in MARKERS)
+        _SUFFIXES = ["".join(markers[flag] for flag in (SNATCH, DROP, FOUL, POINT)
+            if flags & flag) for flags in range(16)]
+    return _SUFFIXES
+
+def is_encoded(value):
+    """Tells whether a passes.pass_string value is an encoded blob"""
+    return value is not None and value[:2] == MAGIC
+
+def encode(pass_string):
+    """Returns the blob of a pass string. Raises ValueError for the strings
+    that wouldn't decode back to the same text, such as those with empty
+    hands or lines, or markers in an unusual order."""
+    from frisbee import tokenize_hand
+    terminated = pass_string.endswith("\n")
+    text = pass_string[:-1] if terminated else pass_string
+    ids, codes = {}, []
+    lengths, hands = [], []
+    for line in (text.split("\n") if text else []):
+        parts = line.split("-")
+        for hand in parts:
+            code, flags = tokenize_hand(hand)
+            if not code:
+                raise ValueError("empty hand in %r" % line)
+            pid = ids.get(code)
+            if pid is None:
+                pid = ids[code] = len(codes)
+                codes.append(code)
+            hands.append(pid << 4 | flags)
+        lengths.append(len(parts))
+    joined = "-".join(codes).encode("ascii")
+    if len(codes) > 4096 or len(lengths) > 0xffff or len(joined) > 0xffff:
+        raise ValueError("pass string too large to encode")
+    fmt = VERSION << 4
+    if lengths and max(lengths) > 0xff:
+        fmt |= WIDE_LENGTHS
+    if len(codes) > 16:
+        fmt |= WIDE_HANDS
+    if text and not terminated:
+        fmt |= UNTERMINATED
+    blob = b"".join([HEADER.pack(MAGIC, fmt, len(codes), len(lengths),
+        len(joined)), joined,
+        _bytes(array.array("H" if fmt & WIDE_LENGTHS else "B", lengths)),
+        _bytes(array.array("H" if fmt & WIDE_HANDS else "B", hands))])
+    if decode_text(blob) != pass_string:
+        raise ValueError("pass string %r has no exact encoding" % pass_string)
+    return blob
+
+def layout(blob):
+    """Returns (format, codes, (offset, count, typecode) of the lengths,
+    (offset, count, typecode) of the hands) of a blob, from its header"""
+    blob = bytes(blob)
+    magic, fmt, ncodes, npos, size = HEADER.unpack_from(blob)
+    if magic != MAGIC or fmt >> 4 != VERSION:
+        raise ValueError("not an encoded pass string")
+    start = HEADER.size
+    codes = blob[start:start + size].decode("ascii").split("-") if ncodes else []
+    start += size
+    ltype = "H" if fmt & WIDE_LENGTHS else "B"
+    htype = "H" if fmt & WIDE_HANDS else "B"
+    hstart = start + npos * (2 if ltype == "H" else 1)
+    nhands = (len(blob) - hstart) // (2 if htype == "H" else 1)
+    return fmt, codes, (start, npos, ltype), (hstart, nhands, htype)
+
+def decode(blob):
+    """Returns (codes, hands per possession, hands) of a blob, the last two
+    as arrays of ints. A hand is code index * 16 + flags."""
+    blob = bytes(blob)
+    fmt, codes, (lstart, npos, ltype), (hstart, nhands, htype) = layout(blob)
+    lengths = _array(ltype, blob[lstart:hstart])
+    hands = _array(htype, blob[hstart:])
+    return codes, lengths, hands
+
+def decode_text(blob):
+    """Returns the pass string of a blob"""
+    fmt = bytearray(blob[2:3])[0]
+    codes, lengths, hands = decode(blob)
+    marks = suffixes()
+    names = [codes[v >> 4] + marks[v & 15] for v in hands]
+    lines, i = [], 0
+    for n in lengths:
+        lines.append("-".join(names[i:i + n]))
+        i += n
+    if fmt & UNTERMINATED:
+        return "\n".join(lines)
+    return "".join(line + "\n" for line in lines)
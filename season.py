@@ -0,0 +1,103 @@
+"""
+Season analysis of all the stored pass strings across CPU cores.
+
+The passes table is streamed in chunks of rows. Each chunk is analysed in a
+worker process into partial per (team_id, code) credit counters, and the
+partials are merged with an associative reduce. Chunks are merged in the
+order they were read and all merges are integer sums, so the result is the
+same as the serial analysis whatever the number of processes.
+
+    python season.py --db frisbee.db [-j 4] [--chunk 2000]
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import itertools
+import multiprocessing
+import time
+
+from frisbee import CREDITS, add_creds, count_creds
+import passcodec
+from gamedb import open_db, close_db, iter_passes, pass_text
+
+def iter_chunks(conn, size, team_id=None):
+    """Yields lists of up to `size` (team_id, pass_string) rows"""
+    rows = iter_passes(conn, team_id, raw=True)
+    while True:
+        # blobs are decoded by the workers, as bytes since py2 buffers
+        # can't be pickled
+        chunk = [(tid, bytes(pstr) if passcodec.is_encoded(pstr) else pstr)
+                for tid, pstr in itertools.islice(rows, size)]
+        if not chunk:
+            return
+        yield chunk
+
+def analyse_chunk(rows):
+    """Returns the credit counters of a chunk of (team_id, pass_string) rows,
+    keyed by (team_id, code)"""
+    return count_creds((tid, pass_text(pstr)) for tid, pstr in rows)
+
+def merge(total, partial):
+    """Adds partial counters into total and returns it"""
+    for (tid, code), cred in partial.items():
+        add_creds(total, tid, {code: cred})
+    return total
+
+def analyse_season(conn, processes=None, chunk=2000, team_id=None):
+    """Returns the season credits of every player as {(team_id, code): cred}.
+    processes=1 analyses serially, None uses all the cores."""
+    total = {}
+    chunks = iter_chunks(conn, chunk, team_id)
+    if processes == 1:
+        for rows in chunks:
+            merge(total, analyse_chunk(rows))
+        return total
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        # The chunks are read here, since the connection belongs to this
+        # thread, with a bounded number of them waiting in the pool
+        pending = collections.deque()
+        for rows in chunks:
+            pending.append(pool.apply_async(analyse_chunk, (rows,)))
+            if len(pending) >= 2 * processes:
+                merge(total, pending.popleft().get())
+        while pending:
+            merge(total, pending.popleft().get())
+    finally:
+        pool.close()
+        pool.join()
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a whole season")
+    parser.add_argument("--db", default="frisbee.db")
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    parser.add_argument("--chunk", type=int, default=2000,
+            help="pass strings per worker task")
+    parser.add_argument("--speedup", action="store_true",
+            help="compare the run time against the serial analysis")
+    args = parser.parse_args()
+
+    conn = open_db(args.db)
+    start = time.time()
+    total = analyse_season(conn, args.processes, args.chunk)
+    elapsed = time.time() - start
+    if args.speedup:
+        start = time.time()
+        serial = analyse_season(conn, 1, args.chunk)
+        serial_time = time.time() - start
+        assert serial == total
+    close_db(conn)
+
+    print("%-8s %-6s %s" % ("team", "code", " ".join("%6s" % k for k in CREDITS)))
+    for (tid, code), cred in sorted(total.items()):
+        print("%-8s %-6s %s" % (tid, code,
+            " ".join("%6d" % cred[k] for k in CREDITS)))
+    print("Analysed in %.3f s" % elapsed)
+    if args.speedup:
+        print("Serial %.3f s, speedup %.2fx" % (serial_time, serial_time / elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Read only HTTP API over the stats in the db, built on asyncio (Python 3).
+
+    python server.py --db frisbee.db --port 8000
+
+Routes (all GET, JSON responses):
+
+    /teams                      league standings
+    /teams/<id>                 team_stats
+    /players/<id>               player_stats
+    /games/<id>/passes          game_string
+    /games/<id>/analysis        analyse_game_string of each team's passes
+    /leaders/<kind>/<stat>[/<span>]
+                                top 10 players or teams by a leaderboard stat
+
+The blocking sqlite3 calls run on a bounded thread pool, each thread using
+its connection from gamedb.get_pool(). Identical requests arriving while one
+is being answered share its result. Responses are cached with an ETag until
+the db files change, so repeated requests neither touch SQLite nor, with
+If-None-Match, resend the body.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+
+import gamedb
+import leaderboard
+from frisbee import analyse_game_string
+
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request",
+        404: "Not Found", 405: "Method Not Allowed",
+        500: "Internal Server Error"}
+
+class NotFound(Exception):
+    pass
+
+def _team(conn, tid):
+    try:
+        return gamedb.team_stats(conn, int(tid))
+    except AttributeError:  # no such row
+        raise NotFound()
+
+def _player(conn, pid):
+    try:
+        return gamedb.player_stats(conn, int(pid))
+    except AttributeError:
+        raise NotFound()
+
+def _passes(conn, gid):
+    passes = gamedb.game_string(conn, int(gid))
+    if not passes:
+        raise NotFound()
+    return passes
+
+def _analysis(conn, gid):
+    return dict((str(p["team_id"]), analyse_game_string(p["pass_string"]))
+            for p in _passes(conn, gid))
+
+def _leaders(conn, kind, stat, span=None):
+    try:
+        rows = leaderboard.top(conn, stat, 10, int(span or 0), kind == "teams")
+    except ValueError:
+        raise NotFound()
+    return [{"team_id": tid, "p_code": code, "value": value}
+            for tid, code, value in rows]
+
+ROUTES = [
+    (re.compile(r"^/teams/?$"), lambda conn: gamedb.standings(conn)),
+    (re.compile(r"^/teams/(\d+)$"), _team),
+    (re.compile(r"^/players/(\d+)$"), _player),
+    (re.compile(r"^/games/(\d+)/passes$"), _passes),
+    (re.compile(r"^/games/(\d+)/analysis$"), _analysis),
+    (re.compile(r"^/leaders/(players|teams)/(\w+)(?:/(\d+))?$"), _leaders),
+]
+
+class StatsService:
+    """Answers the routes, coalescing and caching the db work"""
+    def __init__(self, dbname="frisbee.db", workers=8, loop=None):
+        self.dbname = dbname
+        self.pool = gamedb.get_pool(dbname)
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.loop = loop
+        self._inflight = {}
+        self._cache = {}
+        self._version = None
+        self.queries = 0
+        # Switching to WAL writes to the db and the first read creates the
+        # log, do both before any versioning
+        self.pool.connection().execute("SELECT COUNT(*) FROM teams").fetchone()
+
+    def version(self):
+        """Changes whenever the db or its write ahead log is written to"""
+        stamp = []
+        for path in (self.dbname, self.dbname + "-wal"):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _run(self, func, args):
+        """Runs a route on a pool thread. Returns (status, body)"""
+        self.queries += 1
+        try:
+            data = func(self.pool.connection(), *args)
+        except NotFound:
+            return 404, b'{"error": "not found"}'
+        return 200, json.dumps(data, sort_keys=True).encode("utf-8")
+
+    def get(self, path):
+        """Returns a future of (status, etag, body) for a path"""
+        loop = self.loop or asyncio.get_event_loop()
+        for pattern, func in ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            future = loop.create_future()
+            future.set_result((404, None, b'{"error": "not found"}'))
+            return future
+
+        version = self.version()
+        if version != self._version:
+            # gamedb's own caches can't tell that another process wrote
+            gamedb.invalidate_standings()
+            self._version = version
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == version:
+            future = loop.create_future()
+            future.set_result(cached[1])
+            return future
+
+        key = (path, version)
+        future = self._inflight.get(key)
+        if future is None:
+            future = loop.create_future()
+            self._inflight[key] = future
+            work = loop.run_in_executor(self.executor, self._run, func,
+                    match.groups())
+            work.add_done_callback(
+                    lambda work: self._done(key, future, work))
+        return future
+
+    def _done(self, key, future, work):
+        del self._inflight[key]
+        try:
+            status, body = work.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        result = (status, etag, body)
+        if status == 200:
+            self._cache[key[0]] = (key[1], result)
+        future.set_result(result)
+
+    def close(self):
+        self.executor.shutdown()
+
+class HTTPProtocol(asyncio.Protocol):
+    """A minimal HTTP/1.1 server connection with keep alive. Pipelined
+    requests are answered in order, one at a time."""
+    def __init__(self, service):
+        self.service = service
+        self.buffer = b""
+        self.busy = False
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def data_received(self, data):
+        self.buffer += data
+        if len(self.buffer) > 65536 and b"\r\n\r\n" not in self.buffer:
+            self.respond(400, None, b'{"error": "request too large"}', False)
+            return
+        self.next_request()
+
+    def next_request(self):
+        if self.busy or self.transport is None:
+            return
+        head, sep, rest = self.buffer.partition(b"\r\n\r\n")
+        if not sep:
+            return
+        self.buffer = rest
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        if len(parts) != 3:
+            self.respond(400, None, b'{"error": "bad request"}', False)
+            return
+        method, target, version = parts
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if version == "HTTP/1.0":
+            keep_alive = headers.get("connection", "").lower() == "keep-alive"
+        if method not in ("GET", "HEAD"):
+            self.respond(405, None, b'{"error": "method not allowed"}', keep_alive)
+            return
+
+        self.busy = True
+        future = self.service.get(target.split("?", 1)[0])
+        def reply(future):
+            self.busy = False
+            try:
+                status, etag, body = future.result()
+            except Exception:
+                status, etag, body = 500, None, b'{"error": "internal error"}'
+            if etag is not None and headers.get("if-none-match") == etag:
+                status, body = 304, b""
+            self.respond(status, etag, b"" if method == "HEAD" else body,
+                    keep_alive)
+            self.next_request()
+        future.add_done_callback(reply)
+
+    def respond(self, status, etag, body, keep_alive):
+        if self.transport is None:
+            return
+        head = ["HTTP/1.1 %d %s" % (status, STATUS[status]),
+                "Content-Type: application/json",
+                "Content-Length: %d" % len(body)]
+        if etag is not None:
+            head.append("ETag: %s" % etag)
+        if not keep_alive:
+            head.append("Connection: close")
+        self.transport.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+                + body)
+        if not keep_alive:
+            self.transport.close()
+            self.transport = None
+
+def start_server(service, host="127.0.0.1", port=8000, loop=None):
+    """Returns a future of the asyncio server answering with the service"""
+    loop = loop or asyncio.get_event_loop()
+    return loop.create_server(lambda: HTTPProtocol(service), host, port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Frisbee stats HTTP API")
+    parser.add_argument("--db", default="frisbee.db")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int,
+            default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=8,
+            help="threads running the db queries")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = StatsService(args.db, args.workers, loop)
+    server = loop.run_until_complete(
+            start_server(service, args.host, args.port, loop))
+    print("Serving %s on %s:%d" % (args.db, args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        service.close()
+        loop.close()
+
+if __name__ == "__main__":
+    main()
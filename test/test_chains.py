@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from frisbee import Passes, POINT
+from gamedb import createdb, add_pass_string, add_pass_strings
+from chains import *
+
+class ChainTestCase(unittest.TestCase):
+    """Tests the pass chain index"""
+    def setUp(self):
+        fd, self.dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.dbname)
+        createdb(self.dbname)
+        self.conn = sqlite3.connect(self.dbname)
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.dbname)
+
+    def test_iter_chains(self):
+        """Tests the chains and outcomes of a possession"""
+        self.assertListEqual(list(iter_chains("MAG-SAM-BHA(P)\nMAG*")),
+                [("MAG-SAM", 2, 0), ("SAM-BHA", 2, POINT),
+                    ("MAG-SAM-BHA", 3, POINT)])
+
+    def test_queries(self):
+        """Tests the index is updated by add_pass_string(s) and queried"""
+        add_pass_string(self.conn, Passes("MAG-SAM-BHA(P)\nMAG-SAM-BHA*\n", 1, 1))
+        add_pass_strings(self.conn, [Passes("MAG-SAM-BHA(P)\n", 2, 1),
+            Passes("MAG-SAM-BHA*\n", 2, 2)])
+        self.assertDictEqual(chain_outcomes(self.conn, "MAG-SAM-BHA"),
+                {"point": 2, "drop": 2, "foul": 0, "none": 0, "total": 4})
+        self.assertEqual(chain_outcomes(self.conn, "MAG-SAM-BHA", 2)["total"], 1)
+        self.assertListEqual(top_chains(self.conn, 3, "drop"),
+                [("MAG-SAM-BHA", 1, 1), ("MAG-SAM-BHA", 2, 1)])
+        self.assertListEqual(top_chains(self.conn, 2, "point", 1),
+                [("SAM-BHA", 1, 2)])
+
+    def test_rebuild(self):
+        """Tests rebuilding the index from the passes table"""
+        add_pass_string(self.conn, Passes("MAG-SAM(P)\n", 1, 1))
+        self.conn.execute("DELETE FROM chains")
+        rebuild_chains(self.conn)
+        self.assertEqual(chain_outcomes(self.conn, "MAG-SAM")["point"], 1)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
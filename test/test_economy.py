@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from economy import *
+
+def creds(catch=0, drop=0, throw=0, snatch=0, foul=0):
+    return dict(catch=catch, drop=drop, throw=throw, snatch=snatch, foul=foul)
+
+class EconomyTestCase(unittest.TestCase):
+    """Tests the contribution calculations"""
+    def test_theory_example(self):
+        """Tests the effectiveness example of THEORY.md"""
+        game = {"P1": creds(throw=1), "P2": creds(catch=1),
+                "P3": creds(drop=1), "P4": creds(snatch=1)}
+        codes, w, contrib = contribution(game, 1)
+        self.assertListEqual(codes, ["P1", "P2", "P3", "P4"])
+        np.testing.assert_allclose(w, [2/3., 1/3., -2/3., 1])
+        np.testing.assert_allclose(contrib, [0.5, 0.25, -0.5, 0.75])
+
+    def test_no_work(self):
+        """Tests that a game without work has no contribution"""
+        codes, w, contrib = contribution({"P1": creds(foul=1)}, 0)
+        np.testing.assert_allclose(contrib, [0])
+
+    def test_season(self):
+        """Tests that season totals are the sum of the game contributions"""
+        season = Season()
+        season.add_pass_string(1, "AAA-BBB(P)\nBBB*\n")
+        season.add_pass_string(1, "AAA-BBB-AAA(P)\n")
+        season.add_pass_string(2, "AAA*\n")
+        self.assertListEqual(sorted(season.keys), [(1, "AAA"), (1, "BBB"), (2, "AAA")])
+        expected = {}
+        for tid, gs, points in [(1, "AAA-BBB(P)\nBBB*\n", 1),
+                (1, "AAA-BBB-AAA(P)\n", 1), (2, "AAA*\n", 0)]:
+            codes, w, contrib = contribution(analyse_game_string(gs), points)
+            for code, c in zip(codes, contrib):
+                expected[(tid, code)] = expected.get((tid, code), 0) + c
+        keys, w, contrib = season.totals()
+        np.testing.assert_allclose(contrib, [expected[k] for k in keys])
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
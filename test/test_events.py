@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from frisbee import analyse_game_string, get_points, DROP, POINT
+from events import *
+
+class EventTableTestCase(unittest.TestCase):
+    """Tests building, querying and storing event tables"""
+    gs1 = "DHA-RIY*\nRIY-DHA*\nDHA(S)-RIY-SHE(P)\nDHA-SHE(F)\n"
+    gs2 = "MAG-SAM-BHA(P)\nMAG*\n"
+
+    def setUp(self):
+        builder = EventBuilder()
+        builder.add_pass_string(1, 10, self.gs1)
+        builder.add_pass_string(1, 20, self.gs2)
+        self.table = builder.build()
+
+    def test_columns(self):
+        """Tests the event rows of a possession"""
+        t = self.table.select(self.table.possession == 2)
+        self.assertListEqual([t.codes[i] for i in t.thrower], ["DHA", "RIY", "SHE"])
+        self.assertListEqual([t.codes[i] if i >= 0 else None for i in t.receiver],
+                ["RIY", "SHE", None])
+        self.assertListEqual(list(t.flags), [START | 4, 0, POINT])
+
+    def test_blobs(self):
+        """Tests that blobs give the same events as their pass strings"""
+        import passcodec
+        builder = EventBuilder()
+        builder.add_pass_blob(1, 10, passcodec.encode(self.gs1))
+        builder.add_stored([(1, 20, passcodec.encode(self.gs2)),
+            (2, 20, "AB*(S)\n"), (2, 10, passcodec.encode("CC-DD*\n")),
+            (3, 10, passcodec.encode(""))])
+        table = builder.build()
+        expected = EventBuilder()
+        expected.add_pass_string(1, 10, self.gs1)
+        expected.add_pass_string(1, 20, self.gs2)
+        expected.add_pass_string(2, 20, "AB*(S)\n")
+        expected.add_pass_string(2, 10, "CC-DD*\n")
+        expected = expected.build()
+        self.assertListEqual(table.codes, expected.codes)
+        for name, _ in COLUMNS:
+            self.assertListEqual(getattr(table, name).tolist(),
+                    getattr(expected, name).tolist())
+
+    def test_analysis(self):
+        """Tests that the analysis matches analyse_game_string()"""
+        for tid, gs in ((10, self.gs1), (20, self.gs2)):
+            t = self.table.select(self.table.team == tid)
+            self.assertDictEqual(t.analysis(), analyse_game_string(gs))
+            self.assertEqual(t.points(), get_points(gs))
+        for gs in ("-AAA-BBB\n", "-AAA(P)\n", "AAA--BBB*\n"):
+            builder = EventBuilder()
+            builder.add_pass_string(1, 1, gs)
+            self.assertDictEqual(builder.build().analysis(),
+                    analyse_game_string(gs))
+
+    def test_save_load(self):
+        """Tests the table survives a round trip through a file"""
+        fd, path = tempfile.mkstemp(suffix=".evt")
+        os.close(fd)
+        try:
+            self.table.save(path)
+            loaded = load(path)
+            self.assertListEqual(loaded.codes, self.table.codes)
+            for name, _ in COLUMNS:
+                np.testing.assert_array_equal(getattr(loaded, name),
+                        getattr(self.table, name))
+            self.assertDictEqual(loaded.analysis(), self.table.analysis())
+            del loaded
+        finally:
+            os.remove(path)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
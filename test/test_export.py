@@ -0,0 +1,70 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+import events
+from frisbee import createdb, add_team, import_games, pass_value
+from export import *
+from export import _column
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class ExportTestCase(unittest.TestCase):
+    """Tests the columnar export"""
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.tmp, "test.db")
+        createdb(self.dbname)
+        self.conn = sqlite3.connect(self.dbname)
+        for name in ("FIRE A", "FIRE B", "BULLET A", "BULLET B", "STARS A",
+                "STARS B", "TIGERS A", "TIGERS B"):
+            add_team(self.conn, name)
+        import_games(self.conn, sorted(os.path.join("games", g)
+            for g in os.listdir("games")), processes=1)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmp)
+
+    def test_npy(self):
+        """Tests the npy export maps back to the db rows in small batches"""
+        out = os.path.join(self.tmp, "out")
+        counts = export(self.conn, out, "npy", batch=3)
+        self.assertEqual(counts["passes"], 8)
+        passes = load(out, "passes")
+        self.assertIsInstance(passes["id"], np.memmap)
+        rows = self.conn.execute("SELECT pass_string, team_id FROM passes ORDER BY id").fetchall()
+        self.assertListEqual(passes["pass_string"].tolist(), [pass_text(r[0]) for r in rows])
+        self.assertListEqual(passes["team_id"].tolist(), [r[1] for r in rows])
+        teams = load(out, "teams")
+        self.assertListEqual(teams["name"].tolist()[:2], ["FIRE A", "FIRE B"])
+        # only the pass strings are decoded
+        blob = pass_value("AB-CD(P)\n")
+        self.assertListEqual(_column([blob, None], "text", pass_text),
+                ["AB-CD(P)\n", ""])
+        self.assertListEqual(_column([u"AB", None], "text"), [u"AB", u""])
+
+        table = events.events_from_db(self.conn)
+        exported = load(out, "events")
+        self.assertEqual(len(exported["flags"]), len(table))
+        for name, _ in events.COLUMNS:
+            np.testing.assert_array_equal(exported[name], getattr(table, name))
+        self.assertListEqual(load(out, "codes")["code"].tolist(), table.codes)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow isn't installed")
+    def test_parquet(self):
+        """Tests the parquet export"""
+        out = os.path.join(self.tmp, "out")
+        export(self.conn, out, "parquet", batch=3)
+        table = pyarrow.parquet.read_table(os.path.join(out, "passes.parquet"))
+        self.assertEqual(table.num_rows, 8)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
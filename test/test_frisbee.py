@@ -1,4 +1,8 @@
 import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
 
 from frisbee import *
 
@@ -78,6 +82,21 @@ class AnalysisTestCase(unittest.TestCase):
                 }
         self.assertDictEqual(analyse_game_string(gs), res)
 
+class TokenizerTestCase(unittest.TestCase):
+    """Tests for tokenize_hand() and iter_hands()"""
+    def test_tokenize_hand(self):
+        """Test the code and flags of a hand"""
+        self.assertEqual(tokenize_hand("PL1"), ("PL1", 0))
+        self.assertEqual(tokenize_hand("PL1(S)*"), ("PL1", SNATCH | DROP))
+        self.assertEqual(tokenize_hand("PL1(F)"), ("PL1", FOUL))
+        self.assertEqual(tokenize_hand("PL1(P)"), ("PL1", POINT))
+
+    def test_iter_hands(self):
+        """Test the hands yielded for a multiline string"""
+        gs = "PL1-PL2(P)\n\nPL3*\n"
+        self.assertListEqual(list(iter_hands(gs)),
+                [(0, "PL1", 0), (1, "PL2", POINT), (0, "PL3", DROP)])
+
 class PointsTestCase(unittest.TestCase):
     """Check whether the points are calculated correctly"""
     def test_point_count(self):
@@ -97,6 +116,10 @@ class ParserTestCase(unittest.TestCase):
         with self.assertRaises(ParsingError):
             parse_gamefile("test/data/1team_game.txt")
 
+    def test_error_message(self):
+        """Tests that a ParsingError prints its message"""
+        self.assertEqual(str(ParsingError("Empty file")), "Empty file")
+
     def test_is_parsing_correct(self):
         """Tests whether the function returns the expected result after parsing"""
         resp = parse_gamefile("test/data/full_game.txt")
@@ -107,5 +130,113 @@ class ParserTestCase(unittest.TestCase):
                 }
         self.assertDictEqual(resp, data)
 
+class GameBlockTestCase(unittest.TestCase):
+    """Tests for the streaming iter_gameblocks()"""
+    def test_blocks(self):
+        """Tests the blocks yielded, with and without a trailing blank line"""
+        lines = ["TEAM1: A\n", "AB-CD(P)\n", "EF*\n", "\n", "TEAM2: B\n", "GH(P)"]
+        blocks = list(iter_gameblocks(lines))
+        self.assertListEqual([b.name for b in blocks], ["A", "B"])
+        self.assertListEqual(blocks[0].possessions, ["AB-CD(P)", "EF*"])
+        self.assertListEqual([b.points for b in blocks], [1, 1])
+        self.assertEqual(blocks[1].string, "GH(P)\n")
+
+class ImportTestCase(unittest.TestCase):
+    """Tests for importing game sheets into a db"""
+    def setUp(self):
+        fd, self.dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.dbname)
+        createdb(self.dbname)
+        self.conn = sqlite3.connect(self.dbname)
+        add_team(self.conn, "Team A")
+        add_team(self.conn, "Team B")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.dbname)
+
+    def test_import_games(self):
+        """Test import_games() with a good and a bad sheet"""
+        files = ["test/data/full_game.txt", "test/data/1team_game.txt"]
+        result = import_games(self.conn, files, processes=2)
+        self.assertListEqual(result["skipped"], ["test/data/1team_game.txt"])
+        self.assertListEqual(result["imported"], ["test/data/full_game.txt"])
+        self.assertDictEqual(team_stats(self.conn, 2), {"id": 2,
+            "name": "Team B", "g_played": 1, "g_won": 1, "g_lost": 0,
+            "g_drawn": 0, "p_for": 1, "p_against": 0})
+        self.assertEqual(len(game_string(self.conn, 1)), 2)
+
+    def test_player_counters(self):
+        """Test the player counters after an import and a rebuild"""
+        import_games(self.conn, ["test/data/full_game.txt"])
+        sql = "SELECT catches, drops, throws, snatches, fouls FROM players WHERE team_id=? AND p_code=?"
+        self.assertTupleEqual(self.conn.execute(sql, (1, "JUS")).fetchone(), (0, 1, 1, 0, 0))
+        self.assertTupleEqual(self.conn.execute(sql, (2, "NIM")).fetchone(), (2, 1, 0, 0, 0))
+        self.conn.execute("UPDATE players SET drops = 100")
+        self.assertEqual(rebuild_player_stats(self.conn), 5)
+        self.assertTupleEqual(self.conn.execute(sql, (1, "JUS")).fetchone(), (0, 1, 1, 0, 0))
+
+    def test_resolve_game(self):
+        """Test resolve_game() maps the codes of a parsed game to player ids"""
+        import_games(self.conn, ["test/data/full_game.txt"])
+        game = parse_gamefile("test/data/full_game.txt")
+        game["string2"] += "XYZ(P)\n"
+        (t1, hands1), (t2, hands2) = resolve_game(self.conn, game)
+        self.assertEqual((t1, t2), (1, 2))
+        sql = "SELECT id FROM players WHERE team_id=? AND p_code=?"
+        jus = self.conn.execute(sql, (1, "JUS")).fetchone()[0]
+        self.assertEqual(hands1[0], (0, jus, DROP))
+        self.assertEqual(len(hands2), 5)
+        self.assertEqual(hands2[-1], (0, None, POINT))
+
+    def test_reimport(self):
+        """Test that unchanged sheets are skipped and changed ones replaced"""
+        tmp = tempfile.mkdtemp()
+        sheet = os.path.join(tmp, "game.txt")
+        cache = os.path.join(tmp, "cache")
+        try:
+            shutil.copy("test/data/full_game.txt", sheet)
+            import_games(self.conn, [sheet], cache_dir=cache)
+            self.assertListEqual(import_games(self.conn, [sheet])["unchanged"], [sheet])
+            # Same content, new mtime
+            os.utime(sheet, (0, 0))
+            self.assertListEqual(import_games(self.conn, [sheet])["unchanged"], [sheet])
+            # A copy of an imported sheet is a duplicate
+            copy = os.path.join(tmp, "copy.txt")
+            shutil.copy(sheet, copy)
+            self.assertListEqual(import_games(self.conn, [copy])["skipped"], [copy])
+            # Team A scores a point after all
+            with open(sheet) as f:
+                content = f.read().replace("JUS-KAJ*", "JUS-KAJ(P)")
+            with open(sheet, "w") as f:
+                f.write(content)
+            result = import_games(self.conn, [sheet], cache_dir=cache)
+            self.assertListEqual(result["replaced"], [sheet])
+            self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM games").fetchone()[0], 1)
+            self.assertEqual(draws(self.conn, 1), 1)
+            self.assertEqual(games_played(self.conn, 2), 1)
+            self.assertEqual(wins(self.conn, 2), 0)
+            sql = "SELECT catches, drops, throws FROM players WHERE team_id=1 AND p_code='KAJ'"
+            self.assertTupleEqual(self.conn.execute(sql).fetchone(), (1, 0, 0))
+            self.assertEqual(len(os.listdir(cache)), 2)
+            # Cached parses of another version aren't read
+            for name in os.listdir(cache):
+                with open(os.path.join(cache, name), "w") as f:
+                    f.write("[]")
+                os.rename(os.path.join(cache, name),
+                        os.path.join(cache, name.replace("-v%d" % CACHE_VERSION, "-v0")))
+            self.assertEqual(len(read_sheet(sheet, cache)[2]), 2)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_import_game_data(self):
+        """Test import_game_data() of a single sheet"""
+        self.conn.close()
+        import_game_data("test/data/full_game.txt", self.dbname)
+        self.conn = sqlite3.connect(self.dbname)
+        self.assertEqual(wins(self.conn, 2), 1)
+
 if __name__ == "__main__": # pragma: no cover
     unittest.main()
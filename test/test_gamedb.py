@@ -1,7 +1,10 @@
+import gc
 import unittest
 import os
 import os.path
 import sqlite3
+import threading
+import weakref
 from random import randint
 
 from frisbee import Player, Game, Passes
@@ -44,13 +47,15 @@ class AddDataTestCase(DBTestCase):
         self.c.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = [row[0] for row in self.c]
         # Assert the tables have been created
-        self.assertEqual(len(tables), 4,
-                msg="OMG! Where are the 4 tables we ordered. We have "
+        self.assertEqual(len(tables), 9,
+                msg="OMG! Where are the 9 tables we ordered. We have "
                 + str(len(tables))+"in "+self.dbname)
         self.assertTrue("teams" in tables)
         self.assertTrue("games" in tables)
         self.assertTrue("players" in tables)
         self.assertTrue("passes" in tables)
+        self.assertTrue("chains" in tables)
+        self.assertTrue("imports" in tables)
 
     def test_is_team_added(self):
         """Tests add_team()"""
@@ -77,7 +82,160 @@ class AddDataTestCase(DBTestCase):
         passes = Passes("MAK-SAM-DOP*", 0, 1)
         add_pass_string(self.conn, passes)
         self.c.execute("SELECT pass_string FROM passes WHERE game_id=0 AND team_id=1")
-        self.assertEqual(self.c.fetchone()[0], "MAK-SAM-DOP*")
+        self.assertEqual(pass_text(self.c.fetchone()[0]), "MAK-SAM-DOP*")
+
+    def test_passes_storage(self):
+        """Tests that pass strings are stored as blobs when they round trip"""
+        add_pass_strings(self.conn, [Passes("AB-CD(P)\nCD*\n", 0, 1),
+            Passes("AB*(S)\n", 0, 2)])
+        self.c.execute("SELECT typeof(pass_string) FROM passes ORDER BY id")
+        self.assertListEqual([r[0] for r in self.c], ["blob", "text"])
+        self.assertListEqual([g["pass_string"] for g in game_string(self.conn, 0)],
+                ["AB-CD(P)\nCD*\n", "AB*(S)\n"])
+
+class MigrationTestCase(unittest.TestCase):
+    """Tests for the schema migrations"""
+    def setUp(self):
+        self.dbname = "/tmp/test_migrate_"+str(randint(1,1000))+".db"
+        createdb(self.dbname, version=0)
+        self.conn = sqlite3.connect(self.dbname)
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.dbname)
+
+    def test_migrate(self):
+        """Tests migrating a version 0 db with data in it"""
+        self.conn.execute("INSERT INTO teams VALUES (NULL, 'Team A', 0, 0, 0, 0, 0, 0)")
+        self.conn.execute("INSERT INTO passes VALUES (NULL, 'AB-CD*\n', 1, 1)")
+        self.conn.commit()
+        self.assertEqual(schema_version(self.conn), 0)
+        self.assertEqual(migrate(self.conn), SCHEMA_VERSION)
+        self.assertEqual(schema_version(self.conn), SCHEMA_VERSION)
+        self.assertEqual(team_id(self.conn, "TEAM A"), 1)
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT id FROM teams WHERE name_key = ?", ("a",)).fetchall()
+        self.assertIn("idx_teams_name_key", str(plan))
+        # Pass strings are migrated to blobs
+        self.assertEqual(self.conn.execute("""SELECT COUNT(*) FROM passes
+                WHERE typeof(pass_string) = 'blob'""").fetchone()[0], 1)
+        self.assertEqual(game_string(self.conn, 1)[0]["pass_string"], "AB-CD*\n")
+        # Migrating again is a no-op
+        self.assertEqual(migrate(self.conn), SCHEMA_VERSION)
+
+    def test_old_schema_passes(self):
+        """Tests adding passes to dbs without the index tables"""
+        add_pass_string(self.conn, Passes("AB-CD*\n", 1, 1))
+        migrate(self.conn, 3)
+        add_pass_strings(self.conn, [Passes("AB-CD(P)\n", 2, 1)])
+        self.assertEqual(self.conn.execute(
+            "SELECT SUM(count) FROM chains").fetchone()[0], 2)
+
+    def test_old_schema_delete(self):
+        """Tests deleting games from a db without the import ledger"""
+        migrate(self.conn, 3)
+        t1 = add_team(self.conn, "team1")
+        t2 = add_team(self.conn, "team2")
+        gid = add_game(self.conn, Game(t1, t2, 1, 0))
+        add_pass_string(self.conn, Passes("AB-CD(P)\n", gid, t1))
+        self.assertListEqual(delete_games(self.conn, [gid]),
+                [(t1, "AB-CD(P)\n")])
+        self.assertEqual(self.conn.execute(
+            "SELECT COUNT(*) FROM chains").fetchone()[0], 0)
+        self.assertEqual(games_played(self.conn, t1), 0)
+
+    def test_passes_rollback(self):
+        """Tests that adding passes leaves the transaction open"""
+        migrate(self.conn)
+        self.conn.commit()
+        add_pass_string(self.conn, Passes("AB-CD*\n", 1, 1))
+        self.conn.rollback()
+        self.assertEqual(self.conn.execute(
+            "SELECT COUNT(*) FROM passes").fetchone()[0], 0)
+
+    def test_migrate_code_collisions(self):
+        """Tests migrating teammates who share a code"""
+        for name, tid in (("Sam", 1), ("Samuel", 1), ("Sam", 1), ("Sam", 2)):
+            self.conn.execute("""INSERT INTO players VALUES (NULL, ?, 'SAM', ?,
+                    0, 0, 0, 0, 0)""", (name, tid))
+        self.conn.commit()
+        self.assertEqual(migrate(self.conn), SCHEMA_VERSION)
+        self.assertListEqual(self.conn.execute("""SELECT team_id, p_code
+                FROM players ORDER BY id""").fetchall(),
+                [(1, "SAM"), (1, "SAU"), (1, "SA1"), (2, "SAM")])
+
+class PoolTestCase(DBTestCase):
+    """Tests for ConnectionPool"""
+    def setUp(self):
+        DBTestCase.setUp(self)
+        self.pool = ConnectionPool(self.dbname)
+
+    def tearDown(self):
+        self.pool.close()
+        DBTestCase.tearDown(self)
+
+    def test_connection_per_thread(self):
+        """Tests that a thread always gets its own connection"""
+        conn = self.pool.connection()
+        self.assertIs(conn, self.pool.connection())
+        other = []
+        t = threading.Thread(target=lambda: other.append(self.pool.connection()))
+        t.start()
+        t.join()
+        self.assertIsNot(conn, other[0])
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_session_commits_once(self):
+        """Tests that nested sessions commit at the outermost exit"""
+        with self.pool.session() as conn:
+            with self.pool.session() as inner:
+                add_team(inner, "team1")
+            self.c.execute("SELECT COUNT(*) FROM teams")
+            self.assertEqual(self.c.fetchone()[0], 0)
+            add_team(conn, "team2")
+        self.c.execute("SELECT COUNT(*) FROM teams")
+        self.assertEqual(self.c.fetchone()[0], 2)
+
+    def test_session_rollback(self):
+        """Tests that a failed session is rolled back"""
+        with self.assertRaises(ValueError):
+            with self.pool.session() as conn:
+                add_team(conn, "team1")
+                raise ValueError()
+        self.c.execute("SELECT COUNT(*) FROM teams")
+        self.assertEqual(self.c.fetchone()[0], 0)
+
+    def test_session_interrupted(self):
+        """Tests that sessions commit again after an interrupted one"""
+        with self.assertRaises(KeyboardInterrupt):
+            with self.pool.session() as conn:
+                add_team(conn, "team1")
+                raise KeyboardInterrupt()
+        with self.pool.session() as conn:
+            add_team(conn, "team2")
+        self.c.execute("SELECT name FROM teams")
+        self.assertListEqual(self.c.fetchall(), [("team2",)])
+
+    def test_row_factory_untouched(self):
+        """Tests that the stats functions don't change the connection"""
+        conn = self.pool.connection()
+        t1 = add_team(conn, "team1")
+        team_stats(conn, t1)
+        self.assertIsNone(conn.row_factory)
+
+class BulkAddTestCase(DBTestCase):
+    """Tests for the executemany based bulk functions"""
+    def test_add_games(self):
+        """Test add_games() and add_pass_strings()"""
+        t1 = add_team(self.conn, "team1")
+        t2 = add_team(self.conn, "team2")
+        self.assertEqual(standings(self.conn)[0]["g_played"], 0)
+        ids = add_games(self.conn, [Game(t1, t2, 2, 1), Game(t1, t2, 0, 0)])
+        self.assertEqual(standings(self.conn)[0]["g_played"], 2)
+        self.assertListEqual(ids, [1, 2])
+        add_pass_strings(self.conn, [Passes("A-B(P)", ids[0], t1)])
+        self.assertEqual(game_string(self.conn, ids[0])[0]["team_id"], t1)
+        self.c.execute("SELECT g_played, g_won, g_lost, g_drawn, p_for, p_against FROM teams ORDER BY id")
+        self.assertListEqual(self.c.fetchall(), [(2, 1, 0, 1, 2, 1), (2, 0, 1, 1, 1, 2)])
 
 class TeamDBTestCase(DBTestCase):
     """Test case to test Team Specific wrapper functions"""
@@ -159,6 +317,73 @@ class TeamDBTestCase(DBTestCase):
             "id" : t2
             }, team_stats(self.conn, t2))
 
+class StandingsTestCase(DBTestCase):
+    """Tests for standings()"""
+    def test_standings(self):
+        """Tests the order of the league table and its cache"""
+        conn = open_db(self.dbname)
+        t1, t2, t3 = [add_team(conn, n) for n in ("team1", "team2", "team3")]
+        add_game(conn, Game(t1, t2, 1, 3))
+        add_game(conn, Game(t2, t3, 1, 3))
+        add_game(conn, Game(t3, t1, 0, 2))
+        # Each team won once with a point difference of 0
+        self.assertListEqual([r["id"] for r in standings(conn)], [t1, t2, t3])
+        table = standings(conn)
+        self.assertEqual(table[0]["rank"], 1)
+        self.assertEqual(table[0]["p_diff"], 0)
+        # Cached until the next game
+        conn.execute("UPDATE teams SET g_won = 5 WHERE id=?", (t3,))
+        self.assertEqual(standings(conn)[0]["id"], t1)
+        add_game(conn, Game(t3, t2, 1, 0))
+        self.assertListEqual([r["id"] for r in standings(conn)], [t3, t1, t2])
+        # and the batched updates
+        played = lambda: dict((r["id"], r["g_played"]) for r in standings(conn))
+        add_games(conn, [Game(t1, t2, 0, 0)])
+        self.assertEqual(played()[t1], 3)
+        update_teams_scores(conn, [Game(t1, t2, 0, 0)], sign=-1)
+        self.assertEqual(played()[t1], 2)
+        conn.commit()
+        close_db(conn)
+
+    def test_standings_other_writer(self):
+        """Tests that games committed by another connection are seen"""
+        conn = open_db(self.dbname)
+        t1, t2 = [add_team(conn, n) for n in ("team1", "team2")]
+        conn.commit()
+        self.assertEqual(standings(conn)[0]["g_played"], 0)
+        # written behind gamedb's back, as another process would
+        self.conn.execute("UPDATE teams SET g_played = 1")
+        self.assertEqual(standings(conn)[0]["g_played"], 0)
+        self.conn.commit()
+        self.assertEqual(standings(conn)[0]["g_played"], 1)
+        # The cache doesn't keep the connection alive
+        ref = weakref.ref(conn)
+        close_db(conn)
+        del conn
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_standings_rollback(self):
+        """Tests that the standings leave the transaction open"""
+        conn = open_db(self.dbname)
+        try:
+            add_team(conn, "team1")
+            self.assertEqual(len(standings(conn)), 1)
+            conn.rollback()
+            self.assertListEqual(standings(conn), [])
+        finally:
+            close_db(conn)
+
+    def test_head_to_head(self):
+        """Tests that head to head breaks ties"""
+        t1, t2, t3, t4 = [add_team(self.conn, "team%d" % i) for i in range(1, 5)]
+        add_game(self.conn, Game(t1, t2, 2, 0))
+        add_game(self.conn, Game(t1, t3, 1, 0))
+        add_game(self.conn, Game(t3, t2, 1, 0))
+        add_game(self.conn, Game(t2, t4, 3, 0))
+        # team2 and team3 have 1 win and no point difference each
+        self.assertListEqual([r["id"] for r in standings(self.conn)], [t1, t3, t2, t4])
+
 class PlayerDBTestCase(DBTestCase):
     """Tests for the player related functions"""
     def test_count_of_players(self):
@@ -168,8 +393,81 @@ class PlayerDBTestCase(DBTestCase):
         self.assertEqual( player_count(self.conn, 0), 3)
         self.assertEqual( player_count(self.conn, 1), 2)
 
+    def test_update_player_counts(self):
+        """Tests update_player_counts() adds to existing players"""
+        pid = add_player(self.conn, Player("Sam", 1))
+        cred = {"catch": 1, "drop": 0, "throw": 2, "snatch": 0, "foul": 1}
+        update_player_counts(self.conn, {(1, "SAM"): cred, (1, "NEW"): cred})
+        update_player_counts(self.conn, {(1, "SAM"): cred})
+        stats = player_stats(self.conn, pid)
+        self.assertEqual((stats["catches"], stats["throws"], stats["fouls"]), (2, 4, 2))
+        self.assertEqual(player_count(self.conn, 1), 2)
+
+    def test_code_collisions(self):
+        """Tests that teammates with the same code get distinct ones"""
+        sam, samuel = Player("Sam", 1), Player("Samuel", 1)
+        ids = [add_player(self.conn, p) for p in (sam, samuel, Player("Sam", 2))]
+        self.assertEqual((sam.code, samuel.code), ("SAM", "SAU"))
+        self.assertEqual(player_code("Sam", ["SAM"]), "SA1")
+        self.assertEqual(player_code("Samu", ["SAM", "SAU"]), "SA1")
+        self.assertDictEqual(player_ids(self.conn),
+                {(1, "SAM"): ids[0], (1, "SAU"): ids[1], (2, "SAM"): ids[2]})
+
+    def test_player_ids_cache(self):
+        """Tests that the player ids are reloaded after a player is added"""
+        pid = add_player(self.conn, Player("Sam", 1))
+        self.assertListEqual(resolve_players(self.conn, 1, ["SAM", "BOB"]),
+                [pid, None])
+        bob = add_player(self.conn, Player("Bob", 1))
+        cred = dict.fromkeys(["catch", "drop", "throw", "snatch", "foul"], 0)
+        update_player_counts(self.conn, {(1, "NEW"): cred})
+        self.assertListEqual(resolve_players(self.conn, 1, ["SAM", "BOB"]),
+                [pid, bob])
+        self.assertTrue((1, "NEW") in player_ids(self.conn))
+
+    def test_player_ids_other_writer(self):
+        """Tests that players committed by another connection are seen"""
+        conn = open_db(self.dbname)
+        try:
+            pid = add_player(conn, Player("Sam", 1))
+            conn.commit()
+            self.assertDictEqual(player_ids(conn), {(1, "SAM"): pid})
+            self.conn.execute("""INSERT INTO players VALUES (NULL, 'Bob', 'BOB',
+                    1, 0, 0, 0, 0, 0)""")
+            self.conn.commit()
+            self.assertTrue((1, "BOB") in player_ids(conn))
+        finally:
+            close_db(conn)
+
+    def test_placeholder_player(self):
+        """Tests that a player takes over the placeholder of its code"""
+        cred = {"catch": 1, "drop": 0, "throw": 2, "snatch": 0, "foul": 1}
+        update_player_counts(self.conn, {(1, "JUS"): cred})
+        justin = Player("Justin", 1)
+        pid = add_player(self.conn, justin)
+        self.assertEqual(justin.code, "JUS")
+        self.assertEqual(player_count(self.conn, 1), 1)
+        stats = player_stats(self.conn, pid)
+        self.assertEqual((stats["name"], stats["throws"]), ("Justin", 2))
+        # a named player keeps the code
+        justus = Player("Justus", 1)
+        add_player(self.conn, justus)
+        self.assertEqual(justus.code, "JUT")
+        self.assertEqual(player_ids(self.conn)[(1, "JUS")], pid)
+
 class GameDBTestCase(DBTestCase):
     """Tests realted to functions dealing with games"""
+    def test_iter_passes(self):
+        """Tests streaming the stored pass strings"""
+        p1 = Passes("HE-SHE-IT-THEY*\n", 1, 1)
+        p2 = Passes("I-YOU-WE*\n", 1, 2)
+        add_pass_strings(self.conn, [p1, p2])
+        self.assertListEqual(list(iter_passes(self.conn)),
+                [(1, p1.string), (2, p2.string)])
+        self.assertListEqual(list(iter_passes(self.conn, 2)), [(2, p2.string)])
+        self.assertEqual(pass_text(next(iter_passes(self.conn, raw=True))[1]),
+                p1.string)
+
     def test_is_game_string(self):
         """Test game_string()"""
         p1 = Passes("HE-SHE-IT-THEY*", 0, 1)
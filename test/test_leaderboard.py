@@ -0,0 +1,125 @@
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from frisbee import Game, Passes, analyse_game_string, get_points
+from gamedb import createdb, add_team, add_games, add_pass_strings, delete_games
+from leaderboard import *
+
+def random_string(rng, codes):
+    lines = []
+    for _ in range(rng.randint(1, 6)):
+        hands = [rng.choice(codes) for _ in range(rng.randint(1, 4))]
+        lines.append("-".join(hands) + rng.choice(["", "*", "(F)", "(P)"]))
+    return "\n".join(lines) + "\n"
+
+class LeaderboardTestCase(unittest.TestCase):
+    """Tests the rolling totals and the leaderboard queries"""
+    def setUp(self):
+        fd, self.dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.dbname)
+        createdb(self.dbname)
+        self.conn = sqlite3.connect(self.dbname)
+        self.teams = [add_team(self.conn, name) for name in ("A", "B", "C")]
+        self.games = []  # (game_id, team_id, pass string, points, conceded)
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.dbname)
+
+    def play(self, rng, n):
+        """Stores n random games, in batches of up to 4"""
+        while n > 0:
+            batch = []
+            for _ in range(min(n, rng.randint(1, 4))):
+                t1, t2 = rng.sample(self.teams, 2)
+                s1 = random_string(rng, ["P%d%d" % (t1, i) for i in range(6)])
+                s2 = random_string(rng, ["P%d%d" % (t2, i) for i in range(6)])
+                batch.append((Game(t1, t2, get_points(s1), get_points(s2)), s1, s2))
+            ids = add_games(self.conn, [g for g, _, _ in batch])
+            passes = []
+            for gid, (g, s1, s2) in zip(ids, batch):
+                passes.extend([Passes(s1, gid, g.team1_id), Passes(s2, gid, g.team2_id)])
+                self.games.append((gid, g.team1_id, s1, g.point1, g.point2))
+                self.games.append((gid, g.team2_id, s2, g.point2, g.point1))
+            add_pass_strings(self.conn, passes)
+            n -= len(batch)
+
+    def expected(self, span):
+        """Totals of every (team_id, p_code) over their team's last span
+        games, computed from the whole history"""
+        totals = {}
+        for tid in self.teams:
+            games = [g for g in self.games if g[1] == tid]
+            for gid, _, string, points, conceded in games[-span if span else 0:]:
+                result = [1, int(points > conceded), int(points == conceded),
+                        int(points < conceded), points, conceded]
+                creds = analyse_game_string(string)
+                for code in list(creds) + [""]:
+                    if code:
+                        counts = [creds[code][k] for k in
+                                ("catch", "drop", "throw", "snatch", "foul")]
+                    else:
+                        counts = [sum(c[k] for c in creds.values()) for k in
+                                ("catch", "drop", "throw", "snatch", "foul")]
+                    total = totals.setdefault((tid, code), [0] * len(FIELDS))
+                    for i, v in enumerate(result + counts):
+                        total[i] += v
+        return totals
+
+    def stored(self, span):
+        c = self.conn.execute("""SELECT team_id, p_code, %s FROM leader_totals
+                WHERE span = ?""" % ", ".join(FIELDS), (span,))
+        return dict((row[:2], list(row[2:])) for row in c)
+
+    def test_incremental(self):
+        """Tests the sliding windows against sums over the whole history"""
+        self.play(random.Random(1), 40)
+        for span in SPANS:
+            self.assertDictEqual(self.stored(span), self.expected(span))
+        leaders = self.conn.execute("SELECT * FROM leaders ORDER BY 1, 2, 3, 5, 6").fetchall()
+        rebuild_leaderboards(self.conn)
+        self.assertListEqual(self.conn.execute(
+            "SELECT * FROM leaders ORDER BY 1, 2, 3, 5, 6").fetchall(), leaders)
+
+    def test_delete(self):
+        """Tests the windows after games are deleted"""
+        self.play(random.Random(2), 30)
+        deleted = [self.games[4][0], self.games[30][0]]
+        delete_games(self.conn, deleted)
+        self.games = [g for g in self.games if g[0] not in deleted]
+        self.play(random.Random(3), 5)
+        for span in SPANS:
+            self.assertDictEqual(self.stored(span), self.expected(span))
+
+    def test_top(self):
+        """Tests the order of the leaderboards"""
+        self.play(random.Random(4), 30)
+        for span in SPANS:
+            totals = self.expected(span)
+            values = sorted((t[FIELDS.index("throws")], tid, code)
+                    for (tid, code), t in totals.items() if code)
+            self.assertListEqual(top(self.conn, "throws", 5, span),
+                    [(tid, code, v) for v, tid, code in values[::-1][:5]])
+        rates = [v for _, _, v in top(self.conn, "drop_rate", 100, 5)]
+        self.assertListEqual(rates, sorted(rates))
+        self.assertTrue(all(code == "" for _, code, _ in
+            top(self.conn, "wins", span=10, teams=True)))
+        self.assertEqual(len(top(self.conn, "wins", teams=True)), 3)
+        self.assertRaises(ValueError, top, self.conn, "throws", span=3)
+
+    def test_plan(self):
+        """Tests that the top k is read from the index, without sorting"""
+        plan = str(self.conn.execute("""EXPLAIN QUERY PLAN
+                SELECT team_id, p_code, value FROM leaders
+                WHERE span = ? AND stat = ? AND is_team = ? AND value IS NOT NULL
+                ORDER BY value DESC, team_id DESC, p_code DESC LIMIT ?""",
+                (5, "throws", 0, 10)).fetchall())
+        self.assertIn("idx_leaders_top", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
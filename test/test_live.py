@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from frisbee import (analyse_game_string, iter_gamefile, add_team,
+        createdb, game_string, team_stats)
+from economy import contribution
+from live import *
+
+class LiveGameTestCase(unittest.TestCase):
+    """Tests ingesting a game hand by hand"""
+    def setUp(self):
+        self.blocks = list(iter_gamefile("games/game_1.txt"))
+        self.game = LiveGame(1, 2)
+        for tid, block in zip((1, 2), self.blocks):
+            for line in block.possessions:
+                hands = line.split("-")
+                for hand in hands:
+                    self.game.add_hand(tid, hand)
+                self.game.end_possession(tid)
+
+    def test_running_stats(self):
+        """Tests the live stats match the analysis of the whole sheet"""
+        for tid, block in zip((1, 2), self.blocks):
+            team = self.game.team(tid)
+            self.assertDictEqual(team.creds, analyse_game_string(block.string))
+            self.assertEqual(team.points, block.points)
+            self.assertEqual(team.string, block.string)
+            codes, w, contrib = contribution(team.creds, team.points)
+            for code, c in zip(codes, contrib):
+                self.assertAlmostEqual(team.contribution(code), c)
+        self.assertEqual(self.game.score, (0, 2))
+
+    def test_finalize(self):
+        """Tests the finalized game is stored like an import"""
+        fd, dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(dbname)
+        createdb(dbname)
+        conn = sqlite3.connect(dbname)
+        try:
+            add_team(conn, "FIRE B")
+            add_team(conn, "BULLET A")
+            gid = self.game.finalize(conn)
+            self.assertEqual(team_stats(conn, 2)["g_won"], 1)
+            self.assertListEqual([g["pass_string"] for g in game_string(conn, gid)],
+                    [b.string for b in self.blocks])
+            with self.assertRaises(ValueError):
+                self.game.add_hand(1, "DHA")
+        finally:
+            conn.close()
+            os.remove(dbname)
+
+    def test_line_marker(self):
+        """Tests that a marker before the end of a line is rejected"""
+        game = LiveGame(1, 2)
+        game.add_line(1, "MAG-SAM-BHA(P)")
+        for line in ("MAG*-SAM", "MAG-(P)-SAM", "MAG-SAM(F)-BHA(P)"):
+            with self.assertRaises(ValueError):
+                game.add_line(1, line)
+        self.assertEqual(game.team(1).string, "MAG-SAM-BHA(P)\n")
+        self.assertEqual(game.score, (1, 0))
+
+    def test_finalize_rollback(self):
+        """Tests that a failed finalize stores nothing"""
+        fd, dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(dbname)
+        createdb(dbname)
+        conn = sqlite3.connect(dbname)
+        try:
+            add_team(conn, "FIRE B")
+            add_team(conn, "BULLET A")
+            conn.commit()
+            conn.execute("DROP TABLE players")
+            with self.assertRaises(sqlite3.OperationalError):
+                self.game.finalize(conn)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM games").fetchone()[0], 0)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM passes").fetchone()[0], 0)
+            self.assertEqual(team_stats(conn, 2)["g_played"], 0)
+            self.assertIsNone(self.game.game_id)
+        finally:
+            conn.close()
+            os.remove(dbname)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
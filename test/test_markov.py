@@ -0,0 +1,61 @@
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+from events import EventBuilder
+from frisbee import CREDITS
+from markov import *
+
+class MarkovTestCase(unittest.TestCase):
+    """Tests fitting and simulating the possession chains"""
+    gs1 = "AAA-BBB(P)\nBBB-AAA*\nAAA(S)-BBB-CCC(P)\nCCC(F)\n"
+    gs2 = "DDD-EEE(P)\nDDD*\n"
+
+    def setUp(self):
+        builder = EventBuilder()
+        builder.add_pass_string(1, 10, self.gs1)
+        builder.add_pass_string(1, 20, self.gs2)
+        builder.add_pass_string(2, 20, self.gs2 + self.gs2)
+        self.models = fit(builder.build())
+
+    def test_fit(self):
+        """Tests the probabilities fitted from the passes"""
+        m = self.models[10]
+        self.assertListEqual(m.codes, ["AAA", "BBB", "CCC"])
+        np.testing.assert_allclose(m.start, [0.5, 0.25, 0.25])
+        np.testing.assert_allclose(m.snatch, [0.5, 0, 0])
+        np.testing.assert_allclose(m.transitions.sum(axis=1), 1)
+        # BBB passes to AAA and CCC once and scores once
+        np.testing.assert_allclose(m.transitions[1], [1/3, 0, 1/3, 0, 0, 0, 1/3])
+        self.assertListEqual(sorted(m.games.tolist()), [4])
+        self.assertListEqual(sorted(self.models[20].games.tolist()), [2, 4])
+
+    def test_expected_points(self):
+        """Tests the simulated points against the absorbing chain"""
+        for m in self.models.values():
+            ends, credits = simulate_possessions(m, 200000,
+                    np.random.RandomState(0))
+            self.assertAlmostEqual(np.mean(ends == SCORED), m.expected_points(),
+                    delta=0.005)
+            # every hand but the points is a throw, a drop or a foul
+            hands = sum(credits[:, CREDITS.index(key)].sum()
+                    for key in ("throw", "drop", "foul")) + np.sum(ends == SCORED)
+            self.assertAlmostEqual(hands / 200000, m.expected_visits().sum(),
+                    delta=0.02)
+
+    def test_match(self):
+        """Tests the match probabilities and their determinism"""
+        result = simulate_match(self.models[10], self.models[20], 20000, seed=1)
+        self.assertAlmostEqual(result["win"] + result["draw"] + result["loss"], 1)
+        self.assertDictEqual(result,
+                simulate_match(self.models[10], self.models[20], 20000, seed=1))
+        self.assertAlmostEqual(result["points"][0],
+                4 * self.models[10].expected_points(), places=1)
+        for tid, points in zip((10, 20), result["points"]):
+            contrib = sum(c for _, _, c in result["players"][tid])
+            self.assertAlmostEqual(contrib, points)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
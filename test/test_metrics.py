@@ -0,0 +1,85 @@
+import unittest
+import os
+import tempfile
+
+import frisbee
+import gamedb
+import metrics
+
+class MetricsTestCase(unittest.TestCase):
+    """Tests for the optional instrumentation"""
+    def setUp(self):
+        fd, self.dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.dbname)
+        gamedb.createdb(self.dbname)
+        conn = gamedb.open_db(self.dbname)
+        gamedb.add_team(conn, "Team A")
+        gamedb.add_team(conn, "Team B")
+        conn.commit()
+        conn.close()
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+        os.remove(self.dbname)
+
+    def test_disabled(self):
+        """Tests that nothing is wrapped or measured when disabled"""
+        original = gamedb.team_id
+        metrics.enable()
+        self.assertTrue(gamedb.team_id is not original)
+        self.assertTrue(frisbee.team_id is gamedb.team_id)
+        metrics.disable()
+        self.assertTrue(gamedb.team_id is original)
+        self.assertTrue(frisbee.team_id is original)
+        conn = gamedb.open_db(self.dbname)
+        gamedb.team_id(conn, "Team A")
+        conn.close()
+        self.assertDictEqual(metrics.snapshot(), {})
+
+    def test_operation(self):
+        """Tests the calls, queries and rows counted for an import"""
+        metrics.enable()
+        frisbee.import_game_data("test/data/full_game.txt", self.dbname)
+        conn = gamedb.open_db(self.dbname)
+        self.assertEqual(gamedb.team_id(conn, "team b"), 2)
+        conn.close()
+        stats = metrics.snapshot()
+        self.assertEqual(stats["gamedb.team_id"]["calls"], 1)
+        self.assertEqual(stats["gamedb.team_id"]["queries"], 1)
+        self.assertEqual(stats["gamedb.team_id"]["rows"], 1)
+        # the import and the leaderboards analyse both teams' passes
+        self.assertEqual(stats["frisbee.analyse_game_string"]["calls"], 4)
+        imported = stats["frisbee.import_game_data"]
+        self.assertEqual(imported["calls"], 1)
+        self.assertTrue(imported["queries"] >= stats["gamedb.add_games"]["queries"] > 0)
+        self.assertTrue(stats["gamedb.add_pass_strings"]["rows"] >= 2)
+
+    def test_slow_queries(self):
+        """Tests that slow queries are kept with their query plan"""
+        metrics.enable(slow=0)
+        try:
+            conn = gamedb.open_db(self.dbname)
+            gamedb.team_id(conn, "Team A")
+            conn.close()
+        finally:
+            metrics.threshold = 0.1
+        elapsed, sql, plan = metrics.slow_queries[-1]
+        self.assertTrue("FROM teams" in sql)
+        self.assertTrue("idx_teams_name_key" in plan)
+
+    def test_dump(self):
+        """Tests the Prometheus text format"""
+        metrics.enable()
+        conn = gamedb.open_db(self.dbname)
+        for _ in range(3):
+            gamedb.team_ids(conn)
+        conn.close()
+        lines = metrics.dump().splitlines()
+        self.assertTrue('frisbee_call_seconds_count{func="gamedb.team_ids"} 3' in lines)
+        self.assertTrue('frisbee_call_seconds_bucket{func="gamedb.team_ids",le="+Inf"} 3' in lines)
+        self.assertTrue('frisbee_call_rows_total{func="gamedb.team_ids"} 6' in lines)
+        self.assertTrue('frisbee_operation_queries_bucket{func="gamedb.team_ids",le="1"} 3' in lines)
+        self.assertTrue("frisbee_query_seconds_count 3" in lines)
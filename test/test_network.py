@@ -0,0 +1,133 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+import gamedb
+from frisbee import Passes
+from network import *
+
+class NetworkTestCase(unittest.TestCase):
+    """Tests the pass network matrices and analytics"""
+    gs = "MAG-SAM-BHA(P)\nMAG-SAM-BHA*\nSAM(S)-MAG-SAM(P)\nMAG*\n"
+
+    def setUp(self):
+        self.net = PassNetwork()
+        self.net.add_pass_string(1, self.gs, 1)
+        self.idx = dict((code, i) for i, (_, code) in enumerate(self.net.keys))
+
+    def test_matrices(self):
+        """Tests the completed, dropped and scoring pass counts"""
+        mag, sam, bha = self.idx["MAG"], self.idx["SAM"], self.idx["BHA"]
+        m = self.net.matrix("pass")
+        self.assertEqual(m[mag, sam], 3)
+        self.assertEqual(m[sam, bha], 1)
+        self.assertEqual(m[sam, mag], 1)
+        self.assertEqual(self.net.matrix("drop")[sam, bha], 1)
+        self.assertEqual(self.net.matrix("score").sum(), 2)
+        out, into = self.net.degrees()
+        self.assertEqual(out[mag], 3)
+        self.assertEqual(into[sam], 3)
+
+    def test_analytics(self):
+        """Tests chains, assists and centrality"""
+        self.assertEqual(self.net.top_chains(2, 1),
+                [(((1, "MAG"), (1, "SAM")), 3)])
+        self.assertEqual(self.net.assists()[0][2], 1)
+        rank = self.net.centrality()
+        self.assertAlmostEqual(rank.sum(), 1.0)
+        self.assertEqual(np.argmax(rank), self.idx["SAM"])
+
+    def test_save_load(self):
+        """Tests a round trip through a file"""
+        fd, path = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+        try:
+            self.net.save(path)
+            loaded = load(path)
+            self.assertListEqual(loaded.keys, self.net.keys)
+            self.assertEqual((loaded.matrix() != self.net.matrix()).nnz, 0)
+            self.assertEqual(loaded.top_chains(3), self.net.top_chains(3))
+        finally:
+            os.remove(path)
+
+    def test_compaction(self):
+        """Tests repeated edges are merged and removals cancel out"""
+        for _ in range(3):
+            self.net.add_pass_string(1, self.gs, 1)
+            self.net.remove_pass_string(1, self.gs, 1)
+        self.net.add_pass_string(1, "MAG-NEW\n", 1)
+        m = self.net.matrix()
+        self.assertEqual(m.nnz, 4)
+        self.assertEqual(m[self.idx["MAG"], self.idx["SAM"]], 3)
+        self.assertEqual(len(self.net._edges["pass"][0]), 0)
+        fd, path = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+        try:
+            self.net.save(path)
+            with np.load(path) as data:
+                self.assertEqual(len(data["pass_rows"]), 4)
+            self.assertEqual((load(path).matrix() != m).nnz, 0)
+        finally:
+            os.remove(path)
+
+    def test_listen(self):
+        """Tests the network follows the pass strings added to the db"""
+        net = PassNetwork(team_id=2)
+        listener = net.listen()
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(path)
+        try:
+            gamedb.createdb(path)
+            conn = sqlite3.connect(path)
+            gamedb.add_pass_strings(conn, [Passes("A-B(P)", 1, 2), Passes("C-D", 1, 3)])
+            conn.close()
+        finally:
+            gamedb.remove_pass_listener(listener)
+            os.remove(path)
+        self.assertListEqual(net.keys, [(2, "A"), (2, "B")])
+
+    def test_listen_replace(self):
+        """Tests a replaced sheet is taken back out of the network"""
+        from frisbee import import_games
+        tmp = tempfile.mkdtemp()
+        sheet = os.path.join(tmp, "game.txt")
+        path = os.path.join(tmp, "frisbee.db")
+        net = PassNetwork()
+        listener = net.listen()
+        try:
+            gamedb.createdb(path)
+            conn = sqlite3.connect(path)
+            gamedb.add_team(conn, "TEAM A")
+            gamedb.add_team(conn, "TEAM B")
+            shutil.copy("test/data/full_game.txt", sheet)
+            import_games(conn, [sheet], processes=1)
+            with open(sheet) as f:
+                content = f.read().replace("DAN-NIM*", "DAN-NIM-DAN*")
+            with open(sheet, "w") as f:
+                f.write(content)
+            os.utime(sheet, (0, 0))
+            self.assertEqual(len(import_games(conn, [sheet], processes=1)
+                ["replaced"]), 1)
+            conn.close()
+        finally:
+            gamedb.remove_pass_listener(listener)
+            shutil.rmtree(tmp)
+        idx = dict((key, i) for i, key in enumerate(net.keys))
+        dan, nim = idx[(2, "DAN")], idx[(2, "NIM")]
+        m = net.matrix("pass")
+        self.assertEqual(m[dan, nim], 2)
+        self.assertEqual(m[nim, dan], 0)
+        self.assertEqual(net.matrix("drop")[dan, nim], 0)
+        self.assertEqual(net.matrix("drop")[nim, dan], 1)
+        self.assertEqual(net.matrix("score")[dan, nim], 1)
+        self.assertEqual(dict(net.top_chains(2)),
+                {((2, "DAN"), (2, "NIM")): 2, ((2, "NIM"), (2, "DAN")): 1,
+                 ((1, "JUS"), (1, "KAJ")): 1})
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
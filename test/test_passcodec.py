@@ -0,0 +1,43 @@
+import unittest
+
+import frisbee
+from passcodec import *
+
+class CodecTestCase(unittest.TestCase):
+    """Tests for the pass string blobs"""
+    def test_round_trip(self):
+        """Tests that pass strings decode back to the same text"""
+        for gs in ["", "DHA*\n", "DHA-RIY*\nRIY-DHA\n", "SAM(S)-MAG-SAM(P)\n",
+                "PL1(S)*\nKIR(F)", "MAK-SAM-DOP*"]:
+            blob = encode(gs)
+            self.assertTrue(is_encoded(blob))
+            self.assertEqual(decode_text(blob), gs)
+
+    def test_no_exact_encoding(self):
+        """Tests that strings which wouldn't round trip are refused"""
+        for gs in ["AB*(S)\n", "AB-\n", "AB\n\nCD\n", "A(P)(P)\n", u"\xc9A*\n"]:
+            self.assertRaises(ValueError, encode, gs)
+        self.assertFalse(is_encoded("AB*\n"))
+
+    def test_decode(self):
+        """Tests the dictionary and the hands of a blob"""
+        codes, lengths, hands = decode(encode("AB-CD(P)\nCD(S)*\n"))
+        self.assertListEqual(codes, ["AB", "CD"])
+        self.assertListEqual(list(lengths), [2, 1])
+        self.assertListEqual(list(hands),
+                [0, 16 | frisbee.POINT, 16 | frisbee.SNATCH | frisbee.DROP])
+        self.assertLess(len(encode("AB-CD(P)\nCD(S)*\n")), 20)
+
+    def test_wide(self):
+        """Tests teams of more than 16 codes and very long possessions"""
+        gs = "-".join("P%02d" % (i % 40) for i in range(300)) + "*\n"
+        blob = encode(gs)
+        fmt = layout(blob)[0]
+        self.assertEqual(fmt & (WIDE_HANDS | WIDE_LENGTHS), WIDE_HANDS | WIDE_LENGTHS)
+        self.assertEqual(decode_text(blob), gs)
+
+    def test_markers(self):
+        """Tests that the markers are read back by frisbee"""
+        for flags, suffix in enumerate(suffixes()):
+            self.assertEqual(frisbee.tokenize_hand("PL1" + suffix), ("PL1", flags))
+        self.assertEqual(suffixes()[frisbee.SNATCH | frisbee.DROP], "(S)*")
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from frisbee import Passes, analyse_game_string, add_creds
+from gamedb import createdb, add_pass_strings
+from season import *
+
+class SeasonTestCase(unittest.TestCase):
+    """Tests the parallel season analysis"""
+    def setUp(self):
+        fd, self.dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.dbname)
+        createdb(self.dbname)
+        self.conn = sqlite3.connect(self.dbname)
+        self.passes = []
+        for name in sorted(os.listdir("games")):
+            with open(os.path.join("games", name)) as f:
+                for i, block in enumerate(f.read().split("\n\n")):
+                    lines = block.strip().split("\n")[1:]
+                    self.passes.append(Passes("\n".join(lines) + "\n", 1, i + 1))
+        add_pass_strings(self.conn, self.passes * 5)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.dbname)
+
+    def test_parallel_matches_serial(self):
+        """Tests that the parallel result equals the serial analysis"""
+        expected = {}
+        for p in self.passes * 5:
+            add_creds(expected, p.team_id, analyse_game_string(p.string))
+        self.assertDictEqual(analyse_season(self.conn, 1, chunk=3), expected)
+        self.assertDictEqual(analyse_season(self.conn, 2, chunk=3), expected)
+        team = analyse_season(self.conn, 2, chunk=3, team_id=2)
+        self.assertTrue(all(key[0] == 2 for key in team))
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
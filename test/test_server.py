@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import gamedb
+from frisbee import Game, Passes, Player
+
+if sys.version_info[0] >= 3:
+    import asyncio
+    import concurrent.futures
+    import http.client
+    from server import StatsService, start_server
+
+@unittest.skipIf(sys.version_info[0] < 3, "asyncio needs Python 3")
+class ServerTestCase(unittest.TestCase):
+    """Tests the HTTP API against a small db"""
+    def setUp(self):
+        fd, self.dbname = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.dbname)
+        gamedb.createdb(self.dbname)
+        conn = gamedb.open_db(self.dbname)
+        t1 = gamedb.add_team(conn, "team1")
+        t2 = gamedb.add_team(conn, "team2")
+        gid = gamedb.add_game(conn, Game(t1, t2, 1, 0))
+        gamedb.add_pass_string(conn, Passes("AAA-BBB(P)\n", gid, t1))
+        gamedb.add_pass_string(conn, Passes("CCC*\n", gid, t2))
+        gamedb.add_player(conn, Player("AAA", t1))
+        conn.commit()
+        conn.close()
+
+        self.loop = asyncio.new_event_loop()
+        self.service = StatsService(self.dbname, 2, self.loop)
+        self.server = self.loop.run_until_complete(
+                start_server(self.service, "127.0.0.1", 0, self.loop))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.client = http.client.HTTPConnection("127.0.0.1", self.port)
+
+    def tearDown(self):
+        self.client.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        self.service.close()
+        gamedb.get_pool(self.dbname).close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.dbname + suffix):
+                os.remove(self.dbname + suffix)
+
+    def get(self, path, headers={}):
+        self.client.request("GET", path, headers=headers)
+        response = self.client.getresponse()
+        return response, response.read()
+
+    def test_routes(self):
+        """Tests the status of every route"""
+        import json
+        response, body = self.get("/teams")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(body.decode())[0]["name"], "team1")
+        self.assertEqual(self.get("/teams/2")[0].status, 200)
+        self.assertEqual(self.get("/teams/9")[0].status, 404)
+        self.assertEqual(self.get("/players/1")[0].status, 200)
+        self.assertEqual(self.get("/games/1/passes")[0].status, 200)
+        response, body = self.get("/games/1/analysis")
+        self.assertEqual(json.loads(body.decode())["1"]["AAA"]["throw"], 1)
+        response, body = self.get("/leaders/players/throws")
+        self.assertEqual(json.loads(body.decode())[0]["p_code"], "AAA")
+        self.assertEqual(self.get("/leaders/teams/wins/5")[0].status, 200)
+        self.assertEqual(self.get("/leaders/teams/wins/3")[0].status, 404)
+        self.assertEqual(self.get("/nothing")[0].status, 404)
+
+    def test_etag(self):
+        """Tests that unchanged data is answered from the cache and with 304"""
+        response, _ = self.get("/teams/1")
+        etag = response.getheader("ETag")
+        queries = self.service.queries
+        response, body = self.get("/teams/1", {"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b"")
+        self.assertEqual(self.service.queries, queries)
+
+    def test_other_writer(self):
+        """Tests that /teams follows games added by another process"""
+        import json
+        self.assertEqual(json.loads(self.get("/teams")[1].decode())[0]["g_played"], 1)
+        # written behind gamedb's back, as another process would
+        conn = gamedb.open_db(self.dbname)
+        conn.execute("UPDATE teams SET g_played = g_played + 1")
+        conn.commit()
+        conn.close()
+        teams = json.loads(self.get("/teams")[1].decode())
+        self.assertEqual(teams[0]["g_played"], 2)
+        self.assertEqual(teams[0]["g_played"],
+                json.loads(self.get("/teams/1")[1].decode())["g_played"])
+
+    def test_coalescing(self):
+        """Tests that identical concurrent requests share one query"""
+        done = concurrent.futures.Future()
+        def start():
+            futures = [self.service.get("/games/1/analysis") for _ in range(10)]
+            asyncio.gather(*futures).add_done_callback(
+                    lambda f: done.set_result(f.result()))
+        self.loop.call_soon_threadsafe(start)
+        results = done.result(5)
+        self.assertEqual(len(set(r[2] for r in results)), 1)
+        self.assertEqual(self.service.queries, 1)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
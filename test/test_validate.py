@@ -0,0 +1,81 @@
+import unittest
+
+from validate import *
+
+class HandTestCase(unittest.TestCase):
+    """Tests for the errors of single possession lines"""
+    def errors(self, line):
+        return [column for column, _ in check_possession(line)]
+
+    def test_valid_lines(self):
+        """Tests that the lines of the THEORY.md grammar have no errors"""
+        for line in ["DHA*", "DHA-RIY", "SAM(S)-MAG-SAM(P)", "KIR(F)",
+                "PL1(S)*", "SPF1-SPF2-SPF1*"]:
+            self.assertListEqual(self.errors(line), [])
+            self.assertTrue(is_valid_block([line]))
+
+    def test_unknown_marker(self):
+        """Tests that a stray marker is reported at its column"""
+        self.assertListEqual(self.errors("ABC-DEF(X)"), [8])
+
+    def test_empty_hands(self):
+        """Tests for trailing, leading and double dashes"""
+        self.assertListEqual(self.errors("ABC-"), [5])
+        self.assertListEqual(self.errors("-ABC"), [1])
+        self.assertListEqual(self.errors("ABC--DEF"), [5])
+
+    def test_markers(self):
+        """Tests for repeated, conflicting and unterminated markers"""
+        self.assertListEqual(self.errors("ABC**"), [5])
+        self.assertListEqual(self.errors("ABC*(P)"), [5])
+        self.assertListEqual(self.errors("ABC(P"), [4])
+        self.assertListEqual(self.errors("(S)*"), [1])
+
+    def test_codes(self):
+        """Tests for lower case codes and stray characters"""
+        self.assertListEqual(self.errors("abc*"), [1])
+        self.assertListEqual(self.errors("AB C*"), [3])
+
+    def test_ending_marker(self):
+        """Tests that a drop, foul or point ends the possession"""
+        self.assertListEqual(self.errors("ABC*-DEF"), [5])
+        self.assertListEqual(self.errors("ABC(P)-DEF(F)"), [7])
+
+    def test_fast_check(self):
+        """Tests that the block check rejects the invalid lines"""
+        for line in ["ABC-", "ABC(S)(S)*", "ABC*(P)", "(F)", "ABC-(S)-DEF",
+                "abc", "A\0B", "ABC*-DEF"]:
+            self.assertFalse(is_valid_block(["DEF", line]))
+
+class SheetTestCase(unittest.TestCase):
+    """Tests for the errors of whole sheets"""
+    def test_valid_sheets(self):
+        """Tests that the sheets in games/ and full_game.txt are valid"""
+        self.assertListEqual(validate_sheet("test/data/full_game.txt"), [])
+        files = ["games/game_%d.txt" % i for i in range(1, 5)]
+        self.assertListEqual(validate_sheets(files, processes=1), [])
+
+    def test_all_errors(self):
+        """Tests that every error is reported with its line and column"""
+        lines = ["TEAM1: A\n", "AB(X)-CD-\n", "XY*-Z\n", "\n", "TEAM2:B\n",
+                "\n", "QQQ\n"]
+        errors = validate_lines(lines, "bad.txt")
+        self.assertListEqual([(e.line, e.column) for e in errors],
+                [(2, 3), (2, 10), (3, 4), (5, 7), (7, 1)])
+        self.assertEqual(str(errors[0]), "bad.txt:2:3: unknown marker '(X)'")
+
+    def test_team_count(self):
+        """Tests for sheets without two teams"""
+        self.assertEqual(len(validate_sheet("test/data/empty_game.txt")), 1)
+        self.assertEqual(len(validate_sheet("test/data/1team_game.txt")), 1)
+        lines = ["T1: A\n", "T2: B\n", "T3: C\n"]
+        self.assertEqual(validate_lines(lines)[0].line, 3)
+
+    def test_bulk(self):
+        """Tests that the pool reports the errors in the order of the files"""
+        files = ["test/data/empty_game.txt", "test/data/full_game.txt",
+                "test/data/1team_game.txt"]
+        errors = validate_sheets(files, processes=2)
+        self.assertListEqual([e.filename for e in errors],
+                [files[0], files[2]])
+        self.assertTrue(all(isinstance(e, ParsingError) for e in errors))
@@ -0,0 +1,213 @@
+"""
+Validating lexer for game sheets.
+
+A sheet is a list of team blocks (see THEORY.md). A block starts with a
+'TEAM1: NAME' line and is followed by one possession per line, ending with
+a blank line or the end of the file. A possession is a '-' separated list
+of hands and a hand is an upper case player code followed by its markers:
+'*' (drop), '(F)' (foul), '(S)' (snatch) and '(P)' (point). A drop, foul or
+point ends the possession, so only the last hand of a line may carry one.
+
+The lexer works on whole lines with str methods instead of regular
+expressions and does not stop at the first error: every error of a sheet is
+reported with its file, line and column in a single pass.
+
+    python validate.py games/ [-j 4]
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import sys
+
+from frisbee import DROP, FOUL, POINT, MARKERS, ParsingError, expand_sheets
+
+MARKER_FLAGS = dict(MARKERS)
+ENDING = DROP | FOUL | POINT
+
+class SheetError(ParsingError):
+    """An error at a line and column (both from 1) of a game sheet"""
+    def __init__(self, filename, line, column, message):
+        ParsingError.__init__(self, message)
+        # the arguments pickle the error back from the validating processes
+        self.args = (filename, line, column, message)
+        self.filename = filename
+        self.line = line
+        self.column = column
+
+    def __str__(self):
+        return "%s:%d:%d: %s" % (self.filename, self.line, self.column,
+                self.value)
+
+def check_hand(hand, last):
+    """Returns the (offset, message) errors of a hand. last tells whether
+    it is the last hand of its possession."""
+    if not hand:
+        return [(0, "missing player code")]
+    errors = []
+    stop = len(hand)
+    for ch in "*(":
+        i = hand.find(ch, 0, stop)
+        if i >= 0:
+            stop = i
+    code = hand[:stop]
+    if not code:
+        errors.append((0, "missing player code"))
+    elif not code.isalnum():
+        for i, ch in enumerate(code):
+            if not ch.isalnum():
+                errors.append((i, "unexpected %r in player code" % ch))
+                break
+    elif code != code.upper():
+        errors.append((0, "player code %r is not upper case" % code))
+
+    flags, i, end = 0, stop, len(hand)
+    while i < end:
+        if hand[i] == "*":
+            marker = "*"
+        elif hand[i] == "(":
+            close = hand.find(")", i)
+            if close < 0:
+                errors.append((i, "unterminated marker %r" % hand[i:]))
+                break
+            marker = hand[i:close + 1]
+        else:
+            errors.append((i, "unexpected %r after the markers" % hand[i]))
+            break
+        flag = MARKER_FLAGS.get(marker)
+        if flag is None:
+            errors.append((i, "unknown marker %r" % marker))
+        elif flags & flag:
+            errors.append((i, "repeated marker %r" % marker))
+        elif flag & ENDING and flags & ENDING:
+            errors.append((i, "marker %r conflicts with an earlier one" % marker))
+        else:
+            flags |= flag
+        i += len(marker)
+    if flags & ENDING and not last:
+        errors.append((len(hand), "possession continues after its last hand"))
+    return errors
+
+def is_valid_block(lines):
+    """Fast check of the possession lines of a block, made of a few C level
+    str methods over the whole block. Every block it accepts is valid, the
+    lines of a rejected one need check_possession()."""
+    text = "\n".join(lines) + "\n"
+    if "\0" in text:
+        return False
+    # the ending markers become a sentinel, so a marker before them is left
+    for marker in ("*\n", "(P)\n", "(F)\n"):
+        text = text.replace(marker, "\0\n")
+    if "*" in text or "(P)" in text or "(F)" in text:
+        return False
+    text = (text.replace("(S)-", "-").replace("(S)\0\n", "\0\n")
+            .replace("(S)\n", "\n"))
+    text = text.replace("\0", "")
+    return (text.replace("-", "").replace("\n", "").isalnum()
+            and text == text.upper() and text[0] not in "-\n" and "--" not in text
+            and "-\n" not in text and "\n-" not in text and "\n\n" not in text)
+
+def check_possession(line):
+    """Returns the (column, message) errors of a possession line"""
+    errors = []
+    hands = line.split("-")
+    last = len(hands) - 1
+    column = 1
+    for i, hand in enumerate(hands):
+        for offset, message in check_hand(hand, i == last):
+            errors.append((column + offset, message))
+        column += len(hand) + 1
+    return errors
+
+def check_block(lines, first, filename, errors):
+    """Adds the SheetErrors of the possession lines of a block, the first
+    of them being line number `first`, to errors"""
+    if is_valid_block(lines):
+        return
+    for lineno, line in enumerate(lines, first):
+        for column, message in check_possession(line):
+            errors.append(SheetError(filename, lineno, column, message))
+
+def check_header(line):
+    """Returns the (column, message) errors of a 'TEAM1: NAME' line"""
+    label, _, name = line.rpartition(":")
+    column = len(label) + 2
+    if not label.strip():
+        return [(1, "missing team label")]
+    if not name.strip():
+        return [(column, "missing team name")]
+    if not name[0].isspace():
+        return [(column, "expected a space after ':'")]
+    return []
+
+def validate_lines(lines, filename="<sheet>"):
+    """Returns the SheetErrors of the lines of a game sheet"""
+    errors = []
+    teams, block, lineno = 0, None, 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if ":" in line or not line.strip():
+            if block:
+                check_block(block, lineno - len(block), filename, errors)
+            block = None
+            if line.strip():
+                teams += 1
+                block = []
+                found = check_header(line)
+                if teams == 3:
+                    found.append((1, "more than two teams in the sheet"))
+                for column, message in found:
+                    errors.append(SheetError(filename, lineno, column, message))
+        elif block is None:
+            errors.append(SheetError(filename, lineno, 1,
+                "possession outside a team block"))
+        else:
+            block.append(line)
+    if block:
+        check_block(block, lineno + 1 - len(block), filename, errors)
+    if teams < 2:
+        errors.append(SheetError(filename, max(lineno, 1), 1,
+            "empty sheet" if not teams else "only one team in the sheet"))
+    return errors
+
+def validate_sheet(filename):
+    """Returns the SheetErrors of a game sheet file"""
+    with open(filename, "r") as f:
+        return validate_lines(f, filename)
+
+def validate_sheets(filenames, processes=None):
+    """Validates many game sheets in a pool of `processes` worker processes
+    (all cores by default, no pool when 1) and returns all their errors,
+    in the order of the files"""
+    if processes == 1 or len(filenames) < 2:
+        results = map(validate_sheet, filenames)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(validate_sheet, filenames, chunksize=64)
+    try:
+        return [error for found in results for error in found]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate game sheets")
+    parser.add_argument("sheets", nargs="+",
+            help="game sheet files, directories or glob patterns")
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    filenames = []
+    for pattern in args.sheets:
+        filenames.extend(expand_sheets(pattern))
+    errors = validate_sheets(filenames, args.processes)
+    for error in errors:
+        print(error)
+    print("%d errors in %d of %d game sheets" % (len(errors),
+        len(set(e.filename for e in errors)), len(filenames)), file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())